@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Compare rasterizing at 120 dpi and resizing with rasterizing at the width.
+
+For the test pdf and synthetic decks, pages are made into 640 px wide pngs
+both ways (PdfPages with fitToWidth off and on). Next to the time per page,
+the quality of either is reported as the root mean square difference to
+a reference, which is the page rasterized at four times the density and
+scaled down (lower is better).
+
+    python benchmarks/bench_fit_width.py --pages 100 --used 20
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticPdf
+from slidesimport.pdfpages import PdfPages
+from slidesimport.renderers import RENDERERS, getRenderer
+
+TEST_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'Veg-food-in-Japan.pdf')
+WIDTH = 640
+
+
+def reference(renderer, pdfFileName, pageNumber, img):
+    """Return the page supersampled 4x and scaled to the size of img."""
+    pageWidth, _ = renderer.getPageSize(pdfFileName, pageNumber)
+    density = 4 * 72.0 * WIDTH / pageWidth
+    ref = renderer.renderPage(pdfFileName, pageNumber, (density, density))
+    ref.resize(img.width, img.height)
+    return ref
+
+
+def measure(rendererName, pdfFileName, pageCount, usedPages):
+    step = max(1, pageCount // usedPages)
+    pages = list(range(1, pageCount + 1, step))[:usedPages]
+    renderer = getRenderer(rendererName)
+
+    result = {'renderer': rendererName, 'pdf': os.path.basename(pdfFileName), 'rendered': len(pages)}
+    for mode, fitToWidth in (('resize', False), ('fit', True)):
+        pdfPages = PdfPages(pdfFileName, lazy=True, maxLoadedPages=1, fitToWidth=fitToWidth,
+                            renderer=getRenderer(rendererName))
+        start = time.time()
+        imgs = [pdfPages.getPageAsPng(pageNumber, WIDTH) for pageNumber in pages]
+        result[mode + '_per_page_s'] = (time.time() - start) / len(pages)
+
+        error = 0.0
+        for pageNumber, img in zip(pages, imgs):
+            _, distortion = img.compare(reference(renderer, pdfFileName, pageNumber, img),
+                                        metric='root_mean_square')
+            error += distortion
+        result[mode + '_rmse'] = error / len(pages)
+
+    result['saved'] = 1 - result['fit_per_page_s'] / result['resize_per_page_s']
+    return result
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--pages', type=int, nargs='*', default=[100],
+                           help='Page counts of the synthetic decks.')
+    argParser.add_argument('--used', type=int, default=20,
+                           help='Number of pages rendered from each deck.')
+    argParser.add_argument('--renderers', nargs='*', default=['wand'], choices=sorted(RENDERERS),
+                           help='The renderers to measure with (default: wand).')
+    args = argParser.parse_args()
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    try:
+        decks = [(TEST_PDF, 31)]
+        for pageCount in args.pages:
+            pdfFileName = os.path.join(tmpDir, 'deck-{0}.pdf'.format(pageCount))
+            writeSyntheticPdf(pdfFileName, pageCount)
+            decks.append((pdfFileName, pageCount))
+
+        results = []
+        for pdfFileName, pageCount in decks:
+            for name in args.renderers:
+                results.append(measure(name, pdfFileName, pageCount, args.used))
+                print('{renderer:>9} {pdf:<22} resize={resize_per_page_s:6.3f}s/page '
+                      'fit={fit_per_page_s:6.3f}s/page saved={saved:4.0%} '
+                      'rmse resize={resize_rmse:.4f} fit={fit_rmse:.4f}'
+                      .format(**results[-1]), file=sys.stderr)
+    finally:
+        shutil.rmtree(tmpDir)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
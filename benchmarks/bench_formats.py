@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare the media formats of slide images in encoding time and size.
+
+The pages of the test pdf and of a synthetic deck are rasterized once (at
+the 640 px of the deck) and then encoded in every format below. Reported
+are the time to encode a slide and the total size of the images.
+
+    python benchmarks/bench_formats.py --pages 100 --used 30
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticPdf
+from slidesimport.pdfpages import PdfPages
+from slidesimport.mediaformat import MediaFormat
+from slidesimport.renderers import RENDERERS, getRenderer
+
+TEST_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'Veg-food-in-Japan.pdf')
+
+FORMATS = [MediaFormat('png'),
+           MediaFormat('png', compressionLevel=9),
+           MediaFormat('png', colors=64),
+           MediaFormat('png', colors=16, compressionLevel=9),
+           MediaFormat('jpeg', quality=85),
+           MediaFormat('jpeg', quality=60),
+           MediaFormat('webp', quality=85),
+           MediaFormat('webp', quality=60)]
+
+
+def measure(rendererName, pdfFileName, pageCount, usedPages):
+    step = max(1, pageCount // usedPages)
+    pages = list(range(1, pageCount + 1, step))[:usedPages]
+    pdfPages = PdfPages(pdfFileName, lazy=True, maxLoadedPages=1, renderer=getRenderer(rendererName))
+    slides = [pdfPages.getCroppedPage(pageNumber, [[0, 100], [0, 100]]) for pageNumber in pages]
+
+    results = []
+    for mediaFormat in FORMATS:
+        encoded = 0
+        start = time.time()
+        for slide in slides:
+            img = slide.clone()
+            encoded += len(mediaFormat.encode(img))
+            img.close()
+        results.append({'format': mediaFormat.getKey(),
+                        'pdf': os.path.basename(pdfFileName),
+                        'rendered': len(pages),
+                        'encode_per_slide_s': (time.time() - start) / len(pages),
+                        'bytes': encoded})
+    for slide in slides:
+        slide.close()
+
+    # Sizes relative to png at the ImageMagick defaults (the first format).
+    for result in results:
+        result['relative_size'] = float(result['bytes']) / results[0]['bytes']
+    return results
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--pages', type=int, nargs='*', default=[100],
+                           help='Page counts of the synthetic decks.')
+    argParser.add_argument('--used', type=int, default=30,
+                           help='Number of pages rendered from each deck.')
+    argParser.add_argument('--renderer', default='wand', choices=sorted(RENDERERS),
+                           help='The renderer to rasterize the pages with (default: wand).')
+    args = argParser.parse_args()
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    try:
+        decks = [(TEST_PDF, 31)]
+        for pageCount in args.pages:
+            pdfFileName = os.path.join(tmpDir, 'deck-{0}.pdf'.format(pageCount))
+            writeSyntheticPdf(pdfFileName, pageCount)
+            decks.append((pdfFileName, pageCount))
+
+        results = []
+        for pdfFileName, pageCount in decks:
+            for result in measure(args.renderer, pdfFileName, pageCount, args.used):
+                results.append(result)
+                print('{format:<12} {pdf:<22} encode={encode_per_slide_s:6.3f}s/slide '
+                      'size={bytes:>10} ({relative_size:4.0%} of png)'
+                      .format(**result), file=sys.stderr)
+    finally:
+        shutil.rmtree(tmpDir)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
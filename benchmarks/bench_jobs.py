@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Measure how slide rendering scales with the number of worker processes.
+
+A synthetic deck and matching notes are generated, and the full
+`slides2anki` run is timed for each value of --jobs. The deck files of all
+runs are compared to make sure they are byte-identical.
+
+    python benchmarks/bench_jobs.py --pages 400 --jobs 1 2 4 8 16
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticNotes, writeSyntheticPdf
+from slidesimport import slidesimport
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--pages', type=int, default=400,
+                           help='Number of pages (and noted slides) of the deck.')
+    argParser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8],
+                           help='Worker counts to measure.')
+    args = argParser.parse_args()
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    pdfFileName = os.path.join(tmpDir, 'deck.pdf')
+    notesFileName = os.path.join(tmpDir, 'notes.txt')
+    writeSyntheticPdf(pdfFileName, args.pages)
+    writeSyntheticNotes(notesFileName, args.pages)
+
+    results = []
+    deckContents = set()
+    for jobs in args.jobs:
+        profileDir = os.path.join(tmpDir, 'profile-{0}'.format(jobs))
+        os.makedirs(os.path.join(profileDir, 'collection.media'))
+        deckFileName = os.path.join(tmpDir, 'deck-{0}.txt'.format(jobs))
+
+        start = time.time()
+        slidesimport.run([notesFileName, pdfFileName, deckFileName,
+                          '-U', profileDir, '--jobs', str(jobs)])
+        elapsed = time.time() - start
+
+        with open(deckFileName, 'rb') as f:
+            deckContents.add(f.read())
+
+        results.append({'jobs': jobs,
+                        'pages': args.pages,
+                        'total_s': elapsed,
+                        'slides_per_s': args.pages / elapsed})
+        print('jobs={jobs:<3} total={total_s:7.2f}s {slides_per_s:7.1f} slides/s'
+              .format(**results[-1]), file=sys.stderr)
+
+    shutil.rmtree(tmpDir)
+
+    if len(deckContents) != 1:
+        print('Deck files differ between job counts!', file=sys.stderr)
+        sys.exit(1)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
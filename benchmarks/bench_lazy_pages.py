@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Compare eager and lazy rasterization in PdfPages.
+
+For every page count a synthetic deck is generated and a fixed number of
+pages is rendered, once with the eager (whole file) mode and once with the
+lazy (per page) mode. Each measurement runs in a fresh process so that the
+reported peak RSS belongs to that measurement only.
+
+    python benchmarks/bench_lazy_pages.py --pages 50 150 400 --used 40
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def peakRssKb():
+    """Peak resident set size of this process in KiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(pdfFileName, pageCount, usedPages, lazy):
+    """Render `usedPages` evenly spread pages and report time and memory."""
+    from slidesimport.pdfpages import PdfPages
+
+    step = max(1, pageCount // usedPages)
+    pages = list(range(1, pageCount + 1, step))[:usedPages]
+
+    start = time.time()
+    pdfPages = PdfPages(pdfFileName, lazy=lazy)
+    opened = time.time()
+    for pageNumber in pages:
+        pdfPages.getPageAsPng(pageNumber)
+    done = time.time()
+
+    return {'mode': 'lazy' if lazy else 'eager',
+            'pages': pageCount,
+            'rendered': len(pages),
+            'open_s': opened - start,
+            'total_s': done - start,
+            'peak_rss_kb': peakRssKb()}
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--pages', type=int, nargs='+', default=[50, 150, 400],
+                           help='Page counts of the synthetic decks.')
+    argParser.add_argument('--used', type=int, default=40,
+                           help='Number of pages rendered from each deck.')
+    argParser.add_argument('--single', nargs=3, metavar=('PDF', 'PAGES', 'MODE'),
+                           help=A.SUPPRESS)
+    args = argParser.parse_args()
+
+    if args.single:
+        pdfFileName, pageCount, mode = args.single
+        print(json.dumps(measure(pdfFileName, int(pageCount), args.used, mode == 'lazy')))
+        return
+
+    from synthetic import writeSyntheticPdf
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    results = []
+    for pageCount in args.pages:
+        pdfFileName = os.path.join(tmpDir, 'deck-{0}.pdf'.format(pageCount))
+        writeSyntheticPdf(pdfFileName, pageCount)
+        for mode in ('eager', 'lazy'):
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                           '--used', str(args.used),
+                                           '--single', pdfFileName, str(pageCount), mode])
+            result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+            results.append(result)
+            print('{mode:>5} pages={pages:<5} rendered={rendered:<4} '
+                  'open={open_s:7.2f}s total={total_s:7.2f}s peak_rss={peak_rss_kb} KiB'
+                  .format(**result), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Measure the throughput of the notes Parser on large synthetic notes.
+
+With --memory-slides the memory taken by the parsed slide cards is
+compared with that of the NotesAndCropsParsing dictionaries built from them.
+With --crop-lines the crops of that many crop-annotated lines are parsed
+with and without remembering the crops of the strings seen before.
+
+    python benchmarks/bench_parser.py --size-mb 1 4 16
+    python benchmarks/bench_parser.py --size-mb --memory-slides 50000
+    python benchmarks/bench_parser.py --size-mb --crop-lines 10000 100000
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticNotes
+from slidesimport.parser import Parser, CropParser
+
+
+def readSyntheticNotes(slideCount):
+    """Return synthetic notes for slideCount slides."""
+    fd, fileName = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        writeSyntheticNotes(fileName, slideCount)
+        with io.open(fileName, 'r') as f:
+            return f.read()
+    finally:
+        os.remove(fileName)
+
+
+def makeNotes(sizeMb):
+    """Return synthetic notes of roughly sizeMb megabytes."""
+    # Measure the size of a small sample to scale the slide count.
+    sampleSize = len(readSyntheticNotes(1000).encode('utf-8'))
+    return readSyntheticNotes(int(1000 * sizeMb * 1024 * 1024 / sampleSize) + 1)
+
+
+def measureMemory(slideCount):
+    """Return the bytes held by the slide cards and by the compatibility view."""
+    notes = readSyntheticNotes(slideCount)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    parser = Parser(io.StringIO(notes))
+    cardsBytes = tracemalloc.get_traced_memory()[0] - before
+    parser.getNotesAndCropsParsing()
+    viewBytes = tracemalloc.get_traced_memory()[0] - before - cardsBytes
+    tracemalloc.stop()
+
+    return {'slides': slideCount,
+            'cards_bytes': cardsBytes,
+            'compat_view_bytes': viewBytes,
+            'cards_bytes_per_slide': cardsBytes / float(slideCount),
+            'compat_view_bytes_per_slide': viewBytes / float(slideCount)}
+
+
+def measureCrops(lineCount, repeat):
+    """Return the time per line of parsing the crops of lineCount lines."""
+    presets = {'logo': [[80, 100], [0, 15]]}
+    cropStrings = ['tl', 'br', 'vmt', 't', '10-40,10:100', '25-75, 0-50', 'logo']
+    lines = [cropStrings[idx % len(cropStrings)] for idx in range(lineCount)]
+    result = {'crop_lines': lineCount}
+    for name, cacheSize in (('uncached', 0), ('cached', 4096)):
+        best = None
+        for _ in range(repeat):
+            cropParser = CropParser(presets, cacheSize=cacheSize)
+            start = time.time()
+            for cropString in lines:
+                cropParser.parse(cropString)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result[name + '_us_per_line'] = 1e6 * best / lineCount
+    return result
+
+
+def measure(notes, repeat):
+    """Return the best times out of `repeat` runs for parsing the notes into
+    slide cards and for building the NotesAndCropsParsing view from them."""
+    bestParse, bestView = None, None
+    for _ in range(repeat):
+        start = time.time()
+        parser = Parser(io.StringIO(notes))
+        parsed = time.time()
+        parser.getNotesAndCropsParsing()
+        done = time.time()
+        bestParse = parsed - start if bestParse is None else min(bestParse, parsed - start)
+        bestView = done - parsed if bestView is None else min(bestView, done - parsed)
+    return bestParse, bestView
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--size-mb', type=float, nargs='*', default=[1, 4, 16],
+                           help='Sizes of the synthetic notes files.')
+    argParser.add_argument('--repeat', type=int, default=3,
+                           help='Number of runs per size; the best is reported.')
+    argParser.add_argument('--memory-slides', type=int, nargs='*', default=[],
+                           help='Slide counts for which to measure memory.')
+    argParser.add_argument('--crop-lines', type=int, nargs='*', default=[],
+                           help='Numbers of crop-annotated lines for which to time crop parsing.')
+    args = argParser.parse_args()
+
+    results = []
+    for lineCount in args.crop_lines:
+        results.append(measureCrops(lineCount, args.repeat))
+        print('crop lines={crop_lines:<8} uncached={uncached_us_per_line:6.2f} us/line '
+              'cached={cached_us_per_line:6.2f} us/line'.format(**results[-1]), file=sys.stderr)
+
+    for slideCount in args.memory_slides:
+        results.append(measureMemory(slideCount))
+        print('slides={slides:<7} cards={cards_bytes_per_slide:7.1f} B/slide '
+              'compat view={compat_view_bytes_per_slide:7.1f} B/slide'.format(**results[-1]),
+              file=sys.stderr)
+
+    for sizeMb in args.size_mb:
+        notes = makeNotes(sizeMb)
+        elapsed, viewElapsed = measure(notes, args.repeat)
+        lines = notes.count('\n')
+        results.append({'size_mb': len(notes.encode('utf-8')) / (1024.0 * 1024.0),
+                        'lines': lines,
+                        'parse_s': elapsed,
+                        'compat_view_s': viewElapsed,
+                        'mb_per_s': len(notes.encode('utf-8')) / (1024.0 * 1024.0) / elapsed,
+                        'lines_per_s': lines / elapsed})
+        print('size={size_mb:6.1f}MB lines={lines:<9} parse={parse_s:6.2f}s view={compat_view_s:6.2f}s '
+              '{mb_per_s:6.2f} MB/s {lines_per_s:10.0f} lines/s'.format(**results[-1]),
+              file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
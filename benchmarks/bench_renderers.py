@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Compare the rasterization backends (see slidesimport/renderers.py).
+
+Every installed renderer rasterizes the same pages of the test pdf and of
+synthetic decks of the given page counts. Reported are the time to
+rasterize a page and the time to make the png of a whole slide from it
+(rasterize, resize and encode), per page.
+
+    python benchmarks/bench_renderers.py --pages 100 400 --used 30
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticPdf
+from slidesimport.pdfpages import PdfPages
+from slidesimport.renderers import RENDERERS, getRenderer
+
+TEST_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'Veg-food-in-Japan.pdf')
+
+
+def measure(name, pdfFileName, pageCount, usedPages):
+    """Render `usedPages` evenly spread pages with the named renderer."""
+    step = max(1, pageCount // usedPages)
+    pages = list(range(1, pageCount + 1, step))[:usedPages]
+
+    renderer = getRenderer(name)
+    start = time.time()
+    for pageNumber in pages:
+        renderer.renderPage(pdfFileName, pageNumber, (120, 120)).close()
+    rasterized = time.time()
+
+    pdfPages = PdfPages(pdfFileName, lazy=True, maxLoadedPages=1, renderer=getRenderer(name))
+    for pageNumber in pages:
+        pdfPages.getCroppedPageAsPng(pageNumber, [[0, 100], [0, 100]]).make_blob()
+    done = time.time()
+
+    return {'renderer': name,
+            'pdf': os.path.basename(pdfFileName),
+            'rendered': len(pages),
+            'rasterize_per_page_s': (rasterized - start) / len(pages),
+            'slide_per_page_s': (done - rasterized) / len(pages)}
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--pages', type=int, nargs='*', default=[100, 400],
+                           help='Page counts of the synthetic decks.')
+    argParser.add_argument('--used', type=int, default=30,
+                           help='Number of pages rendered from each deck.')
+    argParser.add_argument('--renderers', nargs='*', default=sorted(RENDERERS), choices=sorted(RENDERERS),
+                           help='The renderers to compare (default: all installed ones).')
+    args = argParser.parse_args()
+
+    renderers = [name for name in args.renderers if RENDERERS[name].isAvailable()]
+    for name in sorted(set(args.renderers) - set(renderers)):
+        print('skipping {0}: not installed'.format(name), file=sys.stderr)
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    try:
+        decks = [(TEST_PDF, 31)]
+        for pageCount in args.pages:
+            pdfFileName = os.path.join(tmpDir, 'deck-{0}.pdf'.format(pageCount))
+            writeSyntheticPdf(pdfFileName, pageCount)
+            decks.append((pdfFileName, pageCount))
+
+        results = []
+        for pdfFileName, pageCount in decks:
+            for name in renderers:
+                results.append(measure(name, pdfFileName, pageCount, args.used))
+                print('{renderer:>9} {pdf:<22} rendered={rendered:<4} '
+                      'rasterize={rasterize_per_page_s:7.3f}s/page slide={slide_per_page_s:7.3f}s/page'
+                      .format(**results[-1]), file=sys.stderr)
+    finally:
+        shutil.rmtree(tmpDir)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""Compare building small decks with a fresh process each and with the
+build server (slides2anki-server).
+
+Each job is a synthetic deck of a few pages. The same jobs are built one
+after the other by running slides_import.py, and by posting them to a
+server on localhost with warm render workers. Reported is the time per
+job from start (or submission) to the finished .apkg.
+
+    python benchmarks/bench_server.py --pages 5 --decks 20
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticNotes, writeSyntheticPdf
+from slidesimport.server import BuildService, makeServer
+from slidesimport.slidesimport import makeRenderPool
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data)) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--pages', type=int, default=5,
+                           help='Number of pages (and noted slides) of every deck.')
+    argParser.add_argument('--decks', type=int, default=20,
+                           help='Number of decks to build each way.')
+    argParser.add_argument('--jobs', type=int, default=2,
+                           help='Render processes of the server.')
+    args = argParser.parse_args()
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    try:
+        pdfFileName = os.path.join(tmpDir, 'deck.pdf')
+        notesFileName = os.path.join(tmpDir, 'notes.txt')
+        writeSyntheticPdf(pdfFileName, args.pages)
+        writeSyntheticNotes(notesFileName, args.pages)
+
+        start = time.time()
+        for idx in range(args.decks):
+            subprocess.check_call([sys.executable, os.path.join(ROOT, 'slides_import.py'),
+                                   notesFileName, pdfFileName,
+                                   os.path.join(tmpDir, 'deck-{0}.apkg'.format(idx))],
+                                  stdout=subprocess.DEVNULL)
+        processSeconds = (time.time() - start) / args.decks
+
+        serverArgs = A.Namespace(jobs=args.jobs, writers=4, cache_dir=None, cache_size=512,
+                                 renderer='wand', sharp_crops=False, format='png', quality=None,
+                                 png_colors=None, png_compression=None, dedup_media=False,
+                                 max_memory=None, crop_presets=None, widths=None)
+        pool = makeRenderPool(args.jobs, {'renderer': 'wand'})
+        service = BuildService(serverArgs, pool, queueSize=args.decks, concurrent=1)
+        server = makeServer(service, quiet=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{0}/jobs'.format(server.server_address[1])
+            with open(notesFileName, 'r') as f:
+                job = {'notes': f.read()}
+            with open(pdfFileName, 'rb') as f:
+                job['slides'] = base64.b64encode(f.read()).decode('ascii')
+
+            start = time.time()
+            buildSeconds = []
+            for _ in range(args.decks):
+                jobUrl = url + '/' + request(url, job)['id']
+                while True:
+                    status = request(jobUrl)
+                    if status['status'] in ('done', 'failed'):
+                        break
+                    time.sleep(0.01)
+                if status['status'] != 'done':
+                    raise RuntimeError(status['error'])
+                buildSeconds.append(status['buildSeconds'])
+            serverSeconds = (time.time() - start) / args.decks
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            service.close()
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(tmpDir)
+
+    result = {'pages': args.pages, 'decks': args.decks,
+              'process_per_deck_s': processSeconds,
+              'server_per_deck_s': serverSeconds,
+              'server_build_per_deck_s': sum(buildSeconds) / len(buildSeconds)}
+    print('process={process_per_deck_s:6.3f}s/deck server={server_per_deck_s:6.3f}s/deck '
+          '(of which building {server_build_per_deck_s:6.3f}s)'.format(**result), file=sys.stderr)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
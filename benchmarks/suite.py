@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""Run all benchmarks on synthetic inputs and write the results as JSON.
+
+Measured are the parser throughput, the start-up time of the command line
+(importing the package, -h and --check), the time of every rendering stage
+of a page (rasterize, resize, crop, encode), and the wall time and peak RSS
+of a full slides2anki run. Every result is a flat record with a unique 'name',
+so that a later run can be compared with a saved one:
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline results.json --tolerance 0.2
+
+With --baseline the exit status is 1 if any time got slower (or peak RSS
+larger) by more than the tolerance.
+"""
+
+from __future__ import print_function
+
+import argparse as A
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import writeSyntheticNotes, writeSyntheticPdf
+
+
+def isLowerBetter(metric):
+    """Whether larger values of a metric are worse (times and memory)."""
+    return (metric.endswith('_s') and not metric.endswith('_per_s')) or metric.endswith('_kb')
+
+
+def peakRssKb():
+    """Peak resident set size of this process in KiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def best(fn, repeat):
+    """Return the shortest time fn() takes out of `repeat` calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def benchParser(tmpDir, slideCounts, repeat):
+    from slidesimport.parser import Parser
+
+    results = []
+    for slideCount in slideCounts:
+        notesFileName = os.path.join(tmpDir, 'parser-{0}.txt'.format(slideCount))
+        writeSyntheticNotes(notesFileName, slideCount)
+        with io.open(notesFileName, 'r') as f:
+            notes = f.read()
+
+        elapsed = best(lambda: Parser(io.StringIO(notes)), repeat)
+        results.append({'name': 'parser/{0}'.format(slideCount),
+                        'slides': slideCount,
+                        'bytes': len(notes.encode('utf-8')),
+                        'parse_s': elapsed,
+                        'slides_per_s': slideCount / elapsed})
+    return results
+
+
+def benchStartup(tmpDir, fileCount, repeat):
+    """Time commands which must not load ImageMagick, each in a fresh
+    process: importing the package, printing the help and checking notes.
+    The time of starting python alone is reported as well."""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    notesFileNames = []
+    for idx in range(fileCount):
+        notesFileNames.append(os.path.join(tmpDir, 'check-{0}.txt'.format(idx)))
+        writeSyntheticNotes(notesFileNames[-1], 50)
+    runCli = 'from slidesimport import slidesimport; slidesimport.run()'
+
+    def timeCode(code, *arguments):
+        with open(os.devnull, 'w') as devnull:
+            return best(lambda: subprocess.call([sys.executable, '-c', code] + list(arguments),
+                                                cwd=root, stdout=devnull, stderr=devnull), repeat)
+
+    wandImported = subprocess.check_output(
+        [sys.executable, '-c', 'import sys; from slidesimport import slidesimport; '
+                               'print(int("wand" in sys.modules))'], cwd=root)
+    return [{'name': 'startup',
+             'python_s': timeCode('pass'),
+             'import_s': timeCode('import slidesimport.slidesimport'),
+             'help_s': timeCode(runCli, '-h'),
+             'wand_imported': int(wandImported.decode('utf-8').strip())},
+            {'name': 'check/{0}files'.format(fileCount),
+             'files': fileCount,
+             'check_s': timeCode(runCli, '--check', *notesFileNames)}]
+
+
+def benchPageStages(tmpDir, pageCount, samplePages, repeat):
+    """Time every stage of rendering a page on its own."""
+    from wand.image import Image
+    from slidesimport.pdfpages import PdfPages
+
+    pdfFileName = os.path.join(tmpDir, 'stages.pdf')
+    writeSyntheticPdf(pdfFileName, pageCount)
+    pages = [1 + idx * pageCount // samplePages for idx in range(samplePages)]
+    crop = [[0, 50], [0, 50]]
+
+    stageTimes = {'rasterize_s': 0.0, 'resize_s': 0.0, 'crop_s': 0.0, 'encode_s': 0.0}
+    for pageNumber in pages:
+        def rasterize():
+            p = PdfPages(pdfFileName, lazy=True)
+            p.getPage(pageNumber)
+            return p
+        stageTimes['rasterize_s'] += best(rasterize, repeat)
+        page = rasterize().getPage(pageNumber)
+
+        def resize():
+            img = Image(image=page)
+            img.resize(640, int(640 * img.height / (1.0 * img.width)))
+            return img
+        stageTimes['resize_s'] += best(resize, repeat)
+        resized = resize()
+
+        def cropImage():
+            return resized[0:resized.width // 2, 0:resized.height // 2]
+        stageTimes['crop_s'] += best(cropImage, repeat)
+
+        cropped = PdfPages(pdfFileName, lazy=True).getCroppedPageAsPng(pageNumber, crop)
+        stageTimes['encode_s'] += best(lambda: cropped.make_blob('png'), repeat)
+
+    result = {'name': 'pages/{0}'.format(pageCount), 'pages': pageCount, 'sampled': len(pages)}
+    for stage, total in stageTimes.items():
+        result[stage.replace('_s', '_per_page_s')] = total / len(pages)
+    return [result]
+
+
+def measureRun(notesFileName, pdfFileName, jobs):
+    """Run slides2anki once in this process and report time and memory."""
+    from slidesimport import slidesimport
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-run-')
+    try:
+        os.makedirs(os.path.join(tmpDir, 'profile', 'collection.media'))
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                slidesimport.run([notesFileName, pdfFileName, os.path.join(tmpDir, 'deck.txt'),
+                                  '-U', os.path.join(tmpDir, 'profile'), '--jobs', str(jobs)])
+            finally:
+                sys.stdout = stdout
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(tmpDir)
+
+    return {'total_s': elapsed, 'peak_rss_kb': peakRssKb()}
+
+
+def benchEndToEnd(tmpDir, pageCount, slideCount, jobs):
+    """Time full runs, each in a fresh process so that peak RSS is its own."""
+    pdfFileName = os.path.join(tmpDir, 'run-{0}.pdf'.format(pageCount))
+    notesFileName = os.path.join(tmpDir, 'run-{0}-{1}.txt'.format(pageCount, slideCount))
+    writeSyntheticPdf(pdfFileName, pageCount)
+    writeSyntheticNotes(notesFileName, slideCount, pageCount)
+
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--single-run',
+                                   notesFileName, pdfFileName, str(jobs)])
+    result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+    result.update({'name': 'run/{0}pages/{1}slides/{2}jobs'.format(pageCount, slideCount, jobs),
+                   'pages': pageCount, 'slides': slideCount, 'jobs': jobs})
+    return [result]
+
+
+def compareWithBaseline(results, baseline, tolerance):
+    """Return descriptions of the metrics which regressed."""
+    baselineByName = dict((result['name'], result) for result in baseline.get('results', []))
+    regressions = []
+    for result in results:
+        previous = baselineByName.get(result['name'])
+        if previous is None:
+            continue
+        for metric, value in result.items():
+            if not isLowerBetter(metric):
+                continue
+            if metric not in previous or previous[metric] <= 0:
+                continue
+            change = (value - previous[metric]) / float(previous[metric])
+            if change > tolerance:
+                regressions.append('{0} {1}: {2:.4g} -> {3:.4g} (+{4:.0%})'
+                                   .format(result['name'], metric, previous[metric], value, change))
+    return regressions
+
+
+def main():
+    argParser = A.ArgumentParser(description=__doc__,
+                                 formatter_class=A.RawDescriptionHelpFormatter)
+    argParser.add_argument('--output', help='Write the results to this file.')
+    argParser.add_argument('--baseline', help='Compare with the results in this file.')
+    argParser.add_argument('--tolerance', type=float, default=0.2,
+                           help='Allowed relative slowdown against the baseline (default: 0.2).')
+    argParser.add_argument('--parser-slides', type=int, nargs='*', default=[10000, 100000],
+                           help='Slide counts of the synthetic notes for the parser.')
+    argParser.add_argument('--check-files', type=int, default=200,
+                           help='Number of notes files checked at once with --check.')
+    argParser.add_argument('--pages', type=int, default=300,
+                           help='Page count of the synthetic pdfs.')
+    argParser.add_argument('--sample-pages', type=int, default=5,
+                           help='Number of pages on which the rendering stages are timed.')
+    argParser.add_argument('--run-slides', type=int, default=60,
+                           help='Number of slides in the notes for the full runs.')
+    argParser.add_argument('--jobs', type=int, nargs='*', default=[1],
+                           help='Job counts for the full runs.')
+    argParser.add_argument('--repeat', type=int, default=3,
+                           help='Repetitions of every timing; the best is reported.')
+    argParser.add_argument('--skip-rendering', action='store_true',
+                           help='Only run the benchmarks which do not need ImageMagick.')
+    argParser.add_argument('--single-run', nargs=3, metavar=('NOTES', 'PDF', 'JOBS'),
+                           help=A.SUPPRESS)
+    args = argParser.parse_args()
+
+    if args.single_run:
+        notesFileName, pdfFileName, jobs = args.single_run
+        print(json.dumps(measureRun(notesFileName, pdfFileName, int(jobs))))
+        return
+
+    tmpDir = tempfile.mkdtemp(prefix='slides-bench-')
+    results = []
+    try:
+        results += benchParser(tmpDir, args.parser_slides, args.repeat)
+        results += benchStartup(tmpDir, args.check_files, args.repeat)
+        if not args.skip_rendering:
+            results += benchPageStages(tmpDir, args.pages, args.sample_pages, args.repeat)
+            for jobs in args.jobs:
+                results += benchEndToEnd(tmpDir, args.pages, args.run_slides, jobs)
+    finally:
+        shutil.rmtree(tmpDir)
+
+    for result in results:
+        print(result['name'], ' '.join('{0}={1:.4g}'.format(k, v) for k, v in sorted(result.items())
+                                       if k != 'name'), file=sys.stderr)
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compareWithBaseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Generators for synthetic inputs used by the benchmarks."""
+
+import unittest
+import io
+import os
+import sys
+import tempfile
+
+
+# One entry per card variant; {n} is replaced by the slide number.
+NOTES_VARIANTS = [
+    ['What is shown on slide {n}?'],
+    ['Q: Question about slide {n}?', 'A: Answer for slide {n}.'],
+    ['Q_S: What is on slide {n}?', 'A: Answer for slide {n}.'],
+    ['S_Q: Explain slide {n}.', 'A_S: Like this.'],
+    ['Q: Question about slide {n}?', 'S_A: Answer for slide {n}.'],
+    ['Q_S[tl]: What is top-left on slide {n}?', 'S_A[br]: Bottom right.'],
+    ['S_Q[10-40,10:100]: Crop of slide {n}?', 'A_S[25-75, 0-50]: Answer.'],
+    ['Q_S[vmt]: Middle of slide {n}?', 'A_S[t]: Top half.'],
+]
+
+
+def writeSyntheticNotes(fileName, slideCount, pageCount=None):
+    """Write notes for `slideCount` slides, cycling through NOTES_VARIANTS.
+
+    Slide numbers wrap around at `pageCount` (if given), so that the notes
+    can be used with a synthetic pdf with fewer pages.
+    """
+    with open(fileName, 'w') as f:
+        for idx in range(slideCount):
+            slideNum = idx % pageCount + 1 if pageCount else idx + 1
+            f.write('Slide {0}:\n'.format(slideNum))
+            for line in NOTES_VARIANTS[idx % len(NOTES_VARIANTS)]:
+                f.write('    {0}\n'.format(line.format(n=slideNum)))
+            f.write('\n')
+
+
+def _pdfPageContent(pageNumber):
+    """Return the content stream of a single synthetic slide."""
+    ops = ['0.9 0.9 1 rg 0 0 720 540 re f',
+           '0.2 0.3 0.6 rg 40 440 640 60 re f',
+           'BT /F1 36 Tf 1 1 1 rg 60 455 Td (Slide {0}) Tj ET'.format(pageNumber)]
+    for idx in range(6):
+        y = 380 - 55 * idx
+        shade = ((pageNumber + idx) % 7) / 10.0
+        ops.append('{0} 0.5 0.5 rg 60 {1} 12 12 re f'.format(shade, y))
+        ops.append('BT /F1 20 Tf 0 0 0 rg 90 {0} Td (Bullet point {1} of slide {2}) Tj ET'
+                   .format(y, idx + 1, pageNumber))
+    return '\n'.join(ops).encode('ascii')
+
+
+def writeSyntheticPdf(fileName, pageCount):
+    """Write a pdf with `pageCount` simple slides (720x540pt) to `fileName`."""
+    # Object layout: 1 catalog, 2 pages, 3 font, then (page, content) pairs.
+    objects = {}
+    pageIds = []
+    for idx in range(pageCount):
+        pageId = 4 + 2 * idx
+        contentId = pageId + 1
+        pageIds.append(pageId)
+        content = _pdfPageContent(idx + 1)
+        objects[pageId] = ('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 720 540] '
+                           '/Resources << /Font << /F1 3 0 R >> >> '
+                           '/Contents {0} 0 R >>'.format(contentId)).encode('ascii')
+        objects[contentId] = (('<< /Length {0} >>\nstream\n'.format(len(content))).encode('ascii') +
+                              content + b'\nendstream')
+
+    objects[1] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[2] = ('<< /Type /Pages /Kids [{0}] /Count {1} >>'
+                  .format(' '.join('{0} 0 R'.format(i) for i in pageIds), pageCount)).encode('ascii')
+    objects[3] = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = {}
+    for objId in sorted(objects):
+        offsets[objId] = out.tell()
+        out.write('{0} 0 obj\n'.format(objId).encode('ascii'))
+        out.write(objects[objId])
+        out.write(b'\nendobj\n')
+
+    xrefOffset = out.tell()
+    size = max(objects) + 1
+    out.write('xref\n0 {0}\n'.format(size).encode('ascii'))
+    out.write(b'0000000000 65535 f \n')
+    for objId in range(1, size):
+        out.write('{0:010d} 00000 n \n'.format(offsets[objId]).encode('ascii'))
+    out.write('trailer\n<< /Size {0} /Root 1 0 R >>\nstartxref\n{1}\n%%EOF\n'
+              .format(size, xrefOffset).encode('ascii'))
+
+    with open(fileName, 'wb') as f:
+        f.write(out.getvalue())
+
+
+class TestSynthetic(unittest.TestCase):
+    def testNotesParse(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        from slidesimport.parser import Parser
+
+        fd, fileName = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+        try:
+            writeSyntheticNotes(fileName, 2 * len(NOTES_VARIANTS))
+            with open(fileName) as f:
+                notes = Parser(f).getNotesAndCropsParsing()
+        finally:
+            os.remove(fileName)
+
+        self.assertEqual(len(notes.fullNotes), 2 * len(NOTES_VARIANTS))
+        self.assertEqual(notes.questionsFollowedBySlidesCrops[6], [[0, 50], [0, 50]])
+
+    def testPdfStructure(self):
+        fd, fileName = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            writeSyntheticPdf(fileName, 3)
+            with open(fileName, 'rb') as f:
+                data = f.read()
+        finally:
+            os.remove(fileName)
+
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Count 3', data)
+        self.assertEqual(data.count(b'/Type /Page '), 3)
+
+        # Every xref entry must point at the start of its object.
+        xrefOffset = int(data.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        entries = data[xrefOffset:].split(b'\n')[3:3 + 9]
+        for objId, entry in enumerate(entries, 1):
+            offset = int(entry[:10])
+            self.assertTrue(data[offset:].startswith('{0} 0 obj'.format(objId).encode('ascii')))
@@ -1,9 +1,6 @@
 from setuptools import setup
-import sys
 
-# The argparse module was introduced in python 2.7 or python 3.2
-REQUIRES = ["argparse"] if sys.version[:3] in ('2.6', '3.0', '3.1') else []
-REQUIRES = REQUIRES + ["wand>=0.4.0"]
+REQUIRES = ["wand>=0.4.0"]
 
 setup(
     version='0.0.1',
@@ -14,9 +11,13 @@ setup(
     license="MIT",
     keywords="anki slides deck import",
     install_requires=REQUIRES,
+    python_requires=">=3.7",
+    extras_require={"mupdf": ["PyMuPDF"]},
     url="https://github.com/musically-ut/anki-slides-import",
     packages=["slidesimport"],
-    entry_points={ "console_scripts": [ "slides2anki = slidesimport.slidesimport:run" ]},
+    entry_points={ "console_scripts": [ "slides2anki = slidesimport.slidesimport:run",
+                                        "slides2anki-batch = slidesimport.batch:run",
+                                        "slides2anki-server = slidesimport.server:run" ]},
     classifiers      = [
         "License :: OSI Approved :: MIT License",
         "Intended Audience :: Science/Research",
@@ -24,7 +25,8 @@ setup(
         "Operating System :: OS Independent",
         "Topic :: Utilities",
         "License :: OSI Approved :: MIT License",
-        "Programming Language :: Python :: 2.7",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
         "Natural Language :: English"
     ],
 )
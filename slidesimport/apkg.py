@@ -0,0 +1,238 @@
+import unittest
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+
+# The id of the note type of the cards, fixed so that importing a deck again
+# reuses the note type instead of creating a new one.
+MODEL_ID = 1432087315208
+
+SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (
+    usn integer not null, oid integer not null, type integer not null
+);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+DECK_CONF = {
+    'id': 1, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60,
+    'autoplay': True, 'timer': 0, 'replayq': True, 'dyn': False,
+    'new': {'bury': True, 'delays': [1, 10], 'initialFactor': 2500,
+            'ints': [1, 4, 7], 'order': 1, 'perDay': 20, 'separate': True},
+    'lapse': {'delays': [10], 'leechAction': 0, 'leechFails': 8,
+              'minInt': 1, 'mult': 0},
+    'rev': {'bury': True, 'ease4': 1.3, 'fuzz': 0.05, 'ivlFct': 1,
+            'maxIvl': 36500, 'minSpace': 1, 'perDay': 100},
+}
+
+
+def makeId(name):
+    """Return a stable id for a deck name."""
+    return int(hashlib.sha1(name.encode('utf-8')).hexdigest()[:12], 16)
+
+
+def makeGuid(key):
+    """Return the guid of the note for key; Anki updates notes with the
+    same guid instead of adding them again."""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]
+
+
+def stripHtml(field):
+    """Return the text of a field as Anki sorts and checksums it."""
+    return html.unescape(re.sub(r'<[^>]*>', '', field)).strip()
+
+
+def fieldChecksum(field):
+    return int(hashlib.sha1(stripHtml(field).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def makeDeck(deckId, name, now):
+    return {'id': deckId, 'name': name, 'desc': '', 'mod': now, 'usn': -1,
+            'collapsed': False, 'dyn': 0, 'conf': 1, 'extendNew': 10, 'extendRev': 50,
+            'newToday': [0, 0], 'revToday': [0, 0], 'lrnToday': [0, 0], 'timeToday': [0, 0]}
+
+
+def makeModel(deckId, now):
+    field = {'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20, 'media': []}
+    return {'id': MODEL_ID, 'name': 'Basic (slides2anki)', 'type': 0, 'mod': now, 'usn': -1,
+            'sortf': 0, 'did': deckId, 'tags': [], 'vers': [], 'req': [[0, 'all', [0]]],
+            'flds': [dict(field, name='Front', ord=0), dict(field, name='Back', ord=1)],
+            'tmpls': [{'name': 'Card 1', 'ord': 0, 'did': None, 'bqfmt': '', 'bafmt': '',
+                       'qfmt': '{{Front}}', 'afmt': '{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}'}],
+            'css': '.card {\n font-family: arial;\n font-size: 20px;\n text-align: center;\n'
+                   ' color: black;\n background-color: white;\n}\n',
+            'latexPre': '\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n'
+                        '\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n'
+                        '\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n',
+            'latexPost': '\\end{document}'}
+
+
+class ApkgWriter(object):
+    """Writes an Anki package (.apkg): one zip with the collection and the media.
+
+    Media are added to the zip as soon as they are given, so that they need
+    not be kept in memory; the collection is added on close(). The package
+    only appears under its name once it is complete.
+    """
+
+    def __init__(self, fileName, deckName):
+        self.fileName = fileName
+        self.deckName = deckName
+        self.now = int(time.time())
+        self.deckId = makeId(deckName)
+        self.noteCount = 0
+        self.mediaNames = []
+        self.addedMedia = set()
+
+        self.zipFileName = fileName + '.tmp'
+        self.zip = zipfile.ZipFile(self.zipFileName, 'w', zipfile.ZIP_DEFLATED)
+        fd, self.dbFileName = tempfile.mkstemp(suffix='.anki2')
+        os.close(fd)
+        self.db = sqlite3.connect(self.dbFileName)
+        self.db.executescript(SCHEMA)
+
+    def addNote(self, key, front, back):
+        """Add a note (and its card); key identifies the note across builds."""
+        noteId = self.now * 1000 + self.noteCount
+        self.noteCount += 1
+        self.db.execute('INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                        (noteId, makeGuid(key), MODEL_ID, self.now, -1, '',
+                         front + '\x1f' + back, stripHtml(front), fieldChecksum(front), 0, ''))
+        self.db.execute('INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                        (noteId, noteId, self.deckId, 0, self.now, -1, 0, 0, self.noteCount,
+                         0, 0, 0, 0, 0, 0, 0, 0, ''))
+
+    def addMedia(self, name, data):
+        """Add a media file; adding a name again is ignored."""
+        if name in self.addedMedia:
+            return
+        self.addedMedia.add(name)
+        # Images are compressed already.
+        self.zip.writestr(str(len(self.mediaNames)), data, zipfile.ZIP_STORED)
+        self.mediaNames.append(name)
+
+    def close(self):
+        conf = {'nextPos': self.noteCount + 1, 'estTimes': True, 'activeDecks': [1],
+                'sortType': 'noteFld', 'timeLim': 0, 'sortBackwards': False, 'addToCur': True,
+                'curDeck': 1, 'newBury': True, 'newSpread': 0, 'dueCounts': True,
+                'curModel': str(MODEL_ID), 'collapseTime': 1200}
+        decks = {'1': makeDeck(1, 'Default', self.now),
+                 str(self.deckId): makeDeck(self.deckId, self.deckName, self.now)}
+        self.db.execute('INSERT INTO col VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                        (1, self.now - self.now % 86400, self.now * 1000, self.now * 1000, 11, 0, 0, 0,
+                         json.dumps(conf), json.dumps({str(MODEL_ID): makeModel(self.deckId, self.now)}),
+                         json.dumps(decks), json.dumps({'1': DECK_CONF}), '{}'))
+        self.db.commit()
+        self.db.close()
+
+        try:
+            self.zip.write(self.dbFileName, 'collection.anki2')
+            self.zip.writestr('media', json.dumps(dict((str(idx), name)
+                                                      for idx, name in enumerate(self.mediaNames))))
+            self.zip.close()
+            os.replace(self.zipFileName, self.fileName)
+        finally:
+            os.remove(self.dbFileName)
+
+    def abort(self):
+        """Discard the package, also after close failed."""
+        self.db.close()
+        try:
+            self.zip.close()
+        finally:
+            for fileName in (self.dbFileName, self.zipFileName):
+                if os.path.exists(fileName):
+                    os.remove(fileName)
+
+
+class TestApkgWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.tmpDir, 'deck.apkg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testPackage(self):
+        writer = ApkgWriter(self.fileName, 'lecture')
+        writer.addNote('lecture-1', 'Question', '<img src="lecture-1.png" />')
+        writer.addNote('lecture-2', '<div>Other</div>', 'Answer')
+        writer.addMedia('lecture-1.png', b'png')
+        writer.addMedia('lecture-1.png', b'png')
+        self.assertFalse(os.path.exists(self.fileName))
+        writer.close()
+
+        with zipfile.ZipFile(self.fileName) as z:
+            self.assertEqual(json.loads(z.read('media').decode('utf-8')), {'0': 'lecture-1.png'})
+            self.assertEqual(z.read('0'), b'png')
+            z.extract('collection.anki2', self.tmpDir)
+
+        db = sqlite3.connect(os.path.join(self.tmpDir, 'collection.anki2'))
+        notes = db.execute('SELECT guid, flds, sfld FROM notes ORDER BY id').fetchall()
+        self.assertEqual([n[1] for n in notes], ['Question\x1f<img src="lecture-1.png" />',
+                                                 '<div>Other</div>\x1fAnswer'])
+        self.assertEqual(notes[1][2], 'Other')
+        self.assertEqual(notes[0][0], makeGuid('lecture-1'))
+        self.assertEqual(db.execute('SELECT count(*) FROM cards').fetchone()[0], 2)
+        decks = json.loads(db.execute('SELECT decks FROM col').fetchone()[0])
+        self.assertIn('lecture', [deck['name'] for deck in decks.values()])
+        db.close()
+
+    def testStripHtml(self):
+        self.assertEqual(stripHtml('<div>A &amp; B</div> '), 'A & B')
+        self.assertEqual(fieldChecksum('<b>A &amp; B</b>'), fieldChecksum('A & B'))
+
+    def testAbort(self):
+        writer = ApkgWriter(self.fileName, 'lecture')
+        writer.addMedia('a.png', b'png')
+        writer.abort()
+        self.assertEqual(os.listdir(self.tmpDir), [])
+
+        # The package cannot replace a folder.
+        os.mkdir(self.fileName)
+        writer = ApkgWriter(self.fileName, 'lecture')
+        with self.assertRaises(OSError):
+            writer.close()
+        writer.abort()
+        self.assertEqual(os.listdir(self.tmpDir), ['deck.apkg'])
+        self.assertFalse(os.path.exists(writer.dbFileName))
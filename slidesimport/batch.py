@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from .slidesimport import addCommonArguments, importSlides, makeRenderPool, makeBuildArgs, \
+                          getRenderOptions, checkOptions, expandPath, SlidesImportError
+
+import sys
+import os
+import csv
+import json
+import time
+import argparse as A
+import unittest
+import shutil
+import tempfile
+
+LECTURE_FIELDS = ['notes', 'slides', 'deck', 'prefix']
+
+
+def readLectures(manifestFilePath):
+    """Read the list of lectures to build from a .json or .csv manifest.
+
+    A json manifest is a list of objects, a csv manifest has a header line;
+    both use the keys notes, slides, deck and (optionally) prefix. Relative
+    paths are taken relative to the folder of the manifest.
+    """
+    with open(manifestFilePath, 'r') as f:
+        if manifestFilePath.lower().endswith('.json'):
+            lectures = json.load(f)
+        else:
+            lectures = list(csv.DictReader(f))
+
+    if not isinstance(lectures, list):
+        raise SlidesImportError('The manifest must contain a list of lectures.')
+
+    baseDir = os.path.dirname(os.path.abspath(manifestFilePath))
+    result = []
+    for idx, lecture in enumerate(lectures):
+        if not isinstance(lecture, dict):
+            raise SlidesImportError('Lecture {0} in the manifest is not an object.'.format(idx + 1))
+        for field in ['notes', 'slides', 'deck']:
+            if not lecture.get(field):
+                raise SlidesImportError('Lecture {0} in the manifest has no "{1}".'.format(idx + 1, field))
+        entry = {}
+        for field in LECTURE_FIELDS:
+            value = lecture.get(field) or None
+            if value is not None and field != 'prefix':
+                value = os.path.join(baseDir, expandPath(value))
+            entry[field] = value
+        result.append(entry)
+
+    return result
+
+
+def runBatch(args, lectures):
+    """Build every lecture, returning a list of (lecture, error, seconds).
+
+    error is None for lectures which were built. One process pool is shared
+    by all lectures.
+    """
+    pool = None
+    if args.jobs > 1:
+        pool = makeRenderPool(args.jobs, getRenderOptions(args))
+
+    results = []
+    try:
+        for lecture in lectures:
+            print('=== {0}'.format(lecture['deck']))
+            lectureArgs = A.Namespace(**dict(vars(args), **lecture))
+            start = time.time()
+            try:
+                importSlides(lectureArgs, pool)
+                error = None
+            except SlidesImportError as e:
+                error = str(e)
+            except Exception as e:
+                error = '{0}: {1}'.format(type(e).__name__, e)
+            results.append((lecture, error, time.time() - start))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return results
+
+
+def run(rawArgs=None):
+    argParser = A.ArgumentParser(description='Build the decks of many lectures at once.')
+    argParser.add_argument( 'manifest',
+                            help = 'A .json or .csv file listing the notes, slides, deck and (optional) prefix of every lecture.',
+                            type = str
+                          )
+
+    addCommonArguments(argParser)
+
+    if rawArgs is not None:
+        args = argParser.parse_args(rawArgs)
+    else:
+        args = argParser.parse_args()
+
+    try:
+        lectures = readLectures(expandPath(args.manifest))
+    except (IOError, ValueError, csv.Error, SlidesImportError) as e:
+        print('Error while reading the manifest:', file=sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+
+    # The options are the same for every lecture (and the render processes).
+    try:
+        checkOptions(args)
+    except SlidesImportError as e:
+        print('Error in the options:', file=sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+
+    results = runBatch(args, lectures)
+
+    print('')
+    print('Summary:')
+    failures = 0
+    for lecture, error, seconds in results:
+        if error is None:
+            print('  OK      {0} ({1:.1f}s)'.format(lecture['deck'], seconds))
+        else:
+            failures += 1
+            print('  FAILED  {0}: {1}'.format(lecture['deck'], error.replace('\n', ' ')))
+    print('{0} of {1} lectures built.'.format(len(results) - failures, len(results)))
+
+    if failures > 0:
+        sys.exit(-1)
+
+
+class TestReadLectures(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def testCsv(self):
+        path = self.write('lectures.csv', 'notes,slides,deck,prefix\n'
+                                          'l1.txt,l1.pdf,l1.deck,lecture1\n'
+                                          'l2.txt,/abs/l2.pdf,l2.deck,\n')
+        lectures = readLectures(path)
+
+        self.assertEqual(len(lectures), 2)
+        self.assertEqual(lectures[0]['notes'], os.path.join(self.tmpDir, 'l1.txt'))
+        self.assertEqual(lectures[0]['prefix'], 'lecture1')
+        self.assertEqual(lectures[1]['slides'], '/abs/l2.pdf')
+        self.assertIsNone(lectures[1]['prefix'])
+
+    def testJson(self):
+        path = self.write('lectures.json', json.dumps([{'notes': 'l1.txt', 'slides': 'l1.pdf', 'deck': 'l1.deck'}]))
+        lectures = readLectures(path)
+
+        self.assertEqual(lectures[0]['deck'], os.path.join(self.tmpDir, 'l1.deck'))
+        self.assertIsNone(lectures[0]['prefix'])
+
+    def testMissingField(self):
+        path = self.write('lectures.json', json.dumps([{'notes': 'l1.txt', 'deck': 'l1.deck'}]))
+        with self.assertRaises(SlidesImportError):
+            readLectures(path)
+
+    def testNotAnObject(self):
+        path = self.write('lectures.json', json.dumps([['l1.txt', 'l1.pdf', 'l1.deck']]))
+        with self.assertRaises(SlidesImportError):
+            readLectures(path)
+
+    def testInvalidOptions(self):
+        path = self.write('lectures.json', json.dumps([{'notes': 'l1.txt', 'slides': 'l1.pdf', 'deck': 'l1.deck'}]))
+        with self.assertRaises(SystemExit):
+            run([path, '-j', '2', '--format', 'jpeg', '--png-colors', '16'])
+
+    def testFailuresDoNotStopTheBatch(self):
+        os.makedirs(os.path.join(self.tmpDir, 'profile', 'collection.media'))
+        self.write('bad.txt', 'Not a slide line\n')
+        lectures = [{'notes': os.path.join(self.tmpDir, 'bad.txt'), 'slides': 'missing.pdf',
+                     'deck': os.path.join(self.tmpDir, 'bad.deck'), 'prefix': None},
+                    {'notes': os.path.join(self.tmpDir, 'missing.txt'), 'slides': 'missing.pdf',
+                     'deck': os.path.join(self.tmpDir, 'missing.deck'), 'prefix': None}]
+        args = makeBuildArgs(None, None, None, anki=os.path.join(self.tmpDir, 'profile'))
+
+        results = runBatch(args, lectures)
+
+        self.assertEqual(len(results), 2)
+        self.assertIn('Parsing error', results[0][1])
+        self.assertIn('Error while reading source files', results[1][1])
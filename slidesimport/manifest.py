@@ -0,0 +1,170 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+from .rendercache import hashFile
+from .parser import SlideCard
+
+MANIFEST_VERSION = 1
+
+
+def getManifestPath(deckFilePath):
+    """Return the file name of the manifest written next to a deck."""
+    return deckFilePath + '.manifest.json'
+
+
+def loadManifest(manifestPath):
+    """Read a manifest, returning None if there is no usable one."""
+    try:
+        with open(manifestPath, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return None
+
+    return manifest
+
+
+def saveManifest(manifestPath, manifest):
+    """Write a manifest atomically."""
+    manifest['version'] = MANIFEST_VERSION
+    tmpPath = manifestPath + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmpPath, manifestPath)
+
+
+def makeManifest(pdfHash, prefix, renderSettings=None):
+    """Start a manifest; renderSettings are the options which change how
+    slides look (slides are rendered again when they differ)."""
+    return {'version': MANIFEST_VERSION, 'slidesHash': pdfHash, 'prefix': prefix,
+            'render': renderSettings or {}, 'slides': {}}
+
+
+# The SlideCard attributes which determine a card and its media.
+CARD_FIELDS = ['fullNotes', 'questionKind', 'question', 'questionCrop',
+               'answerKind', 'answer', 'answerCrop']
+
+
+def makeSlideRecord(card, mediaJobs):
+    """Describe everything a slide's card and media are generated from.
+
+    card is a SlideCard, mediaJobs a list of (cropPercentValues,
+    mediaFilePath, width). The record only contains plain JSON types so that it
+    compares equal to the one read back from the manifest.
+    """
+    return {'card': dict((field, getattr(card, field)) for field in CARD_FIELDS),
+            'media': [{'crop': cropPercentValues, 'name': os.path.basename(mediaFilePath)}
+                      for cropPercentValues, mediaFilePath, _ in mediaJobs]}
+
+
+def getMediaFileName(media):
+    """Return the name of the file of a media entry of a slide record.
+
+    Media stored under the hash of their content (see --dedup-media) record
+    the name of that file as 'file'; otherwise the file has the media name.
+    """
+    return media.get('file', media['name'])
+
+
+def getPreviousMediaNames(manifest):
+    """Return the names of all media files a manifest accounts for.
+
+    Files named by their content are left out: other decks may use them too,
+    so they are neither ours to overwrite nor to delete.
+    """
+    if manifest is None:
+        return set()
+    return set(media['name']
+               for record in manifest['slides'].values()
+               for media in record['media']
+               if 'file' not in media)
+
+
+def isSlideUpToDate(previousManifest, manifest, slideNum, record, collectionMediaPath):
+    """Whether the media of a slide from a previous run can be kept as is."""
+    if previousManifest is None:
+        return False
+    if (previousManifest.get('slidesHash') != manifest['slidesHash'] or
+            previousManifest.get('prefix') != manifest['prefix'] or
+            previousManifest.get('render', {}) != manifest['render']):
+        return False
+
+    previousRecord = previousManifest['slides'].get(str(slideNum))
+    if previousRecord is None:
+        return False
+    if previousRecord.get('card') != record['card']:
+        return False
+    if [(m['crop'], m['name']) for m in previousRecord['media']] != \
+       [(m['crop'], m['name']) for m in record['media']]:
+        return False
+
+    # The files must still be the ones we wrote.
+    for media in previousRecord['media']:
+        mediaFilePath = os.path.join(collectionMediaPath, getMediaFileName(media))
+        if not os.path.exists(mediaFilePath) or hashFile(mediaFilePath) != media.get('sha256'):
+            return False
+
+    return True
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.mediaDir = os.path.join(self.tmpDir, 'collection.media')
+        os.makedirs(self.mediaDir)
+        self.card = SlideCard(1, 'A_S[t]: Answer', answerKind='A_S', answer='Answer',
+                              answerCrop=[[0, 100], [0, 50]])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeMedia(self, name, data):
+        path = os.path.join(self.mediaDir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def testUpToDate(self):
+        path = self.writeMedia('p-1.png', b'png')
+        record = makeSlideRecord(self.card, [([[0, 100], [0, 50]], path, 640)])
+        previous = makeManifest('hash', 'p')
+        previous['slides']['1'] = dict(record, media=[dict(record['media'][0], sha256=hashFile(path))])
+
+        manifestPath = getManifestPath(os.path.join(self.tmpDir, 'deck.txt'))
+        saveManifest(manifestPath, previous)
+        previous = loadManifest(manifestPath)
+
+        self.assertTrue(isSlideUpToDate(previous, makeManifest('hash', 'p'), 1, record, self.mediaDir))
+        self.assertFalse(isSlideUpToDate(previous, makeManifest('other', 'p'), 1, record, self.mediaDir))
+        self.assertFalse(isSlideUpToDate(previous, makeManifest('hash', 'p', {'renderer': 'mupdf'}),
+                                         1, record, self.mediaDir))
+        self.assertFalse(isSlideUpToDate(previous, makeManifest('hash', 'p'), 2, record, self.mediaDir))
+        self.assertEqual(getPreviousMediaNames(previous), set(['p-1.png']))
+
+        self.card.answerCrop = [[0, 100], [50, 100]]
+        changed = makeSlideRecord(self.card, [([[0, 100], [0, 50]], path, 640)])
+        self.assertFalse(isSlideUpToDate(previous, makeManifest('hash', 'p'), 1, changed, self.mediaDir))
+
+        self.writeMedia('p-1.png', b'edited')
+        self.assertFalse(isSlideUpToDate(previous, makeManifest('hash', 'p'), 1, record, self.mediaDir))
+
+    def testSharedMedia(self):
+        path = self.writeMedia('slide-0123.png', b'png')
+        record = makeSlideRecord(self.card, [([[0, 100], [0, 50]], 'p-1.png', 640)])
+        previous = makeManifest('hash', 'p')
+        previous['slides']['1'] = dict(record, media=[dict(record['media'][0], file='slide-0123.png',
+                                                           sha256=hashFile(path))])
+
+        self.assertTrue(isSlideUpToDate(previous, makeManifest('hash', 'p'), 1, record, self.mediaDir))
+        self.assertEqual(getPreviousMediaNames(previous), set())
+
+        os.remove(path)
+        self.assertFalse(isSlideUpToDate(previous, makeManifest('hash', 'p'), 1, record, self.mediaDir))
+
+    def testMissingManifest(self):
+        self.assertIsNone(loadManifest(os.path.join(self.tmpDir, 'missing.json')))
@@ -0,0 +1,93 @@
+import unittest
+
+
+# The file extension of every supported format.
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+DEFAULT_QUALITY = 85
+
+
+class MediaFormat(object):
+    """How the images of slides are encoded.
+
+    frmt is one of EXTENSIONS. quality (1-100) only applies to jpeg and webp,
+    colors (2-256) reduces a png to a palette of that many colors and
+    compressionLevel (0-9) is the zlib level of a png. Options left at None
+    use the ImageMagick defaults.
+    """
+
+    def __init__(self, frmt='png', quality=None, colors=None, compressionLevel=None):
+        if frmt not in EXTENSIONS:
+            raise ValueError('Unknown image format "{0}"; choose one of: {1}.'
+                             .format(frmt, ', '.join(sorted(EXTENSIONS))))
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError('The quality must be between 1 and 100.')
+        if colors is not None and not 2 <= colors <= 256:
+            raise ValueError('The number of png colors must be between 2 and 256.')
+        if compressionLevel is not None and not 0 <= compressionLevel <= 9:
+            raise ValueError('The png compression level must be between 0 and 9.')
+        if frmt != 'png' and (colors is not None or compressionLevel is not None):
+            raise ValueError('Colors and compression level only apply to png images.')
+        if frmt == 'png' and quality is not None:
+            raise ValueError('The quality only applies to jpeg and webp images.')
+
+        self.frmt = frmt
+        self.quality = quality if quality is not None or frmt == 'png' else DEFAULT_QUALITY
+        self.colors = colors
+        self.compressionLevel = compressionLevel
+
+    def getExtension(self):
+        return EXTENSIONS[self.frmt]
+
+    def getKey(self):
+        """Return a string which differs for formats encoding differently."""
+        key = self.frmt
+        for letter, value in (('q', self.quality), ('c', self.colors), ('z', self.compressionLevel)):
+            if value is not None:
+                key += '-{0}{1}'.format(letter, value)
+        return key
+
+    def encode(self, img):
+        """Return the encoded bytes of a wand image, which is changed."""
+        from wand.color import Color
+        if self.frmt == 'jpeg':
+            # JPEG has no transparency; put slides on white, not black.
+            img.background_color = Color('white')
+            img.alpha_channel = 'remove'
+        if self.colors is not None:
+            img.quantize(self.colors, dither=False)
+        if self.compressionLevel is not None:
+            img.options['png:compression-level'] = str(self.compressionLevel)
+        if self.quality is not None:
+            img.compression_quality = self.quality
+        # Leave out metadata, such as the date:create and date:modify chunks
+        # of pngs, so that the same slide is always encoded to the same bytes.
+        img.strip()
+        img.options['png:exclude-chunks'] = 'date,time'
+        img.format = self.frmt
+        return img.make_blob()
+
+
+class TestMediaFormat(unittest.TestCase):
+    def testKeysAndExtensions(self):
+        self.assertEqual(MediaFormat().getKey(), 'png')
+        self.assertEqual(MediaFormat('png', colors=64, compressionLevel=9).getKey(), 'png-c64-z9')
+        self.assertEqual(MediaFormat('jpeg').getKey(), 'jpeg-q85')
+        self.assertEqual(MediaFormat('jpeg').getExtension(), 'jpg')
+        self.assertEqual(MediaFormat('webp', quality=60).getExtension(), 'webp')
+
+    def testInvalidOptions(self):
+        for args in [('gif',), ('jpeg', 0), ('png', 80), ('png', None, 1000),
+                     ('png', None, None, 10), ('webp', 80, 16)]:
+            with self.assertRaises(ValueError):
+                MediaFormat(*args)
+
+    def testEncode(self):
+        from wand.image import Image
+        slide = Image(filename='./slidesimport/test/slide-12.png')
+        self.assertEqual(MediaFormat('jpeg').encode(slide.clone())[:3], b'\xff\xd8\xff')
+        self.assertEqual(MediaFormat('webp').encode(slide.clone())[8:12], b'WEBP')
+        png = MediaFormat().encode(slide.clone())
+        palette = MediaFormat('png', colors=16, compressionLevel=9).encode(slide.clone())
+        self.assertEqual(palette[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertLess(len(palette), len(png))
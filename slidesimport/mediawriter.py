@@ -0,0 +1,128 @@
+from .profiling import Profile, NullProfile
+import unittest
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+
+def writeMediaFile(mediaFilePath, data, keepExisting=False):
+    """Write a media file, returning whether it was written.
+
+    With keepExisting, a file which exists already is left as is (for
+    media named by their content). The file is written atomically, as an
+    interrupted write would be taken for a complete image on the next run.
+    """
+    if keepExisting and os.path.exists(mediaFilePath):
+        return False
+    tmpPath = mediaFilePath + '.tmp'
+    with open(tmpPath, 'wb') as mediaFile:
+        mediaFile.write(data)
+    os.replace(tmpPath, mediaFilePath)
+    return True
+
+
+class MediaWriter(object):
+    """Writes media files on a pool of threads, so that slides are rendered
+    while the files of the previous ones are written (which is slow on e.g.
+    network folders).
+
+    put() blocks while maxQueued files wait to be written, which bounds the
+    memory taken by encoded images. An error of a thread is raised by the
+    next put() or by close(); the files queued after it are not written.
+    The time spent writing is recorded in profile as the 'save' stage,
+    summed over the threads, and with the bytes written also for the slide
+    a file is put for (if given).
+    """
+
+    def __init__(self, threads=4, maxQueued=None, profile=None):
+        self.queue = queue.Queue(maxQueued if maxQueued is not None else 4 * threads)
+        self.profile = profile if profile is not None else NullProfile()
+        self.error = None
+        # Every thread records into a profile of its own.
+        self.threadProfiles = [Profile() for _ in range(threads)]
+        self.threads = [threading.Thread(target=self.writeQueued, args=(threadProfile,))
+                        for threadProfile in self.threadProfiles]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def writeQueued(self, profile):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            mediaFilePath, data, keepExisting, slideNum = item
+            try:
+                if slideNum is None:
+                    self.write(profile, mediaFilePath, data, keepExisting)
+                else:
+                    with profile.slide(slideNum):
+                        self.write(profile, mediaFilePath, data, keepExisting)
+            except Exception as e:
+                self.error = e
+
+    def write(self, profile, mediaFilePath, data, keepExisting):
+        with profile.stage('save'):
+            written = writeMediaFile(mediaFilePath, data, keepExisting)
+        if written:
+            profile.addBytesWritten(len(data))
+
+    def put(self, mediaFilePath, data, keepExisting=False, slideNum=None):
+        """Queue a file to be written (see writeMediaFile), accounting it
+        to slide `slideNum` in the profile."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((mediaFilePath, data, keepExisting, slideNum))
+
+    def close(self):
+        """Wait until all queued files are written; closing again does
+        nothing but raise the error again."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        for threadProfile in self.threadProfiles:
+            self.profile.mergeIntoSlides(threadProfile)
+        self.threads, self.threadProfiles = [], []
+        if self.error is not None:
+            raise self.error
+
+
+class TestMediaWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testWrites(self):
+        existing = os.path.join(self.tmpDir, 'existing.png')
+        with open(existing, 'wb') as f:
+            f.write(b'old')
+
+        profile = Profile()
+        writer = MediaWriter(threads=3, maxQueued=2, profile=profile)
+        for n in range(20):
+            writer.put(os.path.join(self.tmpDir, '{0}.png'.format(n)), b'png' * n, slideNum=n % 2)
+        writer.put(existing, b'new', keepExisting=True)
+        writer.close()
+
+        for n in range(20):
+            with open(os.path.join(self.tmpDir, '{0}.png'.format(n)), 'rb') as f:
+                self.assertEqual(f.read(), b'png' * n)
+        with open(existing, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(profile.bytesWritten, 3 * sum(range(20)))
+        self.assertEqual(profile.stages['save']['count'], 21)
+        self.assertEqual(sorted((slide['slide'], slide['bytesWritten']) for slide in profile.slides),
+                         [(0, 3 * sum(range(0, 20, 2))), (1, 3 * sum(range(1, 20, 2)))])
+
+    def testErrorsAreRaised(self):
+        writer = MediaWriter(threads=2)
+        writer.put(os.path.join(self.tmpDir, 'missing', 'a.png'), b'png')
+        with self.assertRaises(IOError):
+            writer.close()
@@ -0,0 +1,174 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import zlib
+
+
+objectPattern = re.compile(rb'(\d+)\s+\d+\s+obj\b(.*?)(?:\bendobj\b|\bstream\r?\n)', re.DOTALL)
+referencePattern = re.compile(rb'(\d+)\s+\d+\s+R')
+numberPattern = re.compile(rb'[-+]?(?:\d+\.?\d*|\.\d+)')
+
+
+def getEntry(dictionary, key):
+    """Return the value of a key of a pdf dictionary as bytes (or None).
+
+    Only arrays, numbers, names and references are understood, which is
+    all that is needed for the page tree.
+    """
+    match = re.search(rb'/' + key + rb'(?![A-Za-z])\s*(\[[^\]]*\]|\d+\s+\d+\s+R|/[A-Za-z]+|[-+\d.]+)', dictionary)
+    return match.group(1) if match is not None else None
+
+
+def readStream(data, start, dictionary):
+    """Return the decoded data of the stream which starts at `start`, or
+    None if its filter is not understood (only Flate without parameters is).
+
+    The stream is sliced out by its /Length, or up to 'endstream' if the
+    length is an indirect object.
+    """
+    length = getEntry(dictionary, b'Length')
+    if length is not None and length.isdigit():
+        raw = data[start:start + int(length)]
+    else:
+        end = data.find(b'endstream', start)
+        if end < 0:
+            return None
+        raw = data[start:end]
+
+    filters = getEntry(dictionary, b'Filter')
+    if filters is None:
+        return raw
+    if re.sub(rb'[\[\]\s]', b'', filters) != b'/FlateDecode' or getEntry(dictionary, b'DecodeParms'):
+        return None
+    return zlib.decompressobj().decompress(raw)
+
+
+def readObjects(data):
+    """Return {object number: object text} of all objects in a pdf file,
+    including the ones packed into (unfiltered or deflated) object streams."""
+    objects = {}
+    for match in objectPattern.finditer(data):
+        body = match.group(2)
+        objects[int(match.group(1))] = body
+        if re.search(rb'/Type\s*/ObjStm\b', body) is None:
+            continue
+        try:
+            stream = readStream(data, match.end(), body)
+        except zlib.error:
+            continue
+        if stream is None:
+            continue
+        count, first = int(getEntry(body, b'N')), int(getEntry(body, b'First'))
+        header = [int(n) for n in stream[:first].split()][:2 * count]
+        offsets = header[1::2] + [len(stream) - first]
+        for idx, number in enumerate(header[::2]):
+            objects.setdefault(number, stream[first + offsets[idx]:first + offsets[idx + 1]])
+    return objects
+
+
+def readPageSizes(pdfFileName, box='MediaBox'):
+    """Return the (width, height) in points of every page of a pdf.
+
+    The sizes are those of the given box (MediaBox or CropBox; a missing
+    CropBox is the MediaBox) with the /Rotate of the page applied. Returns
+    None if the file cannot be understood, e.g. if it is encrypted.
+    """
+    with open(pdfFileName, 'rb') as f:
+        data = f.read()
+
+    try:
+        objects = readObjects(data)
+
+        def resolve(value):
+            match = referencePattern.match(value) if value is not None else None
+            return objects.get(int(match.group(1))) if match is not None else value
+
+        catalogs = [body for body in objects.values() if re.search(rb'/Type\s*/Catalog\b', body)]
+        pages = []
+
+        def walk(number, inherited, depth):
+            node = objects[number]
+            attributes = dict(inherited)
+            for key in (b'MediaBox', b'CropBox', b'Rotate'):
+                value = resolve(getEntry(node, key))
+                if value is not None:
+                    attributes[key] = value
+            kids = getEntry(node, b'Kids')
+            if kids is not None and depth < 64:
+                for kid in referencePattern.findall(resolve(kids)):
+                    walk(int(kid), attributes, depth + 1)
+            else:
+                pages.append(attributes)
+
+        walk(int(referencePattern.match(getEntry(catalogs[-1], b'Pages')).group(1)), {}, 0)
+
+        sizes = []
+        for attributes in pages:
+            rect = attributes.get(box.encode('ascii')) or attributes[b'MediaBox']
+            x0, y0, x1, y1 = [float(n) for n in numberPattern.findall(rect)[:4]]
+            width, height = abs(x1 - x0), abs(y1 - y0)
+            if int(float(attributes.get(b'Rotate', b'0'))) % 180 != 0:
+                width, height = height, width
+            sizes.append((width, height))
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        return None
+
+    return sizes if sizes else None
+
+
+class TestPageSizes(unittest.TestCase):
+    def testOnVegFoodInJapan(self):
+        sizes = readPageSizes('./slidesimport/test/Veg-food-in-Japan.pdf')
+        self.assertEqual(len(sizes), 31)
+        self.assertEqual(set(sizes), set([(362.835, 272.126)]))
+
+    def testObjectStreamsInheritanceAndRotation(self):
+        page3 = b'<< /Type /Page /Parent 2 0 R /Rotate 90 /CropBox [10 10 110 60] >>'
+        page4 = b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 300 400] >>'
+        header = '3 0 4 {0} '.format(len(page3)).encode('ascii')
+        packed, first = header + page3 + page4, len(header)
+        pdf = (b'%PDF-1.5\n'
+               b'1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n'
+               b'2 0 obj\n<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 /MediaBox [0 0 720 540] >>\nendobj\n'
+               b'5 0 obj\n<< /Type /ObjStm /N 2 /First ' + str(first).encode('ascii') +
+               b' /Filter /FlateDecode >>\nstream\n' + zlib.compress(packed) + b'\nendstream\nendobj\n'
+               b'%%EOF\n')
+        tmpDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tmpDir, 'packed.pdf')
+            with open(fileName, 'wb') as f:
+                f.write(pdf)
+            self.assertEqual(readPageSizes(fileName), [(540.0, 720.0), (300.0, 400.0)])
+            self.assertEqual(readPageSizes(fileName, 'CropBox'), [(50.0, 100.0), (300.0, 400.0)])
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testMupdfObjectStreams(self):
+        # Written by MuPDF with use_objstms: the page tree is only in
+        # (unfiltered) object streams.
+        sizes = readPageSizes('./slidesimport/test/object-streams.pdf')
+        self.assertEqual(len(sizes), 40)
+        self.assertEqual(sizes[:2], [(720.0, 540.0), (720.0, 540.0)])
+        self.assertEqual(sizes[9], (400.0, 300.0))
+
+    def testDeflatedMupdfObjectStreams(self):
+        try:
+            import pymupdf
+        except ImportError:
+            self.skipTest('PyMuPDF is not installed')
+        tmpDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tmpDir, 'deflated.pdf')
+            document = pymupdf.open()
+            for _ in range(400):
+                document.new_page(width=400, height=300)
+            document.save(fileName, use_objstms=True, garbage=3, deflate=True)
+            document.close()
+            self.assertEqual(readPageSizes(fileName), [(400.0, 300.0)] * 400)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testNotAPdf(self):
+        self.assertIsNone(readPageSizes('./slidesimport/test/slide-12.png'))
@@ -1,5 +1,10 @@
 import unittest
+import configparser
+import json
+import os
 import re
+import shutil
+import tempfile
 from io import StringIO
 from collections import namedtuple
 import html
@@ -26,6 +31,122 @@ NotesAndCropsParsing = namedtuple('NotesParsing',
                                    'slidesFollowedByAnswers',
                                    'slidesFollowedByAnswersCrops'])
 
+# Markers in the order in which they are preferred for a card.
+QUESTION_MARKERS = ('Q', 'Q_S', 'S_Q')
+ANSWER_MARKERS = ('A', 'A_S', 'S_A')
+
+# The NotesAndCropsParsing fields which hold the notes and crop of a marker.
+MARKER_FIELDS = [('Q', 'questionsWithoutSlides', None),
+                 ('Q_S', 'questionsFollowedBySlides', 'questionsFollowedBySlidesCrops'),
+                 ('S_Q', 'slidesFollowedByQuestions', 'slidesFollowedByQuestionsCrops'),
+                 ('A', 'answersWithoutSlides', None),
+                 ('A_S', 'answersFollowedBySlides', 'answersFollowedBySlidesCrops'),
+                 ('S_A', 'slidesFollowedByAnswers', 'slidesFollowedByAnswersCrops')]
+MARKER_FIELD_NAMES = dict((marker, (notesField, cropField))
+                          for marker, notesField, cropField in MARKER_FIELDS)
+
+
+class SlideCard(object):
+    """The card made from the notes of one slide.
+
+    Only the question and answer which end up on the card are stored:
+    questionKind and answerKind are the markers used (None if the notes
+    have none, i.e. the full notes and the whole slide are used) and
+    questionCrop and answerCrop are None if no crop was given. The rare
+    notes of other markers are kept in unusedNotes (marker -> (notes, crop))
+    so that the NotesAndCropsParsing fields are available as attributes.
+    """
+    __slots__ = ('slideNum', 'fullNotes',
+                 'questionKind', 'question', 'questionCrop',
+                 'answerKind', 'answer', 'answerCrop',
+                 'unusedNotes')
+
+    def __init__(self, slideNum, fullNotes,
+                 questionKind=None, question=None, questionCrop=None,
+                 answerKind=None, answer=None, answerCrop=None,
+                 unusedNotes=None):
+        self.slideNum = slideNum
+        self.fullNotes = fullNotes
+        self.questionKind = questionKind
+        self.question = question
+        self.questionCrop = questionCrop
+        self.answerKind = answerKind
+        self.answer = answer
+        self.answerCrop = answerCrop
+        self.unusedNotes = unusedNotes
+
+    @classmethod
+    def fromNotes(cls, slideNum, fullNotes, markerNotes, markerCrops):
+        """Makes the card from the joined notes and crops of every marker."""
+        card = cls(slideNum, fullNotes)
+        if not markerNotes:
+            return card
+
+        # Crops only come with marker lines, so every marker is in markerNotes.
+        for marker in QUESTION_MARKERS + ANSWER_MARKERS:
+            if marker not in markerNotes:
+                continue
+            notes = markerNotes[marker]
+            crop = markerCrops.get(marker)
+
+            if notes != '' and marker in QUESTION_MARKERS and card.questionKind is None:
+                card.questionKind, card.question, card.questionCrop = marker, notes, crop
+            elif notes != '' and marker in ANSWER_MARKERS and card.answerKind is None:
+                card.answerKind, card.answer, card.answerCrop = marker, notes, crop
+            elif notes != '' or crop is not None:
+                if card.unusedNotes is None:
+                    card.unusedNotes = {}
+                card.unusedNotes[marker] = (notes, crop)
+
+        return card
+
+    def getMarkerNotes(self, marker):
+        """The notes given with a marker, '' if there are none."""
+        if marker == self.questionKind:
+            return self.question
+        if marker == self.answerKind:
+            return self.answer
+        if self.unusedNotes is not None and marker in self.unusedNotes:
+            return self.unusedNotes[marker][0]
+        return ''
+
+    def getMarkerCrop(self, marker):
+        """The crop given with a marker, [] if there is none."""
+        if marker == self.questionKind:
+            crop = self.questionCrop
+        elif marker == self.answerKind:
+            crop = self.answerCrop
+        elif self.unusedNotes is not None and marker in self.unusedNotes:
+            crop = self.unusedNotes[marker][1]
+        else:
+            crop = None
+        return crop if crop is not None else []
+
+    def __eq__(self, other):
+        return (isinstance(other, SlideCard) and
+                all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'SlideCard({0})'.format(', '.join('{0}={1!r}'.format(slot, getattr(self, slot))
+                                                 for slot in self.__slots__
+                                                 if getattr(self, slot) is not None))
+
+
+# Expose the NotesAndCropsParsing fields of a single slide on SlideCard.
+def _markerNotesProperty(marker):
+    return property(lambda self: self.getMarkerNotes(marker))
+
+def _markerCropProperty(marker):
+    return property(lambda self: self.getMarkerCrop(marker))
+
+for _marker, _notesField, _cropField in MARKER_FIELDS:
+    setattr(SlideCard, _notesField, _markerNotesProperty(_marker))
+    if _cropField is not None:
+        setattr(SlideCard, _cropField, _markerCropProperty(_marker))
+
 class ParseException(BaseException):
     def __init__(self, lineNumber, line):
         self.line = line
@@ -35,272 +156,381 @@ class ParseException(BaseException):
         super(ParseException, self).__init__(message)
 
 
+# The crop codes and the part of the slide they stand for, as
+# [[wmin, wmax], [hmin, hmax]] in percent.
+CROP_CODES_TABLE = [
+    # 'All' of the slide, or the 'whole' of the slide
+    (('a', 'w'), [[0, 100], [0, 100]]),
+    # 'Top' or 'top half' of the slide
+    (('t', 'th'), [[0, 100], [0, 50]]),
+    # 'vertical middle half' of the slide
+    (('vmh',), [[0, 100], [25, 75]]),
+    # 'Bottom' or 'bottom half' of the slide
+    (('b', 'bh'), [[0, 100], [50, 100]]),
+    # 'Left' or 'left half' of the slide
+    (('l', 'lh'), [[0, 50], [0, 100]]),
+    # 'middle half' or 'horizontal middle half' of the slide
+    (('mh', 'hmh'), [[25, 75], [0, 100]]),
+    # 'Right' or 'right half' of the slide
+    (('r', 'rh'), [[50, 100], [0, 100]]),
+    # 'middle' or 'centre' or 'middle quarter' or 'centre quarter' of the slide
+    (('m', 'c', 'mq', 'cq'), [[25, 75], [25, 75]]),
+    # 'Top-left' or 'top-left quarter' of the slide
+    (('tl', 'tlq'), [[0, 50], [0, 50]]),
+    # 'Top-right' or 'top-right quarter' of the slide
+    (('tr', 'trq'), [[50, 100], [0, 50]]),
+    # 'Bottom-left' or 'bottom-left quarter' of the slide
+    (('bl', 'blq'), [[0, 50], [50, 100]]),
+    # 'Bottom-right' or 'bottom-right quarter' of the slide
+    (('br', 'brq'), [[50, 100], [50, 100]]),
+    # 'Top third' of the slide
+    (('tt',), [[0, 100], [0, 33]]),
+    # 'Vertical middle third' of the slide
+    (('vmt',), [[0, 100], [33, 66]]),
+    # 'Bottom third' of the slide
+    (('bt',), [[0, 100], [66, 100]]),
+    # 'Left third' of the slide
+    (('lt',), [[0, 33], [0, 100]]),
+    # 'middle third' or 'horizontal middle third' of the slide
+    (('mt', 'hmt'), [[33, 66], [0, 100]]),
+    # 'right third' of the slide
+    (('rt',), [[66, 100], [0, 100]]),
+]
+
+CROP_CODES = dict((code, box) for codes, box in CROP_CODES_TABLE for code in codes)
+
+WHOLE_SLIDE = [[0, 100], [0, 100]]
+
+
+def validateCropPreset(name, box):
+    """Check a user-defined crop code, raising ValueError if it is unusable.
+
+    The name must be a word starting with a letter which is not a built-in
+    code; the box must be [[wmin, wmax], [hmin, hmax]] with whole percents
+    and min < max.
+    """
+    if re.match(r'^[a-zA-Z]\w*$', name) is None:
+        raise ValueError('The crop preset "{0}" must be a word starting with a letter.'.format(name))
+    if name.lower() in CROP_CODES:
+        raise ValueError('The crop preset "{0}" would replace a built-in crop code.'.format(name))
+    try:
+        isValid = len(box) == 2 and all(len(pair) == 2 and
+                                        all(isinstance(n, int) and 0 <= n <= 100 for n in pair) and
+                                        pair[0] < pair[1]
+                                        for pair in box)
+    except TypeError:
+        isValid = False
+    if not isValid:
+        raise ValueError('The crop preset "{0}" must be like [[wmin, wmax], [hmin, hmax]] '
+                         'with percents from 0 to 100, got: {1}'.format(name, box))
+
+
+def loadCropPresets(fileName):
+    """Read user-defined crop codes from the [crops] section of an ini file,
+    e.g. `logo = [[80, 100], [0, 15]]`.
+
+    Returns a dict of the lower-cased names to their boxes. Raises IOError
+    if the file cannot be read and ValueError for invalid presets.
+    """
+    config = configparser.ConfigParser()
+    try:
+        with open(fileName, 'r') as f:
+            config.read_file(f)
+    except configparser.Error as e:
+        raise ValueError('Cannot read the crop presets in {0}: {1}'.format(fileName, e))
+    if not config.has_section('crops'):
+        raise ValueError('{0} has no [crops] section.'.format(fileName))
+
+    presets = {}
+    for name, value in config.items('crops'):
+        try:
+            box = json.loads(value)
+        except ValueError:
+            raise ValueError('The crop preset "{0}" in {1} is not a list: {2}'.format(name, fileName, value))
+        validateCropPreset(name, box)
+        presets[name.lower()] = box
+    return presets
+
+
+class CropParser(object):
+    """Turns the crop strings of the notes into crop percentages.
+
+    Known are the built-in codes (see CROP_CODES), the given presets and
+    numerical crops. Since the same few crops are used over and over, the
+    results for up to `cacheSize` distinct strings are remembered.
+    """
+
+    cropNumbers = re.compile(r'^\s*(?P<wmin>\d.*)[-|:](?P<wmax>\d.*),\s*(?P<hmin>\d.*)[-|:](?P<hmax>\d.*)\s*')
+    cropCode = re.compile(r'^\s*(?P<code>[a-zA-Z].*)\s*')
+
+    def __init__(self, presets=None, cacheSize=4096):
+        self.codes = dict(CROP_CODES)
+        for name, box in (presets or {}).items():
+            validateCropPreset(name, box)
+            self.codes[name.lower()] = box
+        self.cacheSize = cacheSize
+        self.cache = {}
+
+    def parse(self, cropString):
+        """Return [[wmin, wmax], [hmin, hmax]] for a crop string; the whole
+        slide if it cannot be understood."""
+        crop = self.cache.get(cropString)
+        if crop is None:
+            crop = self.parseUncached(cropString)
+            if len(self.cache) >= self.cacheSize:
+                self.cache.clear()
+            if self.cacheSize > 0:
+                self.cache[cropString] = crop
+        # Callers own the lists they get.
+        return [list(crop[0]), list(crop[1])]
+
+    def parseUncached(self, cropString):
+        cropStringNumParsing = self.cropNumbers.match(cropString)
+
+        # First check if we're dealing with numerical values
+        if cropStringNumParsing is None:
+            # If not, check if we're dealing with alphabetic codes, e.g. 'tl' for 'top-left', etc.
+            cropStringAlphaParsing = self.cropCode.match(cropString)
+            if cropStringAlphaParsing is None:
+                # If we can't parse the string, return crop percentage values that encapsulate the entire slide image.
+                return WHOLE_SLIDE
+            # Fall back to default values for unknown codes
+            return self.codes.get(cropStringAlphaParsing.group('code').lower(), WHOLE_SLIDE)
+
+        wmin = int(cropStringNumParsing.group('wmin'))
+        wmax = int(cropStringNumParsing.group('wmax'))
+        hmin = int(cropStringNumParsing.group('hmin'))
+        hmax = int(cropStringNumParsing.group('hmax'))
+
+        # Some error checking
+        if wmax <= wmin:
+            wmin = 0
+            wmax = 100
+        if hmax <= hmin:
+            hmin = 0
+            hmax = 100
+
+        return [[wmin, wmax], [hmin, hmax]]
+
+
+DEFAULT_CROP_PARSER = CropParser()
+
+
 class Parser:
     slideNumberLine = re.compile(r'^(#.*)?Slide (?P<slideNum>\d+):')
-    fullNotes = re.compile(r'^\s+(?P<line>.*)$')
-    questionWithoutSlideLine = re.compile(r'^\s+Q:\s*(?P<line>.*)$')
-    questionFollowedBySlideLine = re.compile(r'^\s+Q_S\s*(?:\[(?P<crop>.*?)\].*?)?\s*:\s*(?P<line>.*)$')
-    slideFollowedByQuestionLine = re.compile(r'^\s+S_Q\s*(?:\[(?P<crop>.*?)\].*?)?\s*:\s*(?P<line>.*)$')
-    answerWithoutSlideLine = re.compile(r'^\s+A:\s*(?P<line>.*)$')
-    answerFollowedBySlideLine = re.compile(r'^\s+A_S\s*(?:\[(?P<crop>.*?)\].*?)?\s*:\s*(?P<line>.*)$')
-    slideFollowedByAnswerLine = re.compile(r'^\s+S_A\s*(?:\[(?P<crop>.*?)\].*?)?\s*:\s*(?P<line>.*)$')
-
-    def __init__(self, questionsBuffer):
+    # Classifies an indented line in one go: 'full' is the whole note and,
+    # if the line starts with a marker, 'line' is the text after it. The
+    # whitespace after the marker must not swallow the trailing newline,
+    # otherwise it would end up in 'full'.
+    notesLine = re.compile(r'^\s+(?P<full>'
+                           r'(?:(?P<plain>[QA]):'
+                           r'|(?P<slide>Q_S|S_Q|A_S|S_A)\s*(?:\[(?P<crop>.*?)\].*?)?\s*:'
+                           r')[^\S\n]*(?P<line>.*)'
+                           r'|.*)$')
+
+    # How iterSlides treats a slide which is mentioned more than once.
+    MERGE_DUPLICATES = 'merge'
+    SEPARATE_DUPLICATES = 'separate'
+    FORBID_DUPLICATES = 'forbid'
+
+    def __init__(self, questionsBuffer, cropParser=None):
         self.questionsBuffer = questionsBuffer
-        slideQList = {}
-        slideQWSList = {}
-        slideQFBSList = {}
-        slideQFBSCropList = {}
-        slideSFBQList = {}
-        slideSFBQCropList = {}
-        slideAWSList = {}
-        slideAFBSList = {}
-        slideAFBSCropList = {}
-        slideSFBAList = {}
-        slideSFBACropList = {}
+        self.slideCards = {}
+        for card in self.iterSlides(self.questionsBuffer, self.MERGE_DUPLICATES, cropParser):
+            self.slideCards[card.slideNum] = card
+        self.notesAndCropsParsing = None
+
+    @classmethod
+    def iterSlides(cls, questionsBuffer, duplicates=MERGE_DUPLICATES, cropParser=None):
+        """Yields a SlideCard for every slide in the notes.
+
+        Crops are parsed by cropParser (a CropParser) if one is given, for
+        instance one which knows the presets of the user.
+
+        The buffer is read lazily. With SEPARATE_DUPLICATES every block of
+        notes is yielded as soon as it ends, even if its slide was mentioned
+        before. FORBID_DUPLICATES does the same but raises a ParseException
+        when a slide is mentioned again. MERGE_DUPLICATES joins all the
+        mentions of a slide (like getNotesAndCropsParsing does), so nothing
+        can be yielded before the whole buffer has been read.
+        """
+        if duplicates == cls.SEPARATE_DUPLICATES:
+            for block in cls.iterBlocks(questionsBuffer, cropParser):
+                yield cls.makeSlideCard(*block)
+
+        elif duplicates == cls.FORBID_DUPLICATES:
+            seenSlides = set()
+            for block in cls.iterBlocks(questionsBuffer, cropParser):
+                slideNum, lineNumber, line = block[0], block[1], block[2]
+                if slideNum in seenSlides:
+                    raise ParseException(lineNumber, line)
+                seenSlides.add(slideNum)
+                yield cls.makeSlideCard(*block)
+
+        elif duplicates == cls.MERGE_DUPLICATES:
+            mergedBlocks = {}
+            for slideNum, _, _, notes, markerNotes, markerCrops in cls.iterBlocks(questionsBuffer, cropParser):
+                if slideNum not in mergedBlocks:
+                    mergedBlocks[slideNum] = (slideNum, None, None, notes, markerNotes, markerCrops)
+                    continue
+
+                _, _, _, mergedNotes, mergedMarkerNotes, mergedMarkerCrops = mergedBlocks[slideNum]
+                mergedNotes.extend(notes)
+                for marker, lines in markerNotes.items():
+                    mergedMarkerNotes.setdefault(marker, []).extend(lines)
+                for marker, crop in markerCrops.items():
+                    mergedMarkerCrops.setdefault(marker, crop)
+
+            for block in mergedBlocks.values():
+                yield cls.makeSlideCard(*block)
 
+        else:
+            raise ValueError('Unknown duplicates mode: {0}'.format(duplicates))
+
+    @classmethod
+    def iterBlocks(cls, questionsBuffer, cropParser=None, errors=None):
+        """Yields the notes under every 'Slide N:' line which has any.
+
+        Every block is a tuple (slideNum, lineNumber, line, notes,
+        markerNotes, markerCrops), where lineNumber and line are those of
+        the 'Slide N:' line, notes is the list of all lines, markerNotes
+        maps markers to their lines and markerCrops maps markers to the
+        crop of the first of their lines which has one.
+
+        A line which cannot be parsed raises a ParseException, unless a list
+        of errors is given: the exception is appended to it then and the
+        line is skipped.
+        """
+        parseCrop = cropParser.parse if cropParser is not None else cls.parseCrop
+        block = None
         slideNum = None
-        for idx, line in enumerate(self.questionsBuffer):
+        for idx, line in enumerate(questionsBuffer):
             lineNumber = idx + 1
             if len(line.strip()) == 0:
                 continue
 
             if slideNum is not None:
-                lineMatch = self.fullNotes.match(line)
-                questionWithoutSlideLineMatch = self.questionWithoutSlideLine.match(line)
-                questionFollowedBySlideLineMatch = self.questionFollowedBySlideLine.match(line)
-                slideFollowedByQuestionLineMatch = self.slideFollowedByQuestionLine.match(line)
-                answerWithoutSlideLineMatch = self.answerWithoutSlideLine.match(line)
-                answerFollowedBySlideLineMatch = self.answerFollowedBySlideLine.match(line)
-                slideFollowedByAnswerLineMatch = self.slideFollowedByAnswerLine.match(line)
+                lineMatch = cls.notesLine.match(line)
             else:
                 lineMatch = None
-                questionWithoutSlideLineMatch = None
-                questionFollowedBySlideLineMatch = None
-                slideFollowedByQuestionLineMatch = None
-                answerWithoutSlideLineMatch = None
-                answerFollowedBySlideLineMatch = None
-                slideFollowedByAnswerLineMatch = None
 
             if lineMatch is not None:
-                if slideNum not in slideQList:
-                    slideQList[slideNum] = []
-                    slideQWSList[slideNum] = []
-                    slideQFBSList[slideNum] = []
-                    slideQFBSCropList[slideNum] = []
-                    slideSFBQList[slideNum] = []
-                    slideSFBQCropList[slideNum] = []
-                    slideAWSList[slideNum] = []
-                    slideAFBSList[slideNum] = []
-                    slideAFBSCropList[slideNum] = []
-                    slideSFBAList[slideNum] = []
-                    slideSFBACropList[slideNum] = []
-
-                slideQList[slideNum].append(html.escape(lineMatch.group('line')))
-
-                questionFollowedBySlideCropParsing = []
-                slideFollowedByQuestionCropParsing = []
-                answerFollowedBySlideCropParsing = []
-                slideFollowedByAnswerCropParsing = []
-
-                if questionWithoutSlideLineMatch is not None:
-                    slideQWSList[slideNum].append(html.escape(questionWithoutSlideLineMatch.group('line')))
-
-                if questionFollowedBySlideLineMatch is not None:
-                    slideQFBSList[slideNum].append(html.escape(questionFollowedBySlideLineMatch.group('line')))
-
-                    questionFollowedBySlideCropString = questionFollowedBySlideLineMatch.group('crop')
-                    if questionFollowedBySlideCropString is not None:
-                        questionFollowedBySlideCropParsing = self.parseCrop(questionFollowedBySlideCropString)
-
-                if slideFollowedByQuestionLineMatch is not None:
-                    slideSFBQList[slideNum].append(html.escape(slideFollowedByQuestionLineMatch.group('line')))
-
-                    slideFollowedByQuestionCropString = slideFollowedByQuestionLineMatch.group('crop')
-                    if slideFollowedByQuestionCropString is not None:
-                        slideFollowedByQuestionCropParsing = self.parseCrop(slideFollowedByQuestionCropString)
-
-                if answerWithoutSlideLineMatch is not None:
-                    slideAWSList[slideNum].append(html.escape(answerWithoutSlideLineMatch.group('line')))
-
-                if answerFollowedBySlideLineMatch is not None:
-                    slideAFBSList[slideNum].append(html.escape(answerFollowedBySlideLineMatch.group('line')))
-
-                    answerFollowedBySlideCropString = answerFollowedBySlideLineMatch.group('crop')
-                    if answerFollowedBySlideCropString is not None:
-                        answerFollowedBySlideCropParsing = self.parseCrop(answerFollowedBySlideCropString)
-
-                if slideFollowedByAnswerLineMatch is not None:
-                    slideSFBAList[slideNum].append(html.escape(slideFollowedByAnswerLineMatch.group('line')))
-
-                    slideFollowedByAnswerCropString = slideFollowedByAnswerLineMatch.group('crop')
-                    if slideFollowedByAnswerCropString is not None:
-                        slideFollowedByAnswerCropParsing = self.parseCrop(slideFollowedByAnswerCropString)
-
-                # For now, just to get this working, unlike with the notes/questions/answers lists,
-                # we are not appending to the crop values list for the slide,
-                # but just assigning it to whatever the last input crop values were.
-                # It might be best to do things this way anyway, because in the current incarnation
-                # of system, we're only able to use one slide, so having multiple
-                # crop values is pointless.
-                if slideQFBSCropList[slideNum] == []:
-                    slideQFBSCropList[slideNum] = questionFollowedBySlideCropParsing
-                if slideSFBQCropList[slideNum] == []:
-                    slideSFBQCropList[slideNum] = slideFollowedByQuestionCropParsing
-                if slideAFBSCropList[slideNum] == []:
-                    slideAFBSCropList[slideNum] = answerFollowedBySlideCropParsing
-                if slideSFBACropList[slideNum] == []:
-                    slideSFBACropList[slideNum] = slideFollowedByAnswerCropParsing
+                notes, markerNotes, markerCrops = block[3], block[4], block[5]
+                notes.append(html.escape(lineMatch.group('full')))
+
+                marker = lineMatch.group('plain') or lineMatch.group('slide')
+                if marker is not None:
+                    if marker not in markerNotes:
+                        markerNotes[marker] = []
+                    markerNotes[marker].append(html.escape(lineMatch.group('line')))
+
+                    # Only one slide can be shown per marker, so only the
+                    # first crop given for it is used.
+                    cropString = lineMatch.group('crop')
+                    if cropString is not None and marker not in markerCrops:
+                        markerCrops[marker] = parseCrop(cropString)
 
             else:
-                slideNumMatch = self.slideNumberLine.match(line)
+                slideNumMatch = cls.slideNumberLine.match(line)
                 if slideNumMatch:
+                    # Empty slides are not recorded
+                    if block is not None and len(block[3]) > 0:
+                        yield block
                     slideNum = int(slideNumMatch.group('slideNum'))
+                    block = (slideNum, lineNumber, line, [], {}, {})
+                elif errors is not None:
+                    errors.append(ParseException(lineNumber, line))
                 else:
                     raise ParseException(lineNumber, line)
 
-        self.fullNotes = self.dictOfListsToDict(slideQList)
-        self.slideQuestionsWithoutSlides = self.dictOfListsToDict(slideQWSList)
-        self.slideQuestionsFollowedBySlides = self.dictOfListsToDict(slideQFBSList)
-        self.slideQuestionsFollowedBySlidesCrops = dict(slideQFBSCropList)
-        self.slideSlidesFollowedByQuestions = self.dictOfListsToDict(slideSFBQList)
-        self.slideSlidesFollowedByQuestionsCrops = dict(slideSFBQCropList)
-        self.slideAnswersWithoutSlides = self.dictOfListsToDict(slideAWSList)
-        self.slideAnswersFollowedBySlides = self.dictOfListsToDict(slideAFBSList)
-        self.slideAnswersFollowedBySlidesCrops = dict(slideAFBSCropList)
-        self.slideSlidesFollowedByAnswers = self.dictOfListsToDict(slideSFBAList)
-        self.slideSlidesFollowedByAnswersCrops = dict(slideSFBACropList)
+        if block is not None and len(block[3]) > 0:
+            yield block
+
+    @classmethod
+    def findErrors(cls, questionsBuffer, cropParser=None):
+        """Returns a ParseException for every line of the notes which cannot
+        be parsed, in order; empty if the notes are fine."""
+        errors = []
+        for _ in cls.iterBlocks(questionsBuffer, cropParser, errors):
+            pass
+        return errors
+
+    @staticmethod
+    def makeSlideCard(slideNum, lineNumber, line, notes, markerNotes, markerCrops):
+        """Turns a block from iterBlocks into a SlideCard."""
+        return SlideCard.fromNotes(slideNum,
+                                   '<br><br>'.join(notes),
+                                   dict((marker, '<br><br>'.join(lines))
+                                        for marker, lines in markerNotes.items()),
+                                   markerCrops)
 
     def dictOfListsToDict(self, x):
         """Converts a dict of lists of strings to a dict of strings separated by HTML line breaks."""
         return {k: '<br><br>'.join(v) for k, v in x.items()}
 
-    def parseCrop(self, cropString):
-        """Parses a slide crop string to a list of crop percentage numbers formatted as [[wmin, wmax], [hmin, hmax]]."""
-
-        cropStringNumParser = re.compile(r'^\s*(?P<wmin>\d.*)[-|:](?P<wmax>\d.*),\s*(?P<hmin>\d.*)[-|:](?P<hmax>\d.*)\s*')
-        cropStringNumParsing = cropStringNumParser.match(cropString)
-        cropStringAlphaParser = re.compile(r'^\s*(?P<code>[a-zA-Z].*)\s*')
-        cropStringAlphaParsing = cropStringAlphaParser.match(cropString)
-
-        # First check if we're dealing with numerical values
-        if cropStringNumParsing is None:
-            # If not, check if we're dealing with alphabetic codes, e.g. 'tl' for 'top-left', etc.
-            if cropStringAlphaParsing is None:
-                # If we can't parse the string, return crop percentage values that encapsulate the entire slide image.
-                cropNumList = [[0,100], [0,100]]
-            else:
-                code = cropStringAlphaParsing.group('code').lower()
-
-                # 'All' of the slide, or the 'whole' of the slide
-                if code == 'a' or code == 'w':
-                    cropNumList = [[0, 100], [0, 100]]
-                # 'Top' or 'top half' of the slide
-                elif code == 't' or code == 'th':
-                    cropNumList = [[0, 100], [0, 50]]
-                # 'vertical middle half' of the slide
-                elif code == 'vmh':
-                    cropNumList = [[0, 100], [25, 75]]
-                # 'Bottom' or 'bottom half' of the slide
-                elif code == 'b' or code == 'bh':
-                    cropNumList = [[0, 100], [50, 100]]
-                # 'Left' or 'left half' of the slide
-                elif code == 'l' or code == 'lh':
-                    cropNumList = [[0, 50], [0, 100]]
-                # 'middle half' or 'horizontal middle half' of the slide
-                elif code == 'mh' or code == 'hmh':
-                    cropNumList = [[25, 75], [0, 100]]
-                # 'Right' or 'right half' of the slide
-                elif code == 'r' or code == 'rh':
-                    cropNumList = [[50, 100], [0, 100]]
-                # 'middle' or 'centre' or 'middle quarter' or 'centre quarter' of the slide
-                elif code == 'm' or code == 'c' or code == 'mq' or code == 'cq':
-                    cropNumList = [[25, 75], [25, 75]]
-                # 'Top-left' or 'top-left quarter' of the slide
-                elif code == 'tl' or code == 'tlq':
-                    cropNumList = [[0, 50], [0, 50]]
-                # 'Top-right' or 'top-right quarter' of the slide
-                elif code == 'tr' or code == 'trq':
-                    cropNumList = [[50, 100], [0, 50]]
-                # 'Bottom-left' or 'bottom-left quarter' of the slide
-                elif code == 'bl' or code == 'blq':
-                    cropNumList = [[0, 50], [50, 100]]
-                # 'Bottom-right' or 'bottom-right quarter' of the slide
-                elif code == 'br' or code == 'brq':
-                    cropNumList = [[50, 100], [50, 100]]
-                # 'Top third' of the slide
-                elif code == 'tt':
-                    cropNumList = [[0, 100], [0, 33]]
-                # 'Vertical middle third' of the slide
-                elif code == 'vmt':
-                    cropNumList = [[0, 100], [33, 66]]
-                # 'Bottom third' of the slide
-                elif code == 'bt':
-                    cropNumList = [[0, 100], [66, 100]]
-                # 'Left third' of the slide
-                elif code == 'lt':
-                    cropNumList = [[0, 33], [0, 100]]
-                # 'middle third' or 'horizontal middle third' of the slide
-                elif code == 'mt' or code == 'hmt':
-                    cropNumList = [[33, 66], [0, 100]]
-                # 'right third' of the slide
-                elif code == 'rt':
-                    cropNumList = [[66, 100], [0, 100]]
-                # Fall back to default values
-                else:
-                    cropNumList = [[0,100], [0,100]]
-
-        else:
-            wmin = int(cropStringNumParsing.group('wmin'))
-            wmax = int(cropStringNumParsing.group('wmax'))
-            hmin = int(cropStringNumParsing.group('hmin'))
-            hmax = int(cropStringNumParsing.group('hmax'))
-
-            # Some error checking
-            if wmax <= wmin:
-                wmin = 0
-                wmax = 100
-            if hmax <= hmin:
-                hmin = 0
-                hmax = 100
+    @staticmethod
+    def parseCrop(cropString):
+        """Parses a slide crop string to a list of crop percentage numbers formatted as [[wmin, wmax], [hmin, hmax]].
 
-            cropNumList = [[wmin, wmax], [hmin, hmax]]
+        Only the built-in codes are known; see CropParser for presets.
+        """
+        return DEFAULT_CROP_PARSER.parse(cropString)
 
-        return cropNumList
+    def getSlideCards(self):
+        """Gets the cards of all slides, in the order the slides first appear in the notes."""
+        return list(self.slideCards.values())
 
     def getQuestions(self):
         """Gets a dictionary of questions. (left here for backwards compatibility)"""
-        return self.fullNotes
+        return self.getNotesAndCropsParsing().fullNotes
 
     def getNotesParsing(self):
         """Gets dictionaries of various question and answer parsings."""
 
-        notesParsing = NotesParsing(self.fullNotes,
-                                    self.slideQuestionsWithoutSlides,
-                                    self.slideQuestionsFollowedBySlides,
-                                    self.slideSlidesFollowedByQuestions,
-                                    self.slideAnswersWithoutSlides,
-                                    self.slideAnswersFollowedBySlides,
-                                    self.slideSlidesFollowedByAnswers)
+        n = self.getNotesAndCropsParsing()
+        notesParsing = NotesParsing(n.fullNotes,
+                                    n.questionsWithoutSlides,
+                                    n.questionsFollowedBySlides,
+                                    n.slidesFollowedByQuestions,
+                                    n.answersWithoutSlides,
+                                    n.answersFollowedBySlides,
+                                    n.slidesFollowedByAnswers)
 
         return notesParsing
 
     def getNotesAndCropsParsing(self):
-        """Gets dictionaries of various question and answer parsings, as well as slide crop values."""
+        """Gets dictionaries of various question and answer parsings, as well as slide crop values.
 
-        notesAndCropsParsing = NotesAndCropsParsing(self.fullNotes,
-                                                    self.slideQuestionsWithoutSlides,
-                                                    self.slideQuestionsFollowedBySlides,
-                                                    self.slideQuestionsFollowedBySlidesCrops,
-                                                    self.slideSlidesFollowedByQuestions,
-                                                    self.slideSlidesFollowedByQuestionsCrops,
-                                                    self.slideAnswersWithoutSlides,
-                                                    self.slideAnswersFollowedBySlides,
-                                                    self.slideAnswersFollowedBySlidesCrops,
-                                                    self.slideSlidesFollowedByAnswers,
-                                                    self.slideSlidesFollowedByAnswersCrops)
+        The dictionaries are built from the slide cards on first use.
+        """
 
-        return notesAndCropsParsing
+        if self.notesAndCropsParsing is None:
+            # Start with every marker absent and fill in the ones present.
+            fields = {}
+            for _, notesField, cropField in MARKER_FIELDS:
+                fields[notesField] = dict.fromkeys(self.slideCards, '')
+                if cropField is not None:
+                    fields[cropField] = {slideNum: [] for slideNum in self.slideCards}
+            fields['fullNotes'] = {slideNum: card.fullNotes for slideNum, card in self.slideCards.items()}
+
+            for slideNum, card in self.slideCards.items():
+                present = []
+                if card.questionKind is not None:
+                    present.append((card.questionKind, card.question, card.questionCrop))
+                if card.answerKind is not None:
+                    present.append((card.answerKind, card.answer, card.answerCrop))
+                if card.unusedNotes is not None:
+                    present.extend((marker, notes, crop) for marker, (notes, crop) in card.unusedNotes.items())
+
+                for marker, notes, crop in present:
+                    notesField, cropField = MARKER_FIELD_NAMES[marker]
+                    fields[notesField][slideNum] = notes
+                    if crop is not None:
+                        fields[cropField][slideNum] = crop
+
+            self.notesAndCropsParsing = NotesAndCropsParsing(**fields)
+
+        return self.notesAndCropsParsing
 
 
 singleSlide = u'''Slide 1:
@@ -890,3 +1120,85 @@ class TestParser(unittest.TestCase):
         self.assertEqual(s_a[1], 'Answer')
         self.assertEqual(s_a_c[1], [[0,100], [50,100]])
 
+
+    def testCropCodes(self):
+        self.assertEqual(Parser.parseCrop('vmt'), [[0, 100], [33, 66]])
+        self.assertEqual(Parser.parseCrop('BRQ'), [[50, 100], [50, 100]])
+        self.assertEqual(Parser.parseCrop('nonesuch'), [[0, 100], [0, 100]])
+        # The remembered crops are not shared with the callers.
+        Parser.parseCrop('tl')[0][0] = 42
+        self.assertEqual(Parser.parseCrop('tl'), [[0, 50], [0, 50]])
+
+    def testCropPresets(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tmpDir, 'presets.ini')
+            with open(fileName, 'w') as f:
+                f.write('[crops]\nlogo = [[80, 100], [0, 15]]\n')
+            cropParser = CropParser(loadCropPresets(fileName))
+            p = Parser(StringIO(u'Slide 1:\n    Q_S[logo]: Question\n    S_A[tl]: Answer\n'), cropParser)
+            card = p.getSlideCards()[0]
+            self.assertEqual(card.questionCrop, [[80, 100], [0, 15]])
+            self.assertEqual(card.answerCrop, [[0, 50], [0, 50]])
+
+            for preset in ['t = [[0, 100], [0, 10]]', 'logo = [[80, 100]]',
+                           'logo = [[80, 100], [15, 0]]', 'logo = [[80, 100], [0, 150]]',
+                           'logo = top']:
+                with open(fileName, 'w') as f:
+                    f.write('[crops]\n' + preset + '\n')
+                with self.assertRaises(ValueError):
+                    loadCropPresets(fileName)
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testIterSlidesMergesDuplicates(self):
+        slides = list(Parser.iterSlides(StringIO(multipleSlideMentionsQAndA)))
+
+        self.assertEqual([s.slideNum for s in slides], [1, 2])
+        self.assertEqual(slides[0].questionsWithoutSlides, 'Question-a<br><br>Question-c')
+        self.assertEqual(slides[0].answersWithoutSlides, 'Answer-a<br><br>Answer-c')
+
+    def testIterSlidesSeparateDuplicates(self):
+        slides = list(Parser.iterSlides(StringIO(multipleSlideMentionsQAndA),
+                                        Parser.SEPARATE_DUPLICATES))
+
+        self.assertEqual([s.slideNum for s in slides], [1, 2, 1])
+        self.assertEqual(slides[0].questionsWithoutSlides, 'Question-a')
+        self.assertEqual(slides[2].questionsWithoutSlides, 'Question-c')
+
+    def testIterSlidesForbidDuplicates(self):
+        slides = Parser.iterSlides(StringIO(multipleSlideMentionsQAndA),
+                                   Parser.FORBID_DUPLICATES)
+
+        self.assertEqual(next(slides).slideNum, 1)
+        self.assertEqual(next(slides).slideNum, 2)
+        with self.assertRaises(ParseException) as cm:
+            next(slides)
+        self.assertEqual(cm.exception.lineNumber, 11)
+
+    def testIterSlidesIsLazy(self):
+        linesRead = []
+        def lines():
+            for line in StringIO(singleSlideS_QAndS_AAlphabeticalCrop + multipleSlideQAndA):
+                linesRead.append(line)
+                yield line
+
+        slides = Parser.iterSlides(lines(), Parser.SEPARATE_DUPLICATES)
+        slide = next(slides)
+
+        # The first slide is complete as soon as the next one starts.
+        self.assertEqual(len(linesRead), 4)
+        self.assertEqual(slide.slideNum, 1)
+        self.assertEqual(slide.slidesFollowedByQuestions, 'Question')
+        self.assertEqual(slide.slidesFollowedByQuestionsCrops, [[0, 100], [0, 50]])
+        self.assertEqual(slide.slidesFollowedByAnswersCrops, [[0, 100], [50, 100]])
+        self.assertEqual(slide.answersWithoutSlides, '')
+        self.assertEqual(len(list(slides)), 2)
+
+    def testFindErrors(self):
+        notes = 'Preamble\n' + singleSlideQAndA + 'Not a slide line\nSlide 3:\n    Q: Question\n'
+        errors = Parser.findErrors(StringIO(notes))
+
+        self.assertEqual([e.lineNumber for e in errors], [1, 5])
+        self.assertEqual(errors[1].line, 'Not a slide line\n')
+        self.assertEqual(Parser.findErrors(StringIO(multipleSlideQAndA)), [])
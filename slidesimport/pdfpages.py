@@ -1,29 +1,291 @@
 from wand.image import Image
+from collections import OrderedDict
+from .rendercache import RenderCache, hashFile
+from .profiling import Profile, NullProfile
+from .renderers import WandRenderer
+from .mediaformat import MediaFormat
 import unittest
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Densities computed from the size of a page are only used within this
+# factor of the fixed resolution; a page size read wrong (e.g. a tiny
+# MediaBox) must not make the renderer rasterize an enormous image.
+MAX_DENSITY_FACTOR = 8
+
+def imageBytes(img):
+    """Approximate number of bytes an uncompressed RGBA wand image occupies."""
+    return img.width * img.height * 4
+
 
 class PdfPages:
-    def __init__(self, pdfFileName, resolution=(120, 120)):
-        self.pdf = Image(filename=pdfFileName, resolution=resolution)
+    def __init__(self, pdfFileName, resolution=(120, 120), lazy=False, maxLoadedPages=8,
+                 resizedCacheBytes=64 * 1024 * 1024, renderCache=None, profile=None,
+                 renderer=None, fitToWidth=True, renderRegions=False, mediaFormat=None,
+                 loadedPagesBytes=None):
+        """Open the pdf file.
 
-    def getPageAsPng(self, pageNumber, width=640):
-        """Return the given page as a png wand.image.Image."""
-        # The page numbers are indexed with base 0, while page numbers start
-        # from 1.
-        img = Image(image = self.pdf.sequence[pageNumber - 1])
-        img.resize(width, int(width * img.height / (1.0 * img.width)))
-        return img.convert('png')
-    
-    def getCroppedPageAsPng(self, pageNumber, cropPercentValues, width=640):
-        """Return the given page as a cropped png wand.image.Image."""
+        By default every page is rasterized as soon as the file is opened. If
+        `lazy` is set, a page is only rasterized the first time it is asked
+        for, and at most `maxLoadedPages` rasterized pages are kept around;
+        fewer if they take more than `loadedPagesBytes` (if given).
+
+        Pages resized to the output width are cached as well, so that all
+        the crops of a slide are cut from one resized image. The least
+        recently used ones are dropped once they take more than
+        `resizedCacheBytes` (the last one is always kept). In lazy mode with
+        `fitToWidth`, these are rasterized at the density which gives the
+        output width directly (computed from the size of the page) instead
+        of being rasterized at `resolution` and resized.
+
+        With `renderRegions` (and `fitToWidth`), a crop of a page is not cut
+        from the page at the output width; instead only the cropped region
+        is rasterized, at the density which makes the crop itself as wide as
+        the output. Such crops are larger and sharper.
+
+        Cropped pages are encoded as given by `mediaFormat` (a MediaFormat,
+        by default png).
+
+        If a `renderCache` (a RenderCache) is given, cropped pages are looked
+        up there before anything is rasterized.
+
+        Pages are rasterized by `renderer` (see renderers.py), by default
+        with ImageMagick.
+
+        The time spent rasterizing, resizing and cropping is recorded in
+        `profile` (see profiling.Profile), if one is given.
+
+        The rasterized pages are freed by close(); PdfPages is a context
+        manager which closes itself.
+        """
+        self.pdfFileName = pdfFileName
+        self.resolution = resolution
+        self.lazy = lazy
+        self.maxLoadedPages = max(1, maxLoadedPages)
+        self.loadedPages = OrderedDict()
+        self.loadedPagesBytes = loadedPagesBytes
+        self.resizedCacheBytes = resizedCacheBytes
+        self.resizedPages = OrderedDict()
+        self.resizedPagesBytes = 0
+        self.renderCache = renderCache
+        self.pdfHash = None
+        self.profile = profile if profile is not None else NullProfile()
+        self.renderer = renderer if renderer is not None else WandRenderer()
+        self.fitToWidth = lazy and fitToWidth
+        self.renderRegions = self.fitToWidth and renderRegions
+        self.mediaFormat = mediaFormat if mediaFormat is not None else MediaFormat()
+
+        if self.lazy:
+            # Fail early, like the eager mode, if the file cannot be read.
+            open(pdfFileName, 'rb').close()
+            self.pdf = None
+        else:
+            with self.profile.stage('rasterize'):
+                self.pdf = self.renderer.renderAll(pdfFileName, resolution)
+
+    def getPage(self, pageNumber):
+        """Return the rasterized page as a wand image (not a copy)."""
         # The page numbers are indexed with base 0, while page numbers start
         # from 1.
-        img = Image(image = self.pdf.sequence[pageNumber - 1])
-        img.resize(width, int(width * img.height / (1.0 * img.width)))
+        if not self.lazy:
+            return self.pdf[pageNumber - 1]
+
+        if pageNumber in self.loadedPages:
+            self.loadedPages.move_to_end(pageNumber)
+            return self.loadedPages[pageNumber]
+
+        with self.profile.stage('rasterize'):
+            page = self.renderer.renderPage(self.pdfFileName, pageNumber, self.resolution)
+        self.loadedPages[pageNumber] = page
+
+        while len(self.loadedPages) > self.maxLoadedPages or \
+              (self.loadedPagesBytes is not None and len(self.loadedPages) > 1 and
+               sum(imageBytes(img) for img in self.loadedPages.values()) > self.loadedPagesBytes):
+            _, evictedPage = self.loadedPages.popitem(last=False)
+            evictedPage.close()
+
+        return page
+
+    def getResizedPage(self, pageNumber, width=640):
+        """Return the page resized to `width` as a wand image (not a copy)."""
+        key = (pageNumber, width)
+        if key in self.resizedPages:
+            self.resizedPages.move_to_end(key)
+            return self.resizedPages[key]
+
+        img = self.rasterizeAtWidth(pageNumber, width) if self.fitToWidth else None
+        if img is None:
+            page = self.getPage(pageNumber)
+            with self.profile.stage('resize'):
+                img = Image(image = page)
+                img.resize(width, int(width * img.height / (1.0 * img.width)))
+        self.resizedPages[key] = img
+        self.resizedPagesBytes += imageBytes(img)
+
+        while self.resizedPagesBytes > self.resizedCacheBytes and len(self.resizedPages) > 1:
+            _, evictedImg = self.resizedPages.popitem(last=False)
+            self.resizedPagesBytes -= imageBytes(evictedImg)
+            evictedImg.close()
+
+        return img
+
+    def rasterizeAtWidth(self, pageNumber, width):
+        """Rasterize a page at `width` pixels, returning None if the size of
+        the page is not known."""
+        size = self.renderer.getPageSize(self.pdfFileName, pageNumber)
+        density = self.getDensity(width, size[0]) if size is not None else None
+        if density is None:
+            return None
+
+        with self.profile.stage('rasterize'):
+            img = self.renderer.renderPage(self.pdfFileName, pageNumber, (density, density))
+        return self.fitImageToWidth(img, width)
+
+    def rasterizeRegionAtWidth(self, pageNumber, cropPercentValues, width):
+        """Rasterize only the cropped part of a page, at `width` pixels.
+        Returns None if the size of the page is not known (or implausible)."""
+        size = self.renderer.getPageSize(self.pdfFileName, pageNumber)
+        region = [(cropPercentValues[0][0] / 100.0, cropPercentValues[0][1] / 100.0),
+                  (cropPercentValues[1][0] / 100.0, cropPercentValues[1][1] / 100.0)]
+        regionWidth = (region[0][1] - region[0][0]) * size[0] if size is not None else 0
+        density = self.getDensity(width, regionWidth)
+        if density is None or region[1][1] <= region[1][0]:
+            return None
+
+        with self.profile.stage('rasterize'):
+            img = self.renderer.renderRegion(self.pdfFileName, pageNumber, (density, density), region)
+        return self.fitImageToWidth(img, width)
+
+    def getDensity(self, width, points):
+        """Return the density which rasterizes `points` (as wide as a page or
+        a region) at `width` pixels, or None if it is not within
+        MAX_DENSITY_FACTOR of `resolution`."""
+        if points <= 0:
+            return None
+        density = 72.0 * width / points
+        if not self.resolution[0] / MAX_DENSITY_FACTOR <= density <= self.resolution[0] * MAX_DENSITY_FACTOR:
+            return None
+        return density
+
+    def fitImageToWidth(self, img, width):
+        """Make an image rasterized for `width` exactly that wide."""
+        if img.width in (width + 1, width + 2):
+            # Renderers round the page size up; drop the extra columns.
+            with self.profile.stage('resize'):
+                trimmed = img[0:width, 0:img.height]
+            img.close()
+            img = trimmed
+        elif img.width != width:
+            with self.profile.stage('resize'):
+                img.resize(width, int(width * img.height / (1.0 * img.width)))
+        return img
+
+    def close(self):
+        """Free all rasterized pages and whatever the renderer holds."""
+        for img in list(self.loadedPages.values()) + list(self.resizedPages.values()) + (self.pdf or []):
+            img.close()
+        self.loadedPages.clear()
+        self.resizedPages.clear()
+        self.resizedPagesBytes = 0
+        self.pdf = None if self.lazy else []
+        self.renderer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def getPageAsPng(self, pageNumber, width=640):
+        """Return the given page as a png wand.image.Image."""
+        return self.getResizedPage(pageNumber, width).convert('png')
+
+    def getPdfHash(self):
+        """Return the hash of the contents of the pdf file."""
+        if self.pdfHash is None:
+            self.pdfHash = hashFile(self.pdfFileName)
+        return self.pdfHash
+
+    def getCroppedPage(self, pageNumber, cropPercentValues, width=640):
+        """Return the cropped page as a new wand image."""
+        if self.renderRegions and cropPercentValues != [[0, 100], [0, 100]]:
+            img = self.rasterizeRegionAtWidth(pageNumber, cropPercentValues, width)
+            if img is not None:
+                return img
+
+        img = self.getResizedPage(pageNumber, width)
         wmin = int((cropPercentValues[0][0] / 100.0) * img.width)
         wmax = int((cropPercentValues[0][1] / 100.0) * img.width)
         hmin = int((cropPercentValues[1][0] / 100.0) * img.height)
         hmax = int((cropPercentValues[1][1] / 100.0) * img.height)
-        return img[wmin:wmax, hmin:hmax].convert('png')
+        with self.profile.stage('crop'):
+            return img[wmin:wmax, hmin:hmax]
+
+    def getCroppedPageBlob(self, pageNumber, cropPercentValues, width=640):
+        """Return the cropped page encoded in the media format."""
+        return self.getCroppedPageBlobs(pageNumber, cropPercentValues, [width])[0]
+
+    def getCroppedPageBlobs(self, pageNumber, cropPercentValues, widths):
+        """Return the cropped page encoded in the media format at each of
+        `widths` (the width of the whole page, as for getCroppedPage).
+
+        The page (or the region) is rasterized once, for the largest width;
+        the smaller ones are scaled down from that crop. They are cached as
+        such, so that the bytes of a width do not depend on the widths which
+        filled the render cache.
+        """
+        blobs = [None] * len(widths)
+        keys = [None] * len(widths)
+        maxWidth = max(widths)
+        if self.renderCache is not None:
+            with self.profile.stage('cache'):
+                if self.renderRegions:
+                    resolution = 'regions'
+                else:
+                    resolution = None if self.fitToWidth else self.resolution
+                for idx, width in enumerate(widths):
+                    keys[idx] = RenderCache.makeKey(self.getPdfHash(), self.renderer.name, pageNumber,
+                                                    resolution, width, cropPercentValues,
+                                                    self.mediaFormat.getKey(),
+                                                    maxWidth if width != maxWidth else None)
+                    blobs[idx] = self.renderCache.get(keys[idx])
+
+        missing = sorted((idx for idx, blob in enumerate(blobs) if blob is None),
+                         key=lambda idx: widths[idx], reverse=True)
+        if not missing:
+            return blobs
+
+        croppedImg = self.getCroppedPage(pageNumber, cropPercentValues, maxWidth)
+        # Encoding changes an image, so the crop itself is encoded last.
+        for idx in reversed(missing):
+            img = croppedImg
+            if widths[idx] != maxWidth:
+                scale = widths[idx] / (1.0 * maxWidth)
+                with self.profile.stage('resize'):
+                    img = Image(image=croppedImg)
+                    img.resize(max(1, int(croppedImg.width * scale)), max(1, int(croppedImg.height * scale)))
+            with self.profile.stage('encode'):
+                blobs[idx] = self.mediaFormat.encode(img)
+            if img is not croppedImg:
+                img.close()
+
+            if self.renderCache is not None:
+                with self.profile.stage('cache'):
+                    self.renderCache.put(keys[idx], blobs[idx])
+        croppedImg.close()
+
+        return blobs
+
+    def getCroppedPageAsPng(self, pageNumber, cropPercentValues, width=640):
+        """Return the given page as a cropped png wand.image.Image."""
+        if self.mediaFormat.frmt == 'png':
+            return Image(blob=self.getCroppedPageBlob(pageNumber, cropPercentValues, width), format='png')
+        croppedImg = self.getCroppedPage(pageNumber, cropPercentValues, width)
+        png = croppedImg.convert('png')
+        croppedImg.close()
+        return png
 
 
 class TestPdfPages(unittest.TestCase):
@@ -32,3 +294,139 @@ class TestPdfPages(unittest.TestCase):
         slide12 = Image(filename='./slidesimport/test/slide-12.png')
         self.assertEqual(p.getPageAsPng(12), slide12)
 
+    def testLazyOnVegFoodInJapan(self):
+        p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True, maxLoadedPages=2,
+                     fitToWidth=False)
+        slide12 = Image(filename='./slidesimport/test/slide-12.png')
+        self.assertEqual(p.getPageAsPng(12), slide12)
+
+        p.getPage(1)
+        p.getPage(2)
+        self.assertEqual(list(p.loadedPages.keys()), [1, 2])
+
+    def testFitToWidth(self):
+        p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True)
+        slide12 = Image(filename='./slidesimport/test/slide-12.png')
+        fitted = p.getPageAsPng(12)
+        self.assertEqual((fitted.width, fitted.height), (slide12.width, slide12.height))
+        # Only one pass of rasterization, no page at `resolution`.
+        self.assertEqual(len(p.loadedPages), 0)
+        _, distortion = fitted.compare(slide12, metric='root_mean_square')
+        self.assertLess(distortion, 0.05)
+
+    def testRenderRegions(self):
+        p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True, renderRegions=True)
+        whole = p.getCroppedPageAsPng(12, [[0, 100], [0, 100]])
+        topLeft = p.getCroppedPageAsPng(12, [[0, 50], [0, 50]])
+        # The quarter is rasterized at twice the density, not cut out.
+        self.assertEqual(topLeft.width, whole.width)
+        self.assertAlmostEqual(topLeft.height, whole.height, delta=1)
+        topHalf = p.getCroppedPageAsPng(12, [[0, 100], [0, 50]])
+        self.assertEqual(topHalf.width, whole.width)
+        self.assertAlmostEqual(topHalf.height, whole.height // 2, delta=1)
+
+    def testDegeneratePageSize(self):
+        class TinyPageRenderer(WandRenderer):
+            def __init__(self):
+                WandRenderer.__init__(self)
+                self.resolutions = []
+
+            def getPageSize(self, pdfFileName, pageNumber):
+                return (0.5, 0.5)
+
+            def renderPage(self, pdfFileName, pageNumber, resolution):
+                self.resolutions.append(resolution)
+                return WandRenderer.renderPage(self, pdfFileName, pageNumber, resolution)
+
+        renderer = TinyPageRenderer()
+        p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True, renderRegions=True,
+                     renderer=renderer)
+        img = p.getCroppedPage(12, [[0, 50], [0, 100]], 640)
+        # The page is rasterized at the resolution and resized, not at 92160 dpi.
+        self.assertEqual(renderer.resolutions, [(120, 120)])
+        self.assertEqual(img.width, 320)
+
+    def testResizedPageCache(self):
+        p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True, fitToWidth=False)
+        slide12 = Image(filename='./slidesimport/test/slide-12.png')
+        whole = p.getCroppedPageAsPng(12, [[0, 100], [0, 100]])
+        self.assertEqual(whole, slide12)
+        top = p.getCroppedPageAsPng(12, [[0, 100], [0, 50]])
+        self.assertEqual(top.width, whole.width)
+        self.assertEqual(len(p.resizedPages), 1)
+
+        # Only the most recently used page survives a tiny budget.
+        p.resizedCacheBytes = 1
+        p.getPageAsPng(1)
+        self.assertEqual(list(p.resizedPages.keys()), [(1, 640)])
+        self.assertEqual(p.resizedPagesBytes, imageBytes(p.resizedPages[(1, 640)]))
+
+    def testRenderCache(self):
+        cacheDir = tempfile.mkdtemp()
+        try:
+            crop = [[0, 100], [0, 50]]
+            p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True,
+                         renderCache=RenderCache(cacheDir))
+            rendered = p.getCroppedPageAsPng(12, crop)
+
+            # A fresh instance is served from the cache without rasterizing.
+            p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True,
+                         renderCache=RenderCache(cacheDir))
+            self.assertEqual(p.getCroppedPageAsPng(12, crop), rendered)
+            self.assertEqual(len(p.loadedPages), 0)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def testCroppedPageBlobs(self):
+        profile = Profile()
+        p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True, profile=profile)
+        crop = [[0, 50], [0, 100]]
+        blobs = p.getCroppedPageBlobs(12, crop, [320, 1280, 640])
+
+        # One rasterization for all widths.
+        self.assertEqual(profile.stages['rasterize']['count'], 1)
+        self.assertEqual([Image(blob=blob).width for blob in blobs], [160, 640, 320])
+        self.assertEqual(blobs[1], PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True)
+                                   .getCroppedPageBlob(12, crop, 1280))
+
+    def testCachedWidths(self):
+        cacheDir = tempfile.mkdtemp()
+        try:
+            crop = [[0, 100], [0, 50]]
+            expected = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True) \
+                       .getCroppedPageBlobs(12, crop, [480, 1920])
+
+            # A width rendered on its own is not taken for one scaled down.
+            p = PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True,
+                         renderCache=RenderCache(cacheDir))
+            p.getCroppedPageBlob(12, crop, 480)
+            self.assertEqual(p.getCroppedPageBlobs(12, crop, [480, 1920]), expected)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def testClose(self):
+        with PdfPages('./slidesimport/test/Veg-food-in-Japan.pdf', lazy=True, fitToWidth=False,
+                      loadedPagesBytes=1) as p:
+            p.getCroppedPageBlob(1, [[0, 100], [0, 100]])
+            p.getCroppedPageBlob(2, [[0, 100], [0, 100]])
+            # The byte budget leaves only the most recent page.
+            self.assertEqual(list(p.loadedPages.keys()), [2])
+        self.assertEqual(len(p.loadedPages), 0)
+        self.assertEqual(len(p.resizedPages), 0)
+
+    def testPeakMemoryIsFlat(self):
+        # Every run is a process of its own, so that its peak is its own.
+        script = ('import sys\n'
+                  'from slidesimport.pdfpages import PdfPages\n'
+                  'from slidesimport.profiling import peakRssBytes\n'
+                  'with PdfPages(sys.argv[1], lazy=True, maxLoadedPages=2,\n'
+                  '              resizedCacheBytes=4 * 1024 * 1024) as p:\n'
+                  '    for n in range(1, int(sys.argv[2]) + 1):\n'
+                  '        p.getCroppedPageBlob(n, [[0, 100], [0, 100]])\n'
+                  'print(peakRssBytes())\n')
+        peaks = [int(subprocess.check_output([sys.executable, '-c', script,
+                                              './slidesimport/test/Veg-food-in-Japan.pdf',
+                                              str(pageCount)]))
+                 for pageCount in (5, 31)]
+        # Six times the pages, but no more than a few pages more memory.
+        self.assertLess(peaks[1] - peaks[0], 24 * 1024 * 1024)
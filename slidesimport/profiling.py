@@ -0,0 +1,191 @@
+import unittest
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def peakRssBytes(who=resource.RUSAGE_SELF):
+    """Peak resident set size of this process (or of its children)."""
+    rss = resource.getrusage(who).ru_maxrss
+    # macOS reports bytes, Linux reports KiB.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class NullProfile:
+    """A profile which records nothing; used when profiling is off."""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    @contextmanager
+    def slide(self, slideNum):
+        yield
+
+    def addBytesWritten(self, count):
+        pass
+
+    def mergeSlides(self, other):
+        pass
+
+    def mergeIntoSlides(self, other):
+        pass
+
+
+class Profile(NullProfile):
+    """Collects the time spent in every stage of building a deck.
+
+    Time is accounted per stage for the whole run and, inside slide(), per
+    slide as well. Stages may be nested; an outer stage includes the time
+    of the stages inside it.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = {}
+        self.slides = []
+        self.currentSlide = None
+        self.bytesWritten = 0
+        self.extra = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+            stage['count'] += 1
+            stage['seconds'] += elapsed
+            if self.currentSlide is not None:
+                slideStages = self.currentSlide['stages']
+                slideStages[name] = slideStages.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def slide(self, slideNum):
+        self.currentSlide = {'slide': slideNum, 'stages': {}, 'bytesWritten': 0}
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.currentSlide['seconds'] = time.time() - start
+            self.slides.append(self.currentSlide)
+            self.currentSlide = None
+
+    def addBytesWritten(self, count):
+        self.bytesWritten += count
+        if self.currentSlide is not None:
+            self.currentSlide['bytesWritten'] += count
+
+    def mergeSlides(self, other):
+        """Add the slides (and their stages) recorded by another profile,
+        e.g. one filled in a worker process."""
+        for slide in other.slides:
+            self.slides.append(slide)
+            self.bytesWritten += slide['bytesWritten']
+        for name, otherStage in other.stages.items():
+            stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+            stage['count'] += otherStage['count']
+            stage['seconds'] += otherStage['seconds']
+
+    def mergeIntoSlides(self, other):
+        """Add what another profile recorded per slide to the records of
+        the same slides here (adding the slides which are not recorded yet),
+        and its stages and bytes to the totals; e.g. for the media which a
+        writer thread saved after their slides were rendered."""
+        records = dict((slide['slide'], slide) for slide in self.slides)
+        for slide in other.slides:
+            record = records.get(slide['slide'])
+            if record is None:
+                records[slide['slide']] = slide
+                self.slides.append(slide)
+                continue
+            record['bytesWritten'] += slide['bytesWritten']
+            for name, seconds in slide['stages'].items():
+                record['stages'][name] = record['stages'].get(name, 0.0) + seconds
+        self.bytesWritten += other.bytesWritten
+        for name, otherStage in other.stages.items():
+            stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+            stage['count'] += otherStage['count']
+            stage['seconds'] += otherStage['seconds']
+
+    def getReport(self):
+        return {'seconds': time.time() - self.start,
+                'stages': self.stages,
+                'slides': sorted(self.slides, key=lambda slide: -slide['seconds']),
+                'bytesWritten': self.bytesWritten,
+                'peakRssBytes': peakRssBytes(),
+                'peakRssChildrenBytes': peakRssBytes(resource.RUSAGE_CHILDREN),
+                'extra': self.extra}
+
+    def writeReport(self, fileName):
+        with open(fileName, 'w') as f:
+            json.dump(self.getReport(), f, indent=2, sort_keys=True)
+
+
+class TestProfile(unittest.TestCase):
+    def testStagesAndSlides(self):
+        p = Profile()
+        with p.stage('parse'):
+            pass
+        with p.slide(3):
+            with p.stage('render'):
+                with p.stage('rasterize'):
+                    pass
+            p.addBytesWritten(10)
+        with p.slide(4):
+            with p.stage('render'):
+                pass
+
+        report = p.getReport()
+        self.assertEqual(report['stages']['render']['count'], 2)
+        self.assertEqual(report['stages']['parse']['count'], 1)
+        self.assertEqual(sorted(slide['slide'] for slide in report['slides']), [3, 4])
+        self.assertEqual(report['bytesWritten'], 10)
+        slide3 = [slide for slide in report['slides'] if slide['slide'] == 3][0]
+        self.assertEqual(sorted(slide3['stages']), ['rasterize', 'render'])
+        self.assertGreater(report['peakRssBytes'], 0)
+
+    def testMergeSlides(self):
+        main, worker = Profile(), Profile()
+        with worker.slide(1):
+            with worker.stage('save'):
+                worker.addBytesWritten(5)
+        main.mergeSlides(worker)
+        main.mergeSlides(worker)
+
+        self.assertEqual(len(main.slides), 2)
+        self.assertEqual(main.bytesWritten, 10)
+        self.assertEqual(main.stages['save']['count'], 2)
+
+    def testMergeIntoSlides(self):
+        main, writer = Profile(), Profile()
+        with main.slide(1):
+            with main.stage('render'):
+                pass
+        with writer.slide(1):
+            with writer.stage('save'):
+                writer.addBytesWritten(5)
+        with writer.slide(1):
+            with writer.stage('save'):
+                writer.addBytesWritten(3)
+        with writer.slide(2):
+            writer.addBytesWritten(1)
+        main.mergeIntoSlides(writer)
+
+        self.assertEqual([slide['slide'] for slide in main.slides], [1, 2])
+        self.assertEqual(main.slides[0]['bytesWritten'], 8)
+        self.assertEqual(sorted(main.slides[0]['stages']), ['render', 'save'])
+        self.assertEqual(main.bytesWritten, 9)
+        self.assertEqual(main.stages['save']['count'], 2)
+
+    def testNullProfile(self):
+        p = NullProfile()
+        with p.slide(1):
+            with p.stage('x'):
+                p.addBytesWritten(1)
+        p.mergeSlides(Profile())
+        p.mergeIntoSlides(Profile())
@@ -0,0 +1,148 @@
+import unittest
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+def hashFile(fileName, chunkSize=1024 * 1024):
+    """Return the sha256 hex digest of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """A content addressed on-disk cache of rendered slide images.
+
+    Entries are plain files named after the hash of everything that
+    influences a render. Reading an entry refreshes its modification time,
+    and the least recently used entries are removed once the cache grows
+    beyond `maxBytes`. Several processes may share one cache folder.
+    """
+
+    def __init__(self, cacheDir, maxBytes=512 * 1024 * 1024):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        self.totalBytes = sum(size for _, _, size in self.entries())
+
+    @staticmethod
+    def makeKey(pdfHash, renderer, pageNumber, resolution, width, cropPercentValues, frmt,
+                scaledFrom=None):
+        """Return the cache key of one render.
+
+        resolution is None for pages rasterized directly at `width`, and
+        'regions' if crops are rasterized on their own. scaledFrom is the
+        width of the render which the image was scaled down from, if any.
+        """
+        if isinstance(resolution, (list, tuple)):
+            resolution = tuple(resolution)
+        description = (pdfHash, renderer, pageNumber, resolution, width,
+                       [list(c) for c in cropPercentValues], frmt)
+        if scaledFrom is not None:
+            description += (scaledFrom,)
+        description = repr(description)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.cacheDir, key[:2], key)
+
+    def entries(self):
+        """Yield (path, mtime, size) of every entry in the cache."""
+        for subDir in os.listdir(self.cacheDir):
+            subDirPath = os.path.join(self.cacheDir, subDir)
+            if not os.path.isdir(subDirPath):
+                continue
+            for name in os.listdir(subDirPath):
+                path = os.path.join(subDirPath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        """Return the cached bytes for key, or None."""
+        path = self.getPath(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, key, data):
+        """Store the bytes for key, evicting old entries if necessary."""
+        path = self.getPath(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # Created by another process in the meantime.
+                pass
+
+        # Write to a temporary file first so that readers never see a
+        # partially written entry.
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmpPath, path)
+
+        self.totalBytes += len(data)
+        if self.totalBytes > self.maxBytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits maxBytes."""
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.totalBytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.totalBytes -= size
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def testKeyCoversAllInputs(self):
+        base = ('abc', 'wand', 1, (120, 120), 640, [[0, 100], [0, 100]], 'png')
+        keys = set([RenderCache.makeKey(*base)])
+        for idx, value in enumerate(['abd', 'mupdf', 2, (72, 72), 480, [[0, 50], [0, 100]], 'jpg']):
+            changed = list(base)
+            changed[idx] = value
+            keys.add(RenderCache.makeKey(*changed))
+        self.assertEqual(len(keys), 8)
+
+    def testGetAndPut(self):
+        c = RenderCache(self.cacheDir)
+        self.assertIsNone(c.get('00ff'))
+        c.put('00ff', b'data')
+        self.assertEqual(c.get('00ff'), b'data')
+        self.assertEqual(RenderCache(self.cacheDir).totalBytes, 4)
+
+    def testEvictsLeastRecentlyUsed(self):
+        c = RenderCache(self.cacheDir, maxBytes=10)
+        c.put('aa01', b'12345')
+        c.put('aa02', b'12345')
+        os.utime(c.getPath('aa01'), (1, 1))
+        os.utime(c.getPath('aa02'), (2, 2))
+        c.put('aa03', b'12345')
+
+        self.assertIsNone(c.get('aa01'))
+        self.assertEqual(c.get('aa02'), b'12345')
+        self.assertEqual(c.get('aa03'), b'12345')
+        self.assertEqual(c.totalBytes, 10)
@@ -0,0 +1,235 @@
+from .pagesizes import readPageSizes
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+def makeImage(**kwargs):
+    """Return a new wand image (see wand.image.Image).
+
+    Wand, and with it ImageMagick, is only imported once an image is made,
+    so that e.g. checking notes does not load it.
+    """
+    from wand.image import Image
+    return Image(**kwargs)
+
+
+class Renderer(object):
+    """The parts common to all renderers.
+
+    Page sizes are looked up with readPageSizes, reading every file once.
+    """
+
+    # The box of the page which the renderer rasterizes.
+    box = 'MediaBox'
+
+    def __init__(self):
+        self.pageSizes = {}
+
+    def getPageSize(self, pdfFileName, pageNumber):
+        """Return the (width, height) of a page in points, or None if the
+        size cannot be found out."""
+        if pdfFileName not in self.pageSizes:
+            self.pageSizes[pdfFileName] = readPageSizes(pdfFileName, self.box)
+        sizes = self.pageSizes[pdfFileName]
+        if sizes is None or not 1 <= pageNumber <= len(sizes):
+            return None
+        return sizes[pageNumber - 1]
+
+    def close(self):
+        """Free what the renderer keeps open."""
+        pass
+
+    def renderRegion(self, pdfFileName, pageNumber, resolution, region):
+        """Return a part of a page as a wand image.
+
+        region is ((xmin, xmax), (ymin, ymax)) as fractions of the width
+        and height of the page. Unless a renderer can rasterize only a part
+        of a page, the whole page is rasterized and cropped.
+        """
+        page = self.renderPage(pdfFileName, pageNumber, resolution)
+        (xmin, xmax), (ymin, ymax) = region
+        img = page[int(xmin * page.width):int(xmax * page.width),
+                   int(ymin * page.height):int(ymax * page.height)]
+        page.close()
+        return img
+
+
+class WandRenderer(Renderer):
+    """Rasterizes pages with ImageMagick, which in turn runs Ghostscript."""
+
+    name = 'wand'
+
+    @staticmethod
+    def isAvailable():
+        return True
+
+    def renderPage(self, pdfFileName, pageNumber, resolution):
+        """Return page `pageNumber` (starting from 1) as a wand image."""
+        # ImageMagick reads only the requested page for 'file.pdf[N]'.
+        return makeImage(filename='{0}[{1}]'.format(pdfFileName, pageNumber - 1),
+                     resolution=resolution)
+
+    def renderAll(self, pdfFileName, resolution):
+        """Return all pages as a list of wand images."""
+        with makeImage(filename=pdfFileName, resolution=resolution) as pdf:
+            return [makeImage(image=page) for page in pdf.sequence]
+
+
+class PdftoppmRenderer(Renderer):
+    """Rasterizes pages with poppler's pdftoppm, run as a subprocess."""
+
+    name = 'pdftoppm'
+    box = 'CropBox'
+
+    @staticmethod
+    def isAvailable():
+        return shutil.which('pdftoppm') is not None
+
+    def run(self, arguments):
+        """Run pdftoppm, returning what it writes to stdout."""
+        try:
+            return subprocess.check_output(['pdftoppm'] + arguments, stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError as e:
+            raise IOError('pdftoppm failed: {0}'.format(e.stderr.decode('utf-8', 'replace').strip()))
+
+    def getResolutionArguments(self, resolution):
+        return ['-rx', str(resolution[0]), '-ry', str(resolution[1])]
+
+    def renderPage(self, pdfFileName, pageNumber, resolution):
+        # Without an output root, the (uncompressed) ppm goes to stdout.
+        arguments = ['-f', str(pageNumber), '-l', str(pageNumber), '-singlefile'] + \
+                    self.getResolutionArguments(resolution) + [pdfFileName]
+        return makeImage(blob=self.run(arguments), format='ppm')
+
+    def renderRegion(self, pdfFileName, pageNumber, resolution, region):
+        size = self.getPageSize(pdfFileName, pageNumber)
+        if size is None:
+            return Renderer.renderRegion(self, pdfFileName, pageNumber, resolution, region)
+        # pdftoppm takes the region in pixels at the given resolution.
+        pageWidth, pageHeight = size[0] * resolution[0] / 72.0, size[1] * resolution[1] / 72.0
+        (xmin, xmax), (ymin, ymax) = region
+        x, y = int(xmin * pageWidth), int(ymin * pageHeight)
+        arguments = ['-f', str(pageNumber), '-l', str(pageNumber), '-singlefile',
+                     '-x', str(x), '-y', str(y),
+                     '-W', str(max(1, int(xmax * pageWidth) - x)),
+                     '-H', str(max(1, int(ymax * pageHeight) - y))] + \
+                    self.getResolutionArguments(resolution) + [pdfFileName]
+        return makeImage(blob=self.run(arguments), format='ppm')
+
+    def renderAll(self, pdfFileName, resolution):
+        tmpDir = tempfile.mkdtemp(prefix='slides-pdftoppm-')
+        try:
+            self.run(self.getResolutionArguments(resolution) +
+                     [pdfFileName, os.path.join(tmpDir, 'page')])
+            # The page numbers in the names are padded to the same width.
+            return [makeImage(filename=os.path.join(tmpDir, name))
+                    for name in sorted(os.listdir(tmpDir))]
+        finally:
+            shutil.rmtree(tmpDir)
+
+
+class MupdfRenderer(Renderer):
+    """Rasterizes pages in process with MuPDF (the PyMuPDF package)."""
+
+    name = 'mupdf'
+
+    def __init__(self):
+        Renderer.__init__(self)
+        self.documents = {}
+
+    @staticmethod
+    def getModule():
+        try:
+            import pymupdf
+        except ImportError:
+            # Versions before 1.24 only offer the old name.
+            import fitz as pymupdf
+        return pymupdf
+
+    @classmethod
+    def isAvailable(cls):
+        try:
+            cls.getModule()
+        except ImportError:
+            return False
+        return True
+
+    def getDocument(self, pdfFileName):
+        if pdfFileName not in self.documents:
+            try:
+                self.documents[pdfFileName] = self.getModule().open(pdfFileName)
+            except RuntimeError as e:
+                raise IOError('MuPDF cannot open {0}: {1}'.format(pdfFileName, e))
+        return self.documents[pdfFileName]
+
+    def close(self):
+        for document in self.documents.values():
+            document.close()
+        self.documents.clear()
+
+    def getPageSize(self, pdfFileName, pageNumber):
+        rect = self.getDocument(pdfFileName).load_page(pageNumber - 1).rect
+        return rect.width, rect.height
+
+    def renderPage(self, pdfFileName, pageNumber, resolution):
+        pymupdf = self.getModule()
+        page = self.getDocument(pdfFileName).load_page(pageNumber - 1)
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(resolution[0] / 72.0, resolution[1] / 72.0),
+                                 alpha=False)
+        return makeImage(blob=pixmap.tobytes('ppm'), format='ppm')
+
+    def renderRegion(self, pdfFileName, pageNumber, resolution, region):
+        pymupdf = self.getModule()
+        page = self.getDocument(pdfFileName).load_page(pageNumber - 1)
+        rect = page.rect
+        (xmin, xmax), (ymin, ymax) = region
+        clip = pymupdf.Rect(rect.x0 + xmin * rect.width, rect.y0 + ymin * rect.height,
+                            rect.x0 + xmax * rect.width, rect.y0 + ymax * rect.height)
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(resolution[0] / 72.0, resolution[1] / 72.0),
+                                 clip=clip, alpha=False)
+        return makeImage(blob=pixmap.tobytes('ppm'), format='ppm')
+
+    def renderAll(self, pdfFileName, resolution):
+        return [self.renderPage(pdfFileName, pageNumber, resolution)
+                for pageNumber in range(1, self.getDocument(pdfFileName).page_count + 1)]
+
+
+RENDERERS = dict((renderer.name, renderer)
+                 for renderer in [WandRenderer, PdftoppmRenderer, MupdfRenderer])
+
+
+def getRenderer(name):
+    """Return a new renderer of the given name.
+
+    Raises ValueError for unknown names and for renderers which cannot be
+    used on this system.
+    """
+    if name not in RENDERERS:
+        raise ValueError('Unknown renderer "{0}"; choose one of: {1}.'
+                         .format(name, ', '.join(sorted(RENDERERS))))
+    if not RENDERERS[name].isAvailable():
+        raise ValueError('The renderer "{0}" is not installed on this system.'.format(name))
+    return RENDERERS[name]()
+
+
+class TestRenderers(unittest.TestCase):
+    def testUnknownRenderer(self):
+        with self.assertRaises(ValueError):
+            getRenderer('nonesuch')
+
+    def testRenderersAgreeOnSize(self):
+        pdfFileName = './slidesimport/test/Veg-food-in-Japan.pdf'
+        reference = WandRenderer().renderPage(pdfFileName, 12, (120, 120))
+        for name in sorted(RENDERERS):
+            if not RENDERERS[name].isAvailable():
+                continue
+            renderer = getRenderer(name)
+            page = renderer.renderPage(pdfFileName, 12, (120, 120))
+            self.assertAlmostEqual(page.width, reference.width, delta=2, msg=name)
+            self.assertAlmostEqual(page.height, reference.height, delta=2, msg=name)
+            width, height = renderer.getPageSize(pdfFileName, 12)
+            self.assertAlmostEqual(width, 362.835, places=2, msg=name)
+            self.assertAlmostEqual(height, 272.126, places=2, msg=name)
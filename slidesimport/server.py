@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from .slidesimport import addCommonArguments, importSlides, makeRenderPool, \
+                          getRenderOptions, checkOptions, SlidesImportError
+from .profiling import Profile
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse as A
+import base64
+import binascii
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+import urllib.error
+import zipfile
+
+# The options a job may set, with the argument each sets and its type;
+# everything else is set when the server starts, like the render workers.
+JOB_OPTIONS = {'prefix': ('prefix', str), 'dedupMedia': ('dedup_media', bool)}
+
+
+class BuildJob(object):
+    """A deck to build: the notes and slides are in workDir, and so is the
+    deck (an .apkg) once it is built."""
+
+    def __init__(self, jobId, workDir, options):
+        self.id = jobId
+        self.workDir = workDir
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.profile = None
+
+    def getDeckPath(self):
+        return os.path.join(self.workDir, 'deck.apkg')
+
+    def getStatus(self):
+        """Describe the job as a JSON-able dict, with its timings."""
+        status = {'id': self.id, 'status': self.status, 'error': self.error}
+        if self.started is not None:
+            status['queuedSeconds'] = self.started - self.submitted
+        if self.finished is not None:
+            status['buildSeconds'] = self.finished - self.started
+        if self.profile is not None and self.finished is not None:
+            status['stages'] = self.profile.stages
+            status['slides'] = len(self.profile.slides)
+        if self.status == 'done':
+            status['deckBytes'] = os.path.getsize(self.getDeckPath())
+        return status
+
+
+class BuildService(object):
+    """Builds decks from submitted jobs on `concurrent` threads.
+
+    At most `queueSize` jobs wait to be built; submit() raises queue.Full
+    beyond that. The slides of all jobs are rendered by `pool` (see
+    makeRenderPool), so that the render workers are started once. The
+    files of the last `keepJobs` finished jobs are kept for their results
+    to be fetched. `args` holds the options of the decks (see
+    addCommonArguments).
+    """
+
+    def __init__(self, args, pool=None, queueSize=32, concurrent=2, keepJobs=100):
+        self.args = args
+        self.pool = pool
+        self.queue = queue.Queue(queueSize)
+        self.keepJobs = keepJobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.nextId = 1
+        self.workDir = tempfile.mkdtemp(prefix='slides-server-')
+        self.threads = [threading.Thread(target=self.runJobs) for _ in range(concurrent)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, notes, slidesData, options=None):
+        """Queue a deck to be built from the notes (text) and the pdf (bytes).
+
+        Raises ValueError for options a job cannot set and queue.Full if
+        too many jobs are waiting.
+        """
+        options = options or {}
+        for name, value in options.items():
+            if name not in JOB_OPTIONS:
+                raise ValueError('Unknown option "{0}"; a job can set: {1}.'
+                                 .format(name, ', '.join(sorted(JOB_OPTIONS))))
+            if not isinstance(value, JOB_OPTIONS[name][1]):
+                raise ValueError('The option "{0}" has the wrong type.'.format(name))
+        if '/' in options.get('prefix', '') or os.sep in options.get('prefix', ''):
+            raise ValueError('The prefix must not contain a path separator.')
+        if self.queue.full():
+            raise queue.Full()
+
+        with self.lock:
+            jobId = str(self.nextId)
+            self.nextId += 1
+        job = BuildJob(jobId, os.path.join(self.workDir, jobId), options)
+        os.makedirs(job.workDir)
+        with open(os.path.join(job.workDir, 'notes.txt'), 'w') as f:
+            f.write(notes)
+        with open(os.path.join(job.workDir, 'slides.pdf'), 'wb') as f:
+            f.write(slidesData)
+
+        with self.lock:
+            self.jobs[jobId] = job
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.deleteJob(jobId)
+            raise
+        return job
+
+    def getJob(self, jobId):
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def deleteJob(self, jobId):
+        """Forget a job which is not being built, returning whether there was
+        such a job."""
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None or job.status == 'running':
+                return False
+            del self.jobs[jobId]
+            # A queued job is skipped once it is taken from the queue.
+            job.status = 'deleted'
+        shutil.rmtree(job.workDir, ignore_errors=True)
+        return True
+
+    def runJobs(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                if job.status == 'deleted':
+                    continue
+                job.status = 'running'
+            self.build(job)
+            self.forgetOldJobs()
+
+    def build(self, job):
+        job.started = time.time()
+        job.profile = Profile()
+        prefix = job.options.get('prefix') or 'lecture-{0}'.format(job.id)
+        jobArgs = dict(vars(self.args),
+                       notes=os.path.join(job.workDir, 'notes.txt'),
+                       slides=os.path.join(job.workDir, 'slides.pdf'),
+                       deck=job.getDeckPath(), prefix=prefix, anki=None, force=True)
+        for name, value in job.options.items():
+            jobArgs[JOB_OPTIONS[name][0]] = value
+        try:
+            importSlides(A.Namespace(**jobArgs), self.pool, job.profile)
+            job.status = 'done'
+        except SlidesImportError as e:
+            job.status, job.error = 'failed', str(e)
+        except Exception as e:
+            job.status, job.error = 'failed', '{0}: {1}'.format(type(e).__name__, e)
+        job.finished = time.time()
+
+    def forgetOldJobs(self):
+        with self.lock:
+            finished = [job.id for job in self.jobs.values() if job.finished is not None]
+        for jobId in finished[:max(0, len(finished) - self.keepJobs)]:
+            self.deleteJob(jobId)
+
+    def close(self):
+        """Stop building once the queued jobs are built."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+
+class BuildRequestHandler(BaseHTTPRequestHandler):
+    """The HTTP API of a BuildService (the `service` of the server):
+
+        POST   /jobs            {"notes": text, "slides": base64 pdf, "options": {...}}
+        GET    /jobs/<id>       the status and timings of a job
+        GET    /jobs/<id>/deck  the built .apkg
+        DELETE /jobs/<id>       forget a job and its files
+    """
+
+    # Bodies are read whole, so their size is limited.
+    maxBodyBytes = 256 * 1024 * 1024
+
+    def sendJson(self, code, value):
+        body = json.dumps(value, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendError(self, code, message):
+        self.sendJson(code, {'error': message})
+
+    def getJob(self):
+        """Return the job named in the path, or None after sending a 404."""
+        parts = self.path.strip('/').split('/')
+        job = self.server.service.getJob(parts[1]) if len(parts) >= 2 and parts[0] == 'jobs' else None
+        if job is None:
+            self.sendError(404, 'No such job.')
+        return job
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self.sendError(404, 'Jobs are posted to /jobs.')
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.maxBodyBytes:
+            return self.sendError(413, 'The job is larger than {0} bytes.'.format(self.maxBodyBytes))
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('expected a JSON object')
+            notes, slides = request['notes'], base64.b64decode(request['slides'], validate=True)
+            job = self.server.service.submit(notes, slides, request.get('options'))
+        except (ValueError, KeyError, TypeError, binascii.Error) as e:
+            return self.sendError(400, 'Bad job: {0}'.format(e))
+        except queue.Full:
+            return self.sendError(503, 'Too many jobs are waiting; try again later.')
+        self.sendJson(202, job.getStatus())
+
+    def do_GET(self):
+        job = self.getJob()
+        if job is None:
+            return
+        if not self.path.rstrip('/').endswith('/deck'):
+            return self.sendJson(200, job.getStatus())
+        if job.status != 'done':
+            return self.sendError(409, 'The job is {0}.'.format(job.status))
+        with open(job.getDeckPath(), 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Disposition', 'attachment; filename="{0}.apkg"'.format(job.id))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_DELETE(self):
+        job = self.getJob()
+        if job is None:
+            return
+        if not self.server.service.deleteJob(job.id):
+            return self.sendError(409, 'The job is being built.')
+        self.sendJson(200, {'id': job.id, 'status': 'deleted'})
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def makeServer(service, host='127.0.0.1', port=0, quiet=False):
+    """Return an HTTP server for the service; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), BuildRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def run(rawArgs=None):
+    argParser = A.ArgumentParser(description='Build decks submitted over HTTP (see BuildRequestHandler in slidesimport/server.py for the API).')
+    argParser.add_argument( '--host',
+                            help = 'The address to listen on (default: 127.0.0.1, i.e. this machine only).',
+                            type = str,
+                            default = '127.0.0.1'
+                          )
+
+    argParser.add_argument( '--port',
+                            help = 'The port to listen on (default: 8765).',
+                            type = int,
+                            default = 8765
+                          )
+
+    argParser.add_argument( '--queue-size',
+                            help = 'The number of jobs which may wait to be built (default: 32); more are refused.',
+                            type = int,
+                            default = 32
+                          )
+
+    argParser.add_argument( '--concurrent',
+                            help = 'The number of decks built at once (default: 2); their slides are all rendered by the --jobs render processes.',
+                            type = int,
+                            default = 2
+                          )
+
+    argParser.add_argument( '--keep-jobs',
+                            help = 'The number of finished jobs whose decks are kept to be fetched (default: 100).',
+                            type = int,
+                            default = 100
+                          )
+
+    addCommonArguments(argParser)
+
+    if rawArgs is not None:
+        args = argParser.parse_args(rawArgs)
+    else:
+        args = argParser.parse_args()
+
+    if args.queue_size < 1 or args.concurrent < 1 or args.jobs < 1:
+        print('The queue size, --concurrent and --jobs must be at least 1.', file=sys.stderr)
+        sys.exit(-1)
+
+    # The options are the same for every job (and the render processes).
+    try:
+        checkOptions(args)
+    except SlidesImportError as e:
+        print('Error in the options:', file=sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+
+    # The render processes are started (and import ImageMagick, see
+    # initRenderWorker) only once, and keep the pdfs of recent jobs open.
+    pool = makeRenderPool(args.jobs, getRenderOptions(args))
+    service = BuildService(args, pool, args.queue_size, args.concurrent, args.keep_jobs)
+    server = makeServer(service, args.host, args.port)
+    print('Building decks on http://{0}:{1}/jobs (Ctrl-C to stop) ...'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        pool.close()
+        pool.join()
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        args = A.Namespace(jobs=1, writers=4, cache_dir=None, cache_size=512, renderer='wand',
+                           sharp_crops=False, format='png', quality=None, png_colors=None,
+                           png_compression=None, dedup_media=False, max_memory=None,
+                           crop_presets=None, widths=None)
+        self.service = BuildService(args, queueSize=4, concurrent=1)
+        self.server = makeServer(self.service, quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/jobs'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.service.close()
+
+    def request(self, url, method='GET', body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data, method=method)) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def testBuild(self):
+        with open('./slidesimport/test/Veg-food-in-Japan.pdf', 'rb') as f:
+            slides = base64.b64encode(f.read()).decode('ascii')
+        # Cards without slides need no rendering.
+        job = {'notes': u'Slide 1:\n    Q: Question\n    A: Answer\n', 'slides': slides,
+               'options': {'prefix': 'lecture'}}
+        code, body = self.request(self.url, 'POST', job)
+        self.assertEqual(code, 202)
+        jobUrl = self.url + '/' + json.loads(body.decode('utf-8'))['id']
+
+        for _ in range(100):
+            status = json.loads(self.request(jobUrl)[1].decode('utf-8'))
+            if status['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(status['status'], 'done', status['error'])
+        self.assertIn('buildSeconds', status)
+
+        code, deck = self.request(jobUrl + '/deck')
+        self.assertEqual(code, 200)
+        tmpDir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpDir, 'deck.apkg'), 'wb') as f:
+                f.write(deck)
+            with zipfile.ZipFile(os.path.join(tmpDir, 'deck.apkg')) as package:
+                self.assertIn('collection.anki2', package.namelist())
+        finally:
+            shutil.rmtree(tmpDir)
+
+        self.assertEqual(self.request(jobUrl, 'DELETE')[0], 200)
+        self.assertEqual(self.request(jobUrl)[0], 404)
+
+    def testBadJobs(self):
+        self.assertEqual(self.request(self.url, 'POST', {'notes': 'Slide 1:\n'})[0], 400)
+        self.assertEqual(self.request(self.url, 'POST', [])[0], 400)
+        self.assertEqual(self.request(self.url, 'POST', {'notes': '', 'slides': '',
+                                                         'options': {'renderer': 'mupdf'}})[0], 400)
+        self.assertEqual(self.request(self.url + '/42')[0], 404)
+
+    def testInvalidOptions(self):
+        with self.assertRaises(SystemExit):
+            run(['--format', 'jpeg', '--png-colors', '16', '--port', '0'])
+        with self.assertRaises(SystemExit):
+            run(['--writers', '0', '--port', '0'])
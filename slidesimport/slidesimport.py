@@ -2,14 +2,34 @@
 
 from __future__ import print_function
 
-from .pdfpages import PdfPages
-from .parser import Parser, ParseException, NotesAndCropsParsing
+from .rendercache import RenderCache
+from .manifest import getManifestPath, loadManifest, saveManifest, makeManifest, \
+                      makeSlideRecord, getPreviousMediaNames, isSlideUpToDate, getMediaFileName
+from .parser import Parser, ParseException, CropParser, loadCropPresets
+from .profiling import Profile, NullProfile
+from .apkg import ApkgWriter
+from .mediawriter import MediaWriter
+from .renderers import RENDERERS, getRenderer
+from .mediaformat import MediaFormat, EXTENSIONS
 
 import sys
 import os
+import hashlib
+import shutil
+import tempfile
+import time
 import argparse as A
+from collections import OrderedDict
+import multiprocessing
+import subprocess
+import threading
+import unittest
+from io import StringIO
 
 
+# The width in pixels of slide images, unless --widths says otherwise.
+DEFAULT_WIDTH = 640
+
 def getMediaName(prefix, slideNumber, frmt='png'):
     """Returns the relative name of the media file."""
     return prefix + '-' + str(slideNumber) + '.' + frmt
@@ -18,172 +38,1156 @@ def getMediaPath(collectionMediaPath, prefix, slideNumber, frmt='png'):
     """Return the file name of the destination media file."""
     return os.path.join(collectionMediaPath, getMediaName(prefix, slideNumber, frmt))
 
+def getWidthMediaName(mediaName, width):
+    """Return the name of the variant of a media file which is `width`
+    pixels wide (see --widths), e.g. 'p-12-960w.png' for 'p-12.png'."""
+    base, extension = os.path.splitext(mediaName)
+    return '{0}-{1}w{2}'.format(base, width, extension)
+
+def getMediaVariants(mediaName, widths):
+    """Return (width, media name) of every width a media file is rendered
+    at; with a single width the file keeps its name."""
+    if mediaName == '':
+        return []
+    if len(widths) == 1:
+        return [(widths[0], mediaName)]
+    return [(width, getWidthMediaName(mediaName, width)) for width in widths]
+
+def makeImageTag(variants):
+    """Return the <img> of a slide rendered at the given (width, media name)
+    variants: the first is the src, and all of them make up the srcset from
+    which a viewer picks the one which suits its screen."""
+    if len(variants) == 1:
+        return '<img src="{0}" />'.format(variants[0][1])
+    return '<img src="{0}" srcset="{1}" />'.format(
+        variants[0][1], ', '.join('{0} {1}w'.format(name, width) for width, name in variants))
+
+def parseWidths(text):
+    """Parse the value of --widths, e.g. '480,960,1920'."""
+    try:
+        widths = [int(width) for width in text.split(',')]
+    except ValueError:
+        raise A.ArgumentTypeError('expected widths in pixels separated by commas, e.g. 480,960,1920')
+    return widths
+
+def getDedupMediaName(data, extension):
+    """Return the name of a media file which is named by its content, so
+    that identical images of any deck are stored only once."""
+    return 'slide-{0}.{1}'.format(hashlib.sha256(data).hexdigest()[:32], extension)
+
+def isApkgPath(deckFilePath):
+    """Whether the deck is written as an Anki package instead of a text file."""
+    return deckFilePath.lower().endswith('.apkg')
+
+def renderSlideMedia(pdfPages, slideNum, mediaJobs):
+    """Render the media of one slide, yielding (mediaFilePath, data) with
+    the image encoded in the media format of pdfPages.
+
+    mediaJobs is a list of (cropPercentValues, mediaFilePath, width); each
+    distinct crop is rendered only once, at all its widths together (see
+    PdfPages.getCroppedPageBlobs).
+    """
+    cropWidths = []
+    for cropPercentValues, _, width in mediaJobs:
+        for crop, widths in cropWidths:
+            if crop == cropPercentValues:
+                if width not in widths:
+                    widths.append(width)
+                break
+        else:
+            cropWidths.append((cropPercentValues, [width]))
+
+    renderedCrops = [(crop, dict(zip(widths, pdfPages.getCroppedPageBlobs(slideNum, crop, widths))))
+                     for crop, widths in cropWidths]
+    for cropPercentValues, mediaFilePath, width in mediaJobs:
+        for crop, renderedData in renderedCrops:
+            if crop == cropPercentValues:
+                yield mediaFilePath, renderedData[width]
+                break
+
+def encodeSlideMedia(pdfPages, slideNum, mediaJobs, profile=None):
+    """Render the media of one slide and return them as a list of
+    (mediaFilePath, encoded bytes); they are saved by a MediaWriter."""
+    profile = profile if profile is not None else NullProfile()
+    with profile.slide(slideNum):
+        return list(renderSlideMedia(pdfPages, slideNum, mediaJobs))
+
+def openPdfPages(slidesFilePath, profile=None, cacheDir=None, cacheSize=None, renderer='wand',
+                 sharpCrops=False, mediaFormat=None, maxMemory=None):
+    """Open the slides for rendering with the named renderer, using the
+    on-disk cache if one is given. The options besides profile are the ones
+    returned by getRenderOptions.
+
+    maxMemory (in MB) bounds the memory taken by rasterized pages; half of
+    it goes to the pages as rasterized and half to the resized ones.
+    """
+    # Imported here since it loads ImageMagick, which e.g. --check and -h
+    # do without.
+    from .pdfpages import PdfPages
+    renderCache = None
+    if cacheDir is not None:
+        renderCache = RenderCache(cacheDir, cacheSize * 1024 * 1024)
+    budget = {}
+    if maxMemory is not None:
+        budget = {'loadedPagesBytes': maxMemory * 1024 * 1024 // 2,
+                  'resizedCacheBytes': maxMemory * 1024 * 1024 // 2}
+    return PdfPages(slidesFilePath, lazy=True, renderCache=renderCache, profile=profile,
+                    renderer=getRenderer(renderer), renderRegions=sharpCrops,
+                    mediaFormat=mediaFormat, **budget)
+
+# Each worker process opens the pdfs on its own. The most recently used ones
+# are kept open by path, so that decks built at the same time (see the build
+# server) do not close each other's pdfs, and with them the rasterized pages.
+WORKER_OPEN_PDFS = 4
+workerRenderOptions = {}
+workerPdfPages = OrderedDict()
+
+def initRenderWorker(renderOptions):
+    global workerRenderOptions
+    workerRenderOptions = renderOptions
+    # Load the renderer (and ImageMagick, through pdfpages) now, rather than
+    # for the first slide. An unusable renderer is reported when rendering;
+    # raising here would make the pool start new workers forever.
+    try:
+        getRenderer(renderOptions.get('renderer', 'wand'))
+        from . import pdfpages
+    except (ValueError, ImportError):
+        pass
+
+def renderSlideInWorker(slideJob):
+    """Render the media of a slide, returning (profile, media) with media
+    as returned by encodeSlideMedia."""
+    slidesFilePath, slideNum, mediaJobs = slideJob
+    # A pdf which was saved since it was opened (see --watch) is opened again.
+    stamp = getFileStamp(slidesFilePath)
+    if slidesFilePath in workerPdfPages and workerPdfPages[slidesFilePath][0] != stamp:
+        workerPdfPages.pop(slidesFilePath)[1].close()
+    if slidesFilePath not in workerPdfPages:
+        workerPdfPages[slidesFilePath] = (stamp, openPdfPages(slidesFilePath, **workerRenderOptions))
+        while len(workerPdfPages) > WORKER_OPEN_PDFS:
+            workerPdfPages.popitem(last=False)[1][1].close()
+    workerPdfPages.move_to_end(slidesFilePath)
+    pdfPages = workerPdfPages[slidesFilePath][1]
+    pdfPages.profile = Profile()
+    return pdfPages.profile, encodeSlideMedia(pdfPages, slideNum, mediaJobs, pdfPages.profile)
+
+def makeRenderPool(jobs, renderOptions):
+    """Create a pool of processes to render slides with; renderOptions
+    are the ones returned by getRenderOptions."""
+    return multiprocessing.Pool(jobs, initRenderWorker, (renderOptions,))
+
+def getFileStamp(path):
+    """Return what changes when a file is saved (its modification time and
+    size), or None if there is no such file."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def expandPath(path):
+    return os.path.expandvars(os.path.expanduser(path))
+
+def getRenderOptions(args):
+    """Return the options for openPdfPages given on the command line."""
+    return {'cacheDir': expandPath(args.cache_dir) if args.cache_dir is not None else None,
+            'cacheSize': args.cache_size,
+            'renderer': args.renderer,
+            'sharpCrops': args.sharp_crops,
+            'mediaFormat': getMediaFormat(args),
+            # The budget is shared by the rendering processes.
+            'maxMemory': args.max_memory // args.jobs if args.max_memory is not None else None}
+
+def getMediaFormat(args):
+    """Return the MediaFormat given on the command line; raises ValueError
+    for options which do not go together."""
+    return MediaFormat(args.format, args.quality, args.png_colors, args.png_compression)
+
+class SlidesImportError(Exception):
+    """Raised when a deck cannot be made; the message explains why. The
+    subclasses below tell the reasons apart."""
+    pass
+
+class InvalidOptionsError(SlidesImportError):
+    """Options are missing, out of range or do not go together."""
+    pass
+
+class SourceError(SlidesImportError):
+    """The notes, the slides or the crop presets cannot be read."""
+    pass
+
+class NotesError(SlidesImportError):
+    """The notes cannot be parsed; lineNumber and line tell where."""
+
+    def __init__(self, message, lineNumber, line):
+        SlidesImportError.__init__(self, message)
+        self.lineNumber = lineNumber
+        self.line = line
+
+class MediaConflictError(SlidesImportError):
+    """A media file of the deck exists already (and -f was not given)."""
+
+    def __init__(self, message, path):
+        SlidesImportError.__init__(self, message)
+        self.path = path
+
+class RenderError(SlidesImportError):
+    """The slides cannot be rendered or their media cannot be saved."""
+    pass
+
+class OutputError(SlidesImportError):
+    """The deck file cannot be written."""
+    pass
+
+class DeckBuild(object):
+    """What importSlides made: the deck, its cards and media, and timings.
+
+    cards lists the fields of every card as dicts (slide, question, answer).
+    media are the names of the files the cards show, which are in mediaDir
+    (collection.media) for text decks and inside the package for .apkg
+    decks (mediaDir is None then). seconds is the wall time of the build;
+    the time per stage is in profile (see getTimings).
+    """
+
+    def __init__(self, deckPath, mediaDir, profile):
+        self.deckPath = deckPath
+        self.mediaDir = mediaDir
+        self.profile = profile
+        self.cards = []
+        self.media = []
+        self.renderedSlides = 0
+        self.unchangedSlides = 0
+        self.seconds = None
+
+    def getMediaPaths(self):
+        """Return the paths of the media files, or [] for packages."""
+        if self.mediaDir is None:
+            return []
+        return [os.path.join(self.mediaDir, name) for name in self.media]
+
+    def getTimings(self):
+        """Return {stage: {'count', 'seconds'}}, empty if not profiled."""
+        return getattr(self.profile, 'stages', {})
+
 # TODO: Verify that argument parsers does not offer a fancy way of accepting
 # paths while verifying that they exist or not, etc.
 
-def run(rawArgs=None):
-    argParser = A.ArgumentParser()
-    argParser.add_argument( 'notes',
-                            help = 'The notes for the lectures. For details on how to write notes, see: https://gist.github.com/musically-ut/5b5835c06470842cf752',
+def addCommonArguments(argParser):
+    """Add the options which apply to every deck, also in batch mode."""
+    argParser.add_argument( '-U', '--anki',
+                            help = 'The Anki Profile folder to use.',
                             type = str
                           )
 
-    argParser.add_argument( 'slides',
-                            help = 'The pdf slides for the same lecture.',
+    argParser.add_argument( '-f', '--force',
+                            help = 'Force overwriting files.',
+                            action = 'store_true'
+                          )
+
+    argParser.add_argument( '-j', '--jobs',
+                            help = 'The number of processes to render slides with (default: 1).',
+                            type = int,
+                            default = 1
+                          )
+
+    argParser.add_argument( '--crop-presets',
+                            help = 'An ini file whose [crops] section names crops to use in the notes like the built-in codes, e.g. "logo = [[80, 100], [0, 15]]" for Q_S[logo].',
                             type = str
                           )
 
-    argParser.add_argument( 'deck',
-                            help = 'The file to output the deck to.',
+    argParser.add_argument( '--writers',
+                            help = 'The number of threads which write slide images while the next slides are rendered (default: 4). More help if the Anki folder is on a slow (e.g. network) drive.',
+                            type = int,
+                            default = 4
+                          )
+
+    argParser.add_argument( '--max-memory',
+                            help = 'The memory in MB which rasterized slides may take, shared by all --jobs (default: no limit beyond a few pages). Fewer slides are kept around for their crops within the limit.',
+                            type = int
+                          )
+
+    argParser.add_argument( '--cache-dir',
+                            help = 'A folder in which rendered slides are kept across runs.',
                             type = str
                           )
 
-    argParser.add_argument( '-U', '--anki',
-                            help = 'The Anki Profile folder to use.',
+    argParser.add_argument( '--cache-size',
+                            help = 'The maximum size of the render cache in MB (default: 512).',
+                            type = int,
+                            default = 512
+                          )
+
+    argParser.add_argument( '--renderer',
+                            help = 'The program to rasterize slides with: wand (ImageMagick and Ghostscript, the default), pdftoppm (poppler) or mupdf (needs the PyMuPDF package). The latter two are much faster.',
+                            choices = sorted(RENDERERS),
+                            default = 'wand'
+                          )
+
+    argParser.add_argument( '--sharp-crops',
+                            help = 'Rasterize only the cropped part of a slide, so that a crop is as wide (and as sharp) as a whole slide instead of being cut out of it. Best used with the pdftoppm or mupdf renderers, which rasterize nothing but the crop.',
+                            action = 'store_true'
+                          )
+
+    argParser.add_argument( '--widths',
+                            help = 'The widths in pixels of the slide images, separated by commas (default: 640). With several, e.g. 480,960,1920, every slide is rasterized once and scaled to each width, and the cards show the one which suits the screen (with srcset); the first width is shown where srcset is not supported.',
+                            type = parseWidths
+                          )
+
+    argParser.add_argument( '--format',
+                            help = 'The image format of the slides (default: png). jpeg and webp files are much smaller for photos and gradients; png stays exact for text and line art.',
+                            choices = sorted(EXTENSIONS),
+                            default = 'png'
+                          )
+
+    argParser.add_argument( '--quality',
+                            help = 'The quality (1-100) of jpeg and webp slides (default: 85).',
+                            type = int
+                          )
+
+    argParser.add_argument( '--png-colors',
+                            help = 'Reduce png slides to a palette of this many colors (2-256), which makes them several times smaller.',
+                            type = int
+                          )
+
+    argParser.add_argument( '--png-compression',
+                            help = 'The zlib compression level (0-9) of png slides.',
+                            type = int
+                          )
+
+    argParser.add_argument( '--dedup-media',
+                            help = 'Name slide images by the hash of their content instead of by the prefix and slide, so that identical images (e.g. the question and the answer image of an uncropped slide, or slides shared by several lectures) are stored and synced only once. Unused images are left for Anki\'s Tools > Check Media to remove.',
+                            action = 'store_true'
+                          )
+
+def makeBuildArgs(notes, slides, deck, **options):
+    """Return the args of importSlides for a deck, with the defaults of the
+    command line for the options which are not given.
+
+    Options are named like the long command line options, with '_' for
+    '-' (e.g. prefix, anki, jobs, cache_dir, dedup_media); raises
+    InvalidOptionsError for any other name.
+    """
+    argParser = A.ArgumentParser()
+    addCommonArguments(argParser)
+    defaults = dict(vars(argParser.parse_args([])), prefix=None)
+    unknown = set(options) - set(defaults)
+    if unknown:
+        raise InvalidOptionsError('Unknown options: {0}.'.format(', '.join(sorted(unknown))))
+    defaults.update(options)
+    return A.Namespace(notes=notes, slides=slides, deck=deck, **defaults)
+
+def noLog(message):
+    pass
+
+def buildDeck(notes, slides, deck, pool=None, profile=None, log=None, **options):
+    """Make a deck from notes and pdf slides in this process and return a
+    DeckBuild; nothing is printed unless a log (e.g. print) is given.
+
+    deck is a text file for Anki's importer, for which anki (the Anki
+    profile folder) is needed, or an .apkg package. The other options are
+    those of the command line (see makeBuildArgs), with the same defaults.
+    To build many decks, pass the same pool of render processes (see
+    makeRenderPool) to each. Raises one of the subclasses of
+    SlidesImportError if the deck cannot be made.
+    """
+    args = makeBuildArgs(notes, slides, deck, **options)
+    profile = profile if profile is not None else Profile()
+    return importSlides(args, pool, profile, log=log if log is not None else noLog)
+
+def checkNotes(notesFilePaths, cropParser=None, out=None):
+    """Parse notes without rendering anything and write every error to out
+    (stderr by default), one per line as 'file:line: ...'; returns the
+    number of errors."""
+    out = out if out is not None else sys.stderr
+    errorCount = 0
+    for notesFilePath in notesFilePaths:
+        try:
+            with open(expandPath(notesFilePath), 'r') as notesFile:
+                errors = Parser.findErrors(notesFile, cropParser)
+        except (IOError, UnicodeDecodeError) as e:
+            print('{0}: cannot read the notes: {1}'.format(notesFilePath, e), file=out)
+            errorCount += 1
+            continue
+        for error in errors:
+            print('{0}:{1}: not a "Slide N:" line or a note under one: {2}'
+                  .format(notesFilePath, error.lineNumber, error.line.rstrip('\n')), file=out)
+        errorCount += len(errors)
+    return errorCount
+
+def runCheck(rawArgs):
+    """The --check mode of run: returns the exit status."""
+    argParser = A.ArgumentParser(description='Check notes files for errors without rendering any slides.')
+    argParser.add_argument( '--check',
+                            help = 'Only check the notes.',
+                            action = 'store_true'
+                          )
+
+    argParser.add_argument( 'notes',
+                            help = 'The notes files to check.',
+                            nargs = '+'
+                          )
+
+    argParser.add_argument( '--crop-presets',
+                            help = 'The crop presets which the notes use (see slides2anki -h).',
                             type = str
                           )
 
+    args = argParser.parse_args(rawArgs)
+    cropParser = None
+    if args.crop_presets is not None:
+        try:
+            cropParser = CropParser(loadCropPresets(expandPath(args.crop_presets)))
+        except (IOError, ValueError) as e:
+            print('Cannot read the crop presets: {0}'.format(e), file=sys.stderr)
+            return 1
+    return 1 if checkNotes(args.notes, cropParser) > 0 else 0
+
+def addRunOptions(argParser):
+    """Add the options of slides2anki besides the notes, slides and deck."""
     argParser.add_argument( '-P', '--prefix',
                             help = 'The prefix to use for the deck. Must be unique. ',
                             type = str
                           )
 
-    argParser.add_argument( '-f', '--force',
-                            help = 'Force overwriting files.',
+    addCommonArguments(argParser)
+
+    argParser.add_argument( '--profile-report',
+                            help = 'Write the time spent per stage and per slide, the bytes written and the peak memory to this JSON file.',
+                            type = str
+                          )
+
+    argParser.add_argument( '--check',
+                            help = 'Only check notes for errors, e.g. in a pre-commit hook: slides2anki --check NOTES [NOTES ...]. Every error is reported as file:line, nothing is rendered (nor ImageMagick loaded), and the exit status is 1 if there are errors.',
+                            action = 'store_true'
+                          )
+
+    argParser.add_argument( '--watch',
+                            help = 'After building the deck, keep the slides open and build it again whenever the notes or the slides are saved, rendering only the slides whose notes changed. Stop with Ctrl-C.',
+                            action = 'store_true'
+                          )
+
+    argParser.add_argument( '--cprofile',
+                            help = 'Write cProfile statistics of the main process to this file (see the pstats module).',
+                            type = str
+                          )
+
+    argParser.add_argument( '--tracemalloc',
+                            help = 'Trace the memory allocations of the main process and add the largest ones to the profile report.',
                             action = 'store_true'
                           )
 
-    if rawArgs is not None:
-        args = argParser.parse_args(rawArgs)
+def isCheckRun(rawArgs):
+    """Whether the arguments of run ask for --check; they are parsed, so
+    that e.g. a prefix or a notes file named --check does not count."""
+    argParser = A.ArgumentParser(usage=A.SUPPRESS, add_help=False)
+    addRunOptions(argParser)
+    args, _ = argParser.parse_known_args(rawArgs)
+    return args.check
+
+def run(rawArgs=None):
+    rawArgs = rawArgs if rawArgs is not None else sys.argv[1:]
+    # Checking takes neither slides nor a deck, but any number of notes.
+    if isCheckRun(rawArgs):
+        sys.exit(runCheck(rawArgs))
+
+    argParser = A.ArgumentParser()
+    argParser.add_argument( 'notes',
+                            help = 'The notes for the lectures. For details on how to write notes, see: https://gist.github.com/musically-ut/5b5835c06470842cf752',
+                            type = str
+                          )
+
+    argParser.add_argument( 'slides',
+                            help = 'The pdf slides for the same lecture.',
+                            type = str
+                          )
+
+    argParser.add_argument( 'deck',
+                            help = 'The file to output the deck to. If it ends in .apkg, an Anki package with the media in it is written instead of a text file, and no profile folder is needed.',
+                            type = str
+                          )
+
+    addRunOptions(argParser)
+
+    args = argParser.parse_args(rawArgs)
+
+    profile = Profile() if args.profile_report is not None else None
+    profiler = None
+    if args.cprofile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if args.tracemalloc:
+        import tracemalloc
+        tracemalloc.start()
+
+    try:
+        if args.watch:
+            watchSlides(args, profile=profile)
+        else:
+            importSlides(args, profile=profile)
+    except SlidesImportError as e:
+        print(e, file=sys.stderr)
+        sys.exit(-1)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(expandPath(args.cprofile))
+        if args.tracemalloc:
+            if profile is not None:
+                snapshot = tracemalloc.take_snapshot()
+                profile.extra['tracemalloc'] = {
+                    'peakBytes': tracemalloc.get_traced_memory()[1],
+                    'top': [{'where': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                            for stat in snapshot.statistics('lineno')[:20]]}
+            tracemalloc.stop()
+        if profile is not None:
+            profile.writeReport(expandPath(args.profile_report))
+
+
+def checkOptions(args):
+    """Check the options which apply to every deck, returning the
+    (mediaFormat, cropParser, widths) they give; raises InvalidOptionsError
+    or, for unreadable crop presets, SourceError."""
+    if args.jobs < 1:
+        raise InvalidOptionsError('The number of jobs must be at least 1.')
+
+    if args.writers < 1:
+        raise InvalidOptionsError('The number of writers must be at least 1.')
+
+    if args.max_memory is not None and args.max_memory < args.jobs:
+        raise InvalidOptionsError('The memory limit must be at least 1 MB per job.')
+
+    widths = args.widths or [DEFAULT_WIDTH]
+    if min(widths) < 1 or len(set(widths)) != len(widths):
+        raise InvalidOptionsError('The widths must be different numbers of pixels.')
+
+    try:
+        getRenderer(args.renderer)
+        mediaFormat = getMediaFormat(args)
+        cropParser = None
+        if args.crop_presets is not None:
+            cropParser = CropParser(loadCropPresets(expandPath(args.crop_presets)))
+    except ValueError as e:
+        raise InvalidOptionsError(str(e))
+    except IOError as e:
+        raise SourceError('Cannot read the crop presets: {0}'.format(e))
+
+    return mediaFormat, cropParser, widths
+
+def watchSlides(args, profile=None, pollInterval=0.15, builds=None):
+    """Build the deck, then build it again whenever the notes or the slides
+    are saved, until interrupted (or after `builds` builds).
+
+    The pdf stays open (and rasterized pages stay in memory) until the pdf
+    itself changes, and so does the pool of --jobs processes. Only the slides
+    whose cards changed are rendered again: text decks keep track of that
+    in their manifest; for packages, a render cache in a temporary folder
+    is used unless --cache-dir is given. Errors, e.g. in notes saved half
+    way through, are printed and the next save is waited for.
+    """
+    checkOptions(args)
+    notesFilePath = expandPath(args.notes)
+    slidesFilePath = expandPath(args.slides)
+    tmpCacheDir = None
+    pool = None
+    pdfPages = None
+    builtStamps = None
+    pendingStamps = None
+    try:
+        if args.cache_dir is None:
+            tmpCacheDir = tempfile.mkdtemp(prefix='slides-watch-')
+            args = A.Namespace(**dict(vars(args), cache_dir=tmpCacheDir))
+        renderOptions = getRenderOptions(args)
+        pool = makeRenderPool(args.jobs, renderOptions) if args.jobs > 1 else None
+
+        while builds is None or builds > 0:
+            stamps = (getFileStamp(notesFilePath), getFileStamp(slidesFilePath))
+            # Editors may save a file in several steps, so the files are
+            # only read once they have not changed for one poll.
+            if stamps == builtStamps or stamps != pendingStamps:
+                pendingStamps = stamps
+                time.sleep(pollInterval)
+                continue
+
+            start = time.time()
+            try:
+                if pdfPages is not None and builtStamps is not None and builtStamps[1] != stamps[1]:
+                    pdfPages.close()
+                    pdfPages = None
+                if pdfPages is None:
+                    pdfPages = openPdfPages(slidesFilePath, profile, **renderOptions)
+                importSlides(args, pool, profile, pdfPages)
+                print('Deck built in {0:.2f}s.'.format(time.time() - start))
+            except SlidesImportError as e:
+                print(e, file=sys.stderr)
+            except IOError as e:
+                print('Error while reading the slides: \n{0}'.format(e), file=sys.stderr)
+            builtStamps = stamps
+            if builds is not None:
+                builds -= 1
+            print('Watching {0} and {1} for changes (Ctrl-C to stop) ...'.format(args.notes, args.slides))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pdfPages is not None:
+            pdfPages.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if tmpCacheDir is not None:
+            shutil.rmtree(tmpCacheDir)
+
+def quoteField(field, isText):
+    """Quote the plain text fields of a deck text file."""
+    return '"{0}"'.format(field) if isText else field
+
+def getCardMediaNames(card, prefix, extension):
+    """Return the names of the question and the answer media of a card; the
+    name is '' if a side has no slide."""
+    questionMediaFileName = ''
+    if card.questionKind in ('Q_S', 'S_Q'):
+        questionMediaFileName = getMediaName(prefix + '-question', card.slideNum, extension)
+    # For now, we leave this without an '-answer' suffix for backwards compatibility
+    answerMediaFileName = getMediaName(prefix, card.slideNum, extension)
+    if card.answerKind == 'A':
+        answerMediaFileName = ''
+    return questionMediaFileName, answerMediaFileName
+
+def makeCardFields(card, questionImageTag, answerImageTag):
+    """Return (question, questionIsText, answer, answerIsText) of a card
+    showing the given <img> tags (see makeImageTag)."""
+    # Question without slide
+    if card.questionKind == 'Q':
+        question, questionIsText = card.question, True
+    # Question followed by slide
+    elif card.questionKind == 'Q_S':
+        question, questionIsText = '<div>{0}</div>{1}'.format(card.question, questionImageTag), False
+    # Slide followed by question
+    elif card.questionKind == 'S_Q':
+        question, questionIsText = '{0}<div>{1}</div>'.format(questionImageTag, card.question), False
+    # Otherwise fall back to default behaviour
     else:
-        args = argParser.parse_args()
+        question, questionIsText = card.fullNotes, True
 
+    # Answer without slide
+    if card.answerKind == 'A':
+        answer, answerIsText = card.answer, True
+    # Answer followed by slide
+    elif card.answerKind == 'A_S':
+        answer, answerIsText = '<div>{0}</div>{1}'.format(card.answer, answerImageTag), False
+    # Slide followed by answer
+    elif card.answerKind == 'S_A':
+        answer, answerIsText = '{0}<div>{1}</div>'.format(answerImageTag, card.answer), False
+    # Otherwise fall back to default behaviour
+    else:
+        answer, answerIsText = answerImageTag, False
+
+    return question, questionIsText, answer, answerIsText
+
+def importSlides(args, pool=None, profile=None, pdfPages=None, log=print):
+    """Make the deck described by args (as parsed by run) and return a
+    DeckBuild; progress is reported by calling log with a message.
+
+    If a pool (see makeRenderPool) is given, the slides are rendered with
+    it instead of with a pool of args.jobs processes. Timings are recorded
+    in profile (a profiling.Profile), if one is given. The slides are
+    rendered from pdfPages (as returned by openPdfPages) if it is given,
+    which is left open then.
+    """
+    start = time.time()
+    profile = profile if profile is not None else NullProfile()
+    deckFilePath = expandPath(args.deck)
+    apkg = isApkgPath(deckFilePath)
 
     #########################################################################
 
-    print('Verifying arguments ...')
+    log('Verifying arguments ...')
 
-    # Check for existence of user folder first
-    if args.anki is None:
-        print('Giving a User folder is necessary.', file=sys.stderr)
-        print('Requirement will soon be removed.', file=sys.stderr)
-        sys.exit(-1)
+    # An Anki package carries its media, so it needs no user folder.
+    collectionMediaPath = None
+    if not apkg:
+        # Check for existence of user folder first
+        if args.anki is None:
+            raise InvalidOptionsError('Giving a User folder is necessary.\n'
+                                    'Requirement will soon be removed.')
 
-    ankiPath = os.path.expanduser(args.anki)
+        ankiPath = os.path.expanduser(args.anki)
 
-    if not os.path.isdir(ankiPath):
-        print('Folder: {} does not exist.'.format(ankiPath), file=sys.stderr)
-        sys.exit(-1)
+        if not os.path.isdir(ankiPath):
+            raise InvalidOptionsError('Folder: {} does not exist.'.format(ankiPath))
 
-    collectionMediaPath = os.path.join(ankiPath, 'collection.media')
-    if not os.path.isdir(collectionMediaPath):
-        print('Folder: {} does not exist.'.format(collectionMediaPath), file=sys.stderr)
-        print('Is "{}" the path to a user profile?'.format(ankiPath), file=sys.stderr)
-        sys.exit(-1)
+        collectionMediaPath = os.path.join(ankiPath, 'collection.media')
+        if not os.path.isdir(collectionMediaPath):
+            raise InvalidOptionsError('Folder: {} does not exist.\n'
+                                    'Is "{}" the path to a user profile?'.format(collectionMediaPath, ankiPath))
 
-    print('Done.')
+    mediaFormat, cropParser, widths = checkOptions(args)
+
+    log('Done.')
 
 
     #########################################################################
 
-    print('Reading files ...')
+    log('Reading files ...')
     try:
-        notesFilePath = os.path.expandvars(os.path.expanduser(args.notes))
-        notes = Parser(open(notesFilePath, 'r')).getNotesAndCropsParsing()
-        pdfPages = PdfPages(os.path.expandvars(os.path.expanduser(args.slides)))
+        notesFilePath = expandPath(args.notes)
+        with profile.stage('parse'):
+            with open(notesFilePath, 'r') as notesFile:
+                cards = Parser(notesFile, cropParser).getSlideCards()
+        slidesFilePath = expandPath(args.slides)
+        renderOptions = getRenderOptions(args)
+        ownPdfPages = pdfPages is None
+        if ownPdfPages:
+            with profile.stage('open'):
+                pdfPages = openPdfPages(slidesFilePath, profile, **renderOptions)
     except IOError as e:
-        print("Error while reading source files: ", file=sys.stderr)
-        print(e, file=sys.stderr)
-        sys.exit(-1)
+        raise SourceError('Error while reading source files: \n{0}'.format(e))
     except ParseException as e:
-        print("Parsing error:", file=sys.stderr)
-        print(e.message, file=sys.stderr)
-        sys.exit(-1)
+        raise NotesError('Parsing error:\n{0}'.format(e), e.lineNumber, e.line)
+
+    log('Done reading files.')
+
+    # The pdf is closed however the build ends, unless it was given.
+    try:
+        #######################################################################
+        # Determine if any file be overwritten
+        #######################################################################
+
+        prefix = args.prefix or os.path.basename(args.slides)
+        manifestFilePath = getManifestPath(deckFilePath)
+        previousManifest = None if apkg else loadManifest(manifestFilePath)
+        # Files written by a previous run for this deck are ours to overwrite.
+        previousMediaNames = getPreviousMediaNames(previousManifest)
+        extension = mediaFormat.getExtension()
+        # Media named by their content can be overwritten by identical ones.
+        if not args.force and not apkg and not args.dedup_media:
+            for card in cards:
+                slideNum = card.slideNum
+                # For now, we leave the answer without an '-answer' suffix for backwards compatibility
+                for mediaName in [getMediaName(prefix + '-question', str(slideNum), extension),
+                                  getMediaName(prefix, str(slideNum), extension)]:
+                    for _, variantName in getMediaVariants(mediaName, widths):
+                        mediaFilePath = os.path.join(collectionMediaPath, variantName)
+                        if variantName not in previousMediaNames and os.path.exists(mediaFilePath):
+                            raise MediaConflictError('File "{}" already exists. Choose a different prefix (using --prefix) or use -f to overwrite the files.'.format(mediaFilePath),
+                                                     mediaFilePath)
+
+
+        #######################################################################
+        # Operation begins, potentially destructive changes beyond this point
+        #######################################################################
 
-    print('Done reading files.')
-
-    #######################################################################
-    # Determine if any file be overwritten
-    #######################################################################
-
-    prefix = args.prefix or os.path.basename(args.slides)
-    if not args.force:
-        for slideNum in notes.fullNotes:
-            questionMediaFileName = getMediaPath(collectionMediaPath, prefix + '-question', str(slideNum))
-            # For now, we leave this without an '-answer' suffix for backwards compatibility
-            answerMediaFileName = getMediaPath(collectionMediaPath, prefix, str(slideNum))
-            if os.path.exists(questionMediaFileName):
-                print('File "{}" already exists. Choose a different prefix (using --prefix) or use -f to overwrite the files.'.format(questionMediaFileName), file=sys.stderr)
-                sys.exit(-1)
-            if os.path.exists(answerMediaFileName):
-                print('File "{}" already exists. Choose a different prefix (using --prefix) or use -f to overwrite the files.'.format(answerMediaFileName), file=sys.stderr)
-                sys.exit(-1)
-
-
-    #######################################################################
-    # Operation begins, potentially destructive changes beyond this point
-    #######################################################################
-
-    print('Starting extraction ...')
-
-    deckFilePath = os.path.expandvars(os.path.expanduser(args.deck))
-    outputDeckFile = open(deckFilePath, 'w')
-
-    for slideNum, qs in notes.fullNotes.items():
-        questionMediaFilePath = ''
-        questionMediaFileName = ''
-        answerMediaFilePath = getMediaPath(collectionMediaPath, prefix, slideNum)
-        answerMediaFileName = getMediaName(prefix, slideNum)
-        questionCropPercentValues = [[0,100], [0,100]]
-        answerCropPercentValues = [[0,100], [0,100]]
-        outputString = ''
-
-        # If the "question without slide" dict entry is not empty, write that
-        if notes.questionsWithoutSlides[slideNum] != '':
-            outputString += '"{0}"; '.format(notes.questionsWithoutSlides[slideNum])
-        # Otherwise try "question followed by slide"
-        elif notes.questionsFollowedBySlides[slideNum] != '':
-            questionMediaFilePath = getMediaPath(collectionMediaPath, prefix + '-question', slideNum)
-            questionMediaFileName = getMediaName(prefix + '-question', slideNum)
-            outputString += '<div>{0}</div><img src="{1}" />; '.format(notes.questionsFollowedBySlides[slideNum], questionMediaFileName)
-            if notes.questionsFollowedBySlidesCrops[slideNum] != []:
-                questionCropPercentValues = notes.questionsFollowedBySlidesCrops[slideNum]
-        # Otherwise try "slide followed by question"
-        elif notes.slidesFollowedByQuestions[slideNum] != '':
-            questionMediaFilePath = getMediaPath(collectionMediaPath, prefix + '-question', slideNum)
-            questionMediaFileName = getMediaName(prefix + '-question', slideNum)
-            outputString += '<img src="{0}" /><div>{1}</div>; '.format(questionMediaFileName, notes.slidesFollowedByQuestions[slideNum])
-            if notes.slidesFollowedByQuestionsCrops[slideNum] != []:
-                questionCropPercentValues = notes.slidesFollowedByQuestionsCrops[slideNum]
-        # Otherwise fall back to default behaviour
+        log('Starting extraction ...')
+
+        if apkg:
+            # Media are named as in collection.media, but go into the package.
+            apkgWriter = ApkgWriter(deckFilePath, prefix)
+            manifest = None
+            mediaDir = ''
         else:
-            outputString += '"{0}"; '.format(qs)
-
-        # If the "answer without slide" dict entry is not empty, write that
-        if notes.answersWithoutSlides[slideNum] != '':
-            outputString += '"{0}"\n'.format(notes.answersWithoutSlides[slideNum])
-            answerMediaFileName = ''
-        # Otherwise try "answer followed by slide"
-        elif notes.answersFollowedBySlides[slideNum] != '':
-            outputString += '<div>{0}</div><img src="{1}" />\n'.format(notes.answersFollowedBySlides[slideNum], answerMediaFileName)
-            if notes.answersFollowedBySlidesCrops[slideNum] != []:
-                answerCropPercentValues = notes.answersFollowedBySlidesCrops[slideNum]
-        # Otherwise try "slide followed by answer"
-        elif notes.slidesFollowedByAnswers[slideNum] != '':
-            outputString += '<img src="{0}" /><div>{1}</div>\n'.format(answerMediaFileName, notes.slidesFollowedByAnswers[slideNum])
-            if notes.slidesFollowedByAnswersCrops[slideNum] != []:
-                answerCropPercentValues = notes.slidesFollowedByAnswersCrops[slideNum]
-        # Otherwise fall back to default behaviour
+            apkgWriter = None
+            manifest = makeManifest(pdfPages.getPdfHash(), prefix,
+                                    {'renderer': args.renderer, 'sharpCrops': args.sharp_crops,
+                                     'format': mediaFormat.getKey(), 'dedupMedia': args.dedup_media,
+                                     'widths': widths})
+            mediaDir = collectionMediaPath
+        slideJobs = []
+        upToDateSlides = 0
+        # The (width, media name) variants of the question and answer media of
+        # every card, and the names and hashes of the files they are stored in
+        # (which differ with --dedup-media).
+        cardMedia = []
+        storedMedia = {}
+
+        for card in cards:
+            slideNum = card.slideNum
+            questionMediaFileName, answerMediaFileName = getCardMediaNames(card, prefix, extension)
+            questionCropPercentValues = card.questionCrop or [[0,100], [0,100]]
+            answerCropPercentValues = card.answerCrop or [[0,100], [0,100]]
+            questionVariants = getMediaVariants(questionMediaFileName, widths)
+            answerVariants = getMediaVariants(answerMediaFileName, widths)
+            cardMedia.append((card, questionVariants, answerVariants))
+
+            # Queue the slides to save
+            mediaJobs = []
+            for width, mediaName in questionVariants:
+                mediaJobs.append((questionCropPercentValues, os.path.join(mediaDir, mediaName), width))
+            for width, mediaName in answerVariants:
+                mediaJobs.append((answerCropPercentValues, os.path.join(mediaDir, mediaName), width))
+
+            if manifest is None:
+                slideJobs.append((slidesFilePath, slideNum, mediaJobs))
+                continue
+
+            # Only render the slide again if its notes, crops or media changed
+            # since the previous run.
+            record = makeSlideRecord(card, mediaJobs)
+            if isSlideUpToDate(previousManifest, manifest, slideNum, record, collectionMediaPath):
+                record = previousManifest['slides'][str(slideNum)]
+                for media in record['media']:
+                    storedMedia[media['name']] = (getMediaFileName(media), media['sha256'])
+                upToDateSlides += 1
+            else:
+                slideJobs.append((slidesFilePath, slideNum, mediaJobs))
+            manifest['slides'][str(slideNum)] = record
+
+        if upToDateSlides > 0:
+            log('{0} slides are unchanged, rendering {1} slides.'.format(upToDateSlides, len(slideJobs)))
+
+        # Slides are rendered (and encoded) in this process or by the pool while
+        # the writer threads save the media of the slides before them.
+        mediaWriter = None if apkg else MediaWriter(args.writers, profile=profile)
+        writtenNames = set()
+
+        def storeMedia(slideNum, media):
+            for mediaFilePath, data in media:
+                mediaName = os.path.basename(mediaFilePath)
+                storedName = getDedupMediaName(data, extension) if args.dedup_media else mediaName
+                storedMedia[mediaName] = (storedName, hashlib.sha256(data).hexdigest())
+                if apkgWriter is not None:
+                    apkgWriter.addMedia(storedName, data)
+                # Identical media named by their content are written once.
+                elif storedName not in writtenNames:
+                    writtenNames.add(storedName)
+                    mediaWriter.put(os.path.join(collectionMediaPath, storedName), data,
+                                    keepExisting=args.dedup_media, slideNum=slideNum)
+
+        # The 'render' stage is the wall time of rendering all slides and saving
+        # their media; the stages inside it are summed over the worker processes
+        # and writer threads.
+        try:
+            with profile.stage('render'):
+                if pool is not None or args.jobs > 1:
+                    ownPool = pool is None
+                    if ownPool:
+                        pool = makeRenderPool(args.jobs, renderOptions)
+                    try:
+                        # imap keeps the order of the slides.
+                        for (_, slideNum, _), (slideProfile, media) in \
+                                zip(slideJobs, pool.imap(renderSlideInWorker, slideJobs)):
+                            profile.mergeSlides(slideProfile)
+                            storeMedia(slideNum, media)
+                    finally:
+                        if ownPool:
+                            pool.close()
+                            pool.join()
+                else:
+                    for _, slideNum, mediaJobs in slideJobs:
+                        storeMedia(slideNum, encodeSlideMedia(pdfPages, slideNum, mediaJobs, profile))
+                if mediaWriter is not None:
+                    mediaWriter.close()
+        except BaseException as e:
+            if apkgWriter is not None:
+                apkgWriter.abort()
+            if mediaWriter is not None:
+                # Stop the threads; the original error is the one to report.
+                try:
+                    mediaWriter.close()
+                except Exception:
+                    pass
+            if isinstance(e, IOError):
+                raise RenderError('Error while rendering or saving the slides: \n{0}'.format(e))
+            raise
+    finally:
+        if ownPdfPages:
+            pdfPages.close()
+
+    build = DeckBuild(deckFilePath, collectionMediaPath, profile)
+    build.renderedSlides = len(slideJobs)
+    build.unchangedSlides = upToDateSlides
+
+    # Write deck output
+    outputDeckFile = None
+    try:
+        if not apkg:
+            outputDeckFile = open(deckFilePath, 'w')
+        for card, questionVariants, answerVariants in cardMedia:
+            if args.dedup_media:
+                questionVariants = [(width, storedMedia[name][0]) for width, name in questionVariants]
+                answerVariants = [(width, storedMedia[name][0]) for width, name in answerVariants]
+            question, questionIsText, answer, answerIsText = \
+                makeCardFields(card, makeImageTag(questionVariants) if questionVariants else '',
+                               makeImageTag(answerVariants) if answerVariants else '')
+            build.cards.append({'slide': card.slideNum, 'question': question, 'answer': answer})
+            if apkgWriter is not None:
+                apkgWriter.addNote('{0}-{1}'.format(prefix, card.slideNum), question, answer)
+            else:
+                outputDeckFile.write('{0}; {1}\n'.format(quoteField(question, questionIsText),
+                                                         quoteField(answer, answerIsText)))
+
+        if apkgWriter is not None:
+            apkgWriter.close()
         else:
-            outputString += '<img src="{0}" />\n'.format(answerMediaFileName)
+            outputDeckFile.close()
+    except BaseException as e:
+        if apkgWriter is not None:
+            apkgWriter.abort()
+        elif outputDeckFile is not None:
+            outputDeckFile.close()
+        if isinstance(e, IOError):
+            raise OutputError('Cannot write the deck {0}: \n{1}'.format(deckFilePath, e))
+        raise
+    profile.addBytesWritten(os.path.getsize(deckFilePath))
+    build.media = sorted(set(storedName for storedName, _ in storedMedia.values()))
+
+    if apkgWriter is not None:
+        build.seconds = time.time() - start
+        return build
+
+    # Record the hashes of the freshly written media
+    for _, slideNum, mediaJobs in slideJobs:
+        for media in manifest['slides'][str(slideNum)]['media']:
+            storedName, media['sha256'] = storedMedia[media['name']]
+            if args.dedup_media:
+                media['file'] = storedName
+
+    # Remove the media of slides which are no longer in the notes
+    for mediaName in previousMediaNames - getPreviousMediaNames(manifest):
+        mediaFilePath = os.path.join(collectionMediaPath, mediaName)
+        if os.path.exists(mediaFilePath):
+            os.remove(mediaFilePath)
+
+    saveManifest(manifestFilePath, manifest)
+    build.seconds = time.time() - start
+    return build
+
+
+class TestBuildDeck(unittest.TestCase):
+    slidesFilePath = './slidesimport/test/Veg-food-in-Japan.pdf'
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.ankiPath = os.path.join(self.tmpDir, 'profile')
+        os.makedirs(os.path.join(self.ankiPath, 'collection.media'))
+        self.notesFilePath = self.write('notes.txt', 'Slide 1:\n    Q: Question\n    A: Answer\n\n'
+                                                     'Slide 12:\n    Q: Which slide?\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def testPackage(self):
+        deckFilePath = os.path.join(self.tmpDir, 'deck.apkg')
+        build = buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath, prefix='lecture')
+
+        self.assertTrue(os.path.exists(deckFilePath))
+        self.assertEqual([card['slide'] for card in build.cards], [1, 12])
+        self.assertEqual(build.cards[0]['answer'], 'Answer')
+        self.assertEqual(build.media, ['lecture-12.png'])
+        self.assertEqual(build.getMediaPaths(), [])
+        self.assertEqual(build.renderedSlides, 2)
+        self.assertIn('parse', build.getTimings())
+
+    def testTextDeck(self):
+        deckFilePath = os.path.join(self.tmpDir, 'deck.txt')
+        build = buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath,
+                          anki=self.ankiPath, prefix='lecture')
+        mediaFilePath = os.path.join(self.ankiPath, 'collection.media', 'lecture-12.png')
+        self.assertEqual(build.getMediaPaths(), [mediaFilePath])
+        self.assertTrue(os.path.exists(mediaFilePath))
+
+        build = buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath,
+                          anki=self.ankiPath, prefix='lecture')
+        self.assertEqual((build.renderedSlides, build.unchangedSlides), (0, 2))
+        self.assertEqual(build.getMediaPaths(), [mediaFilePath])
+
+        # Without the manifest, the media are no longer known to be ours.
+        os.remove(getManifestPath(deckFilePath))
+        with self.assertRaises(MediaConflictError) as context:
+            buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath,
+                      anki=self.ankiPath, prefix='lecture')
+        self.assertEqual(context.exception.path, mediaFilePath)
+
+    def testWidths(self):
+        deckFilePath = os.path.join(self.tmpDir, 'deck.txt')
+        profile = Profile()
+        build = buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath, profile=profile,
+                          anki=self.ankiPath, prefix='lecture', widths=[960, 480, 1920])
+
+        self.assertEqual(build.media, ['lecture-12-1920w.png', 'lecture-12-480w.png', 'lecture-12-960w.png'])
+        self.assertEqual(build.cards[1]['answer'],
+                         '<img src="lecture-12-960w.png" srcset="lecture-12-960w.png 960w, '
+                         'lecture-12-480w.png 480w, lecture-12-1920w.png 1920w" />')
+        # All widths come from one rasterization.
+        self.assertEqual(profile.stages['rasterize']['count'], 1)
+        with self.assertRaises(InvalidOptionsError):
+            buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath,
+                      anki=self.ankiPath, prefix='lecture', widths=[480, 480])
+
+    def testDedupMedia(self):
+        # Two decks from the same slides share their media.
+        builds = [buildDeck(self.notesFilePath, self.slidesFilePath, os.path.join(self.tmpDir, name + '.txt'),
+                            anki=self.ankiPath, prefix=name, dedup_media=True)
+                  for name in ('first', 'second')]
+        self.assertEqual(builds[0].media, builds[1].media)
+        self.assertEqual(len(builds[0].media), 1)
+        self.assertEqual(os.listdir(os.path.join(self.ankiPath, 'collection.media')), builds[0].media)
+
+    def testJobs(self):
+        # Rendering in worker processes gives the very same deck and media.
+        notesFilePath = self.write('jobs.txt', ''.join('Slide {0}:\n    Q: Slide {0}?\n\n'.format(slideNum)
+                                                        for slideNum in range(1, 7)))
+        contents = []
+        for jobs in (1, 2):
+            ankiPath = os.path.join(self.tmpDir, 'profile-{0}'.format(jobs))
+            mediaPath = os.path.join(ankiPath, 'collection.media')
+            os.makedirs(mediaPath)
+            deckFilePath = os.path.join(self.tmpDir, 'deck-{0}.txt'.format(jobs))
+            build = buildDeck(notesFilePath, self.slidesFilePath, deckFilePath,
+                              anki=ankiPath, prefix='lecture', jobs=jobs)
+            self.assertEqual(len(build.media), 6)
+            files = {}
+            for name, path in [('deck', deckFilePath)] + \
+                              [(name, os.path.join(mediaPath, name)) for name in build.media]:
+                with open(path, 'rb') as f:
+                    files[name] = f.read()
+            contents.append(files)
+        self.assertEqual(contents[0], contents[1])
+
+    def testPackageOutputError(self):
+        # The package cannot replace a folder; nothing of it is left behind.
+        deckFilePath = os.path.join(self.tmpDir, 'deck.apkg')
+        os.mkdir(deckFilePath)
+        with self.assertRaises(OutputError):
+            buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath, prefix='lecture')
+        self.assertEqual(sorted(os.listdir(self.tmpDir)), ['deck.apkg', 'notes.txt', 'profile'])
+
+    def testErrors(self):
+        deckFilePath = os.path.join(self.tmpDir, 'deck.txt')
+        with self.assertRaises(InvalidOptionsError):
+            buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath)
+        with self.assertRaises(InvalidOptionsError):
+            buildDeck(self.notesFilePath, self.slidesFilePath, deckFilePath,
+                      anki=self.ankiPath, colour='red')
+        with self.assertRaises(SourceError):
+            buildDeck(os.path.join(self.tmpDir, 'missing.txt'), self.slidesFilePath, deckFilePath,
+                      anki=self.ankiPath)
+        with self.assertRaises(NotesError) as context:
+            buildDeck(self.write('bad.txt', 'Not a slide line\n'), self.slidesFilePath, deckFilePath,
+                      anki=self.ankiPath)
+        self.assertEqual(context.exception.lineNumber, 1)
+
+
+class TestRenderWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        initRenderWorker({'renderer': 'wand'})
+
+    def tearDown(self):
+        for _, pdfPages in workerPdfPages.values():
+            pdfPages.close()
+        workerPdfPages.clear()
+        shutil.rmtree(self.tmpDir)
+
+    def testPdfsStayOpen(self):
+        slidesFilePaths = []
+        for idx in range(WORKER_OPEN_PDFS + 1):
+            slidesFilePaths.append(os.path.join(self.tmpDir, '{0}.pdf'.format(idx)))
+            shutil.copy(TestBuildDeck.slidesFilePath, slidesFilePaths[-1])
+        mediaJobs = [([[0, 100], [0, 100]], os.path.join(self.tmpDir, 'slide.png'), DEFAULT_WIDTH)]
+
+        # Slides of two decks built at the same time.
+        for slideNum in (1, 2, 3):
+            for slidesFilePath in slidesFilePaths[:2]:
+                renderSlideInWorker((slidesFilePath, slideNum, mediaJobs))
+        opened = dict((path, workerPdfPages[path][1]) for path in slidesFilePaths[:2])
+        renderSlideInWorker((slidesFilePaths[0], 4, mediaJobs))
+        self.assertIs(workerPdfPages[slidesFilePaths[0]][1], opened[slidesFilePaths[0]])
+
+        # Only the most recently used ones are kept.
+        for slidesFilePath in slidesFilePaths[1:]:
+            renderSlideInWorker((slidesFilePath, 1, mediaJobs))
+        self.assertEqual(list(workerPdfPages), slidesFilePaths[1:])
+        self.assertIs(workerPdfPages[slidesFilePaths[1]][1], opened[slidesFilePaths[1]])
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testCheckNotes(self):
+        goodFilePath = os.path.join(self.tmpDir, 'good.txt')
+        badFilePath = os.path.join(self.tmpDir, 'bad.txt')
+        with open(goodFilePath, 'w') as f:
+            f.write('Slide 1:\n    Q: Question\n')
+        with open(badFilePath, 'w') as f:
+            f.write('Slide 1:\n    Q: Question\nNot a slide line\nNor this one\n')
+
+        out = StringIO()
+        self.assertEqual(checkNotes([goodFilePath, badFilePath, os.path.join(self.tmpDir, 'missing.txt')],
+                                    out=out), 3)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(badFilePath + ':3: '))
+        self.assertTrue(lines[1].startswith(badFilePath + ':4: '))
+        self.assertIn('missing.txt', lines[2])
+        self.assertEqual(checkNotes([goodFilePath], out=out), 0)
+
+    def testCheckDoesNotLoadWand(self):
+        notesFilePath = os.path.join(self.tmpDir, 'notes.txt')
+        with open(notesFilePath, 'w') as f:
+            f.write('Slide 1:\n    Q: Question\n')
+        code = ('import sys\n'
+                'from slidesimport import slidesimport\n'
+                'status = slidesimport.runCheck(sys.argv[1:])\n'
+                'sys.exit(status or "wand" in sys.modules)\n')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code, '--check', notesFilePath]), 0)
+
+    def testCheckRun(self):
+        self.assertTrue(isCheckRun(['--check', 'notes.txt', 'more-notes.txt']))
+        self.assertTrue(isCheckRun(['notes.txt', '--check', '--crop-presets', 'presets.json']))
+        self.assertFalse(isCheckRun(['notes.txt', 'slides.pdf', 'deck.txt', '--prefix=--check']))
+        self.assertFalse(isCheckRun(['notes.txt', 'slides.pdf', 'deck.txt', '--profile-report=--check']))
+        self.assertFalse(isCheckRun(['slides.pdf', 'deck.txt', '--', '--check']))
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.ankiPath = os.path.join(self.tmpDir, 'profile')
+        os.makedirs(os.path.join(self.ankiPath, 'collection.media'))
+        self.notesFilePath = os.path.join(self.tmpDir, 'notes.txt')
+        self.deckFilePath = os.path.join(self.tmpDir, 'deck.txt')
+        with open(self.notesFilePath, 'w') as f:
+            f.write('Slide 12:\n    Q: First question\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def readDeck(self):
+        if not os.path.exists(self.deckFilePath):
+            return ''
+        with open(self.deckFilePath, 'r') as f:
+            return f.read()
+
+    def testRebuildsOnSave(self):
+        args = makeBuildArgs(self.notesFilePath, TestBuildDeck.slidesFilePath, self.deckFilePath,
+                             anki=self.ankiPath, prefix='lecture')
+        watcher = threading.Thread(target=watchSlides, args=(args,),
+                                   kwargs={'pollInterval': 0.01, 'builds': 2})
+        watcher.start()
+        for _ in range(500):
+            if 'First question' in self.readDeck():
+                break
+            time.sleep(0.01)
+        self.assertIn('First question', self.readDeck())
 
-        # Write deck file output
-        outputDeckFile.write(outputString)
+        with open(self.notesFilePath, 'w') as f:
+            f.write('Slide 12:\n    Q: The second question\n')
+        watcher.join(10)
 
-        # Save question slide if necessary
-        if questionMediaFilePath != '':
-            pdfPages.getCroppedPageAsPng(slideNum, questionCropPercentValues).save(filename=questionMediaFilePath)
+        self.assertFalse(watcher.is_alive())
+        self.assertIn('The second question', self.readDeck())
 
-        # Save answer slide if necessary
-        if answerMediaFilePath != '':
-            pdfPages.getCroppedPageAsPng(slideNum, answerCropPercentValues).save(filename=answerMediaFilePath)
+    def testInvalidOptions(self):
+        args = makeBuildArgs(self.notesFilePath, TestBuildDeck.slidesFilePath, self.deckFilePath,
+                             anki=self.ankiPath, format='jpeg', png_colors=16)
+        with self.assertRaises(InvalidOptionsError):
+            watchSlides(args, builds=1)